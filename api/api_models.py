@@ -46,3 +46,133 @@ class NormalizeRoleResponse(RxsmilesRequest):
             "[O:1]=[C:2]1[C:6]2([CH2:11][CH2:10][NH:9][CH2:8][CH2:7]2)[N:5]([C:12]2[CH:17]=[CH:16][CH:15]=[CH:14][CH:13]=2)[CH2:4][N:3]1[CH2:18][C:19]1[CH:31]=[CH:30][CH:29]=[CH:28][C:20]=1[C:21]([O:23][C:24]([CH3:27])([CH3:26])[CH3:25])=[O:22].Cl[CH2:41][CH2:42][CH2:43][N:44]1[C:52]2[C:47](=[CH:48][CH:49]=[CH:50][CH:51]=2)[C:46]([CH3:54])([CH3:53])[C:45]1=[O:55]>[K+].[K+].C(=O)([O-])[O-].CC(=O)CC.[Na+].[I-]>[CH3:54][C:46]1([CH3:53])[C:47]2[C:52](=[CH:51][CH:50]=[CH:49][CH:48]=2)[N:44]([CH2:43][CH2:42][CH2:41][N:9]2[CH2:8][CH2:7][C:6]3([N:5]([C:12]4[CH:13]=[CH:14][CH:15]=[CH:16][CH:17]=4)[CH2:4][N:3]([CH2:18][C:19]4[CH:31]=[CH:30][CH:29]=[CH:28][C:20]=4[C:21]([O:23][C:24]([CH3:27])([CH3:25])[CH3:26])=[O:22])[C:2]3=[O:1])[CH2:11][CH2:10]2)[C:45]1=[O:55] |f:2.3.4,6.7|"
         ],
     )
+
+
+class NormalizeRoleBatchRequest(BaseModel):
+    rxsmiles: List[str] = Field(
+        ...,
+        title="RXSMILES",
+        description="Atom mapped reaction SMILES to normalize the roles of",
+        examples=[["[CH3:1][OH:2].[Na+].[Cl-]>>[CH3:1]Cl |f:1.2|"]],
+    )
+    stream: bool = Field(
+        default=False,
+        description="Stream the results as NDJSON (one result per line) in the order they complete, instead of "
+        "returning all of them at once in request order",
+    )
+
+
+class NormalizeRoleResult(BaseModel):
+    index: int = Field(..., description="Position of the reaction in the request")
+    original_rxsmiles: str = Field(..., description="The reaction SMILES, as given in the request")
+    rxsmiles: Optional[str] = Field(default=None, description="The normalized reaction SMILES")
+    error: Optional[str] = Field(default=None, description="Reason the roles could not be normalized, if any")
+    error_type: Optional[str] = Field(
+        default=None,
+        description="Kind of error, e.g. 'RxsmilesAtomMappingException' or 'FragmentGroupError'",
+    )
+
+
+class NormalizeRoleBatchResponse(BaseModel):
+    results: List[NormalizeRoleResult] = Field(default_factory=list, description="One result per reaction, in request order")
+
+
+##########################
+# Render Models
+##########################
+
+class RenderFormat(str, Enum):
+    json = "json"  # SVG wrapped in a JSON object, optionally base64 encoded
+    svg = "svg"  # Raw image/svg+xml
+    png = "png"  # Raw image/png
+
+
+class RenderItem(BaseModel):
+    id: str = Field(..., description="Identifier of the item, used to key the result (e.g. the node label)", examples=["node_1"])
+    kind: Literal["molecule", "reaction"] = Field(default="molecule", description="Whether 'smiles' is a molecule SMILES or a reaction SMILES")
+    smiles: str = Field(..., description="Molecule SMILES or RXSMILES to draw", examples=["Cc1cc(Br)cc(C)c1C1C(=O)CCC1=O"])
+    highlight: bool = Field(default=True, description="Reactions only: highlight atoms based on atom mapping")
+    show_atom_indices: bool = Field(default=False, description="Reactions only: show atom map numbers")
+    retro: bool = Field(default=False, description="Reactions only: draw a retrosynthetic arrow")
+    img_width: int = Field(default=300, description="Molecules only: width of the image in pixels")
+    img_height: int = Field(default=300, description="Molecules only: height of the image in pixels")
+
+
+class RenderBatchRequest(BaseModel):
+    items: List[RenderItem] = Field(..., description="Molecules and reactions to draw")
+    base64_encode: bool = Field(default=False, description="Whether to return the SVGs base64 encoded")
+
+
+class RenderResult(BaseModel):
+    svg: Optional[str] = Field(default=None, description="SVG text (base64 encoded if requested)")
+    width: Optional[float] = Field(default=None, description="Width of the SVG in pixels")
+    height: Optional[float] = Field(default=None, description="Height of the SVG in pixels")
+    error: Optional[str] = Field(default=None, description="Reason the item could not be drawn, if any")
+
+
+class RenderBatchResponse(BaseModel):
+    results: Dict[str, RenderResult] = Field(default_factory=dict, description="Render results keyed by item id")
+
+
+##########################
+# Balance Index Models
+##########################
+
+class BalanceBatchRequest(BaseModel):
+    rxsmiles: List[str] = Field(
+        ...,
+        title="RXSMILES",
+        description="Atom mapped reaction SMILES to compute the balance indices of",
+        examples=[["[CH3:1][OH:2]>>[CH3:1]Cl"]],
+    )
+
+
+class BalanceResult(BaseModel):
+    rxsmiles: str = Field(..., description="The reaction SMILES, as given in the request")
+    rbi: Optional[float] = Field(default=None, description="Reactant balance index, rounded to two decimals")
+    pbi: Optional[float] = Field(default=None, description="Product balance index, rounded to two decimals")
+    tbi: Optional[float] = Field(default=None, description="Total balance index, rounded to two decimals")
+    reactant_atoms: Optional[int] = Field(default=None, description="Number of reactant atoms")
+    product_atoms: Optional[int] = Field(default=None, description="Number of product atoms")
+    matched_atoms: Optional[int] = Field(default=None, description="Number of atom map numbers found on both sides")
+    unmapped_reactant_atoms: Optional[int] = Field(default=None, description="Number of reactant atoms without atom map number")
+    unmapped_product_atoms: Optional[int] = Field(default=None, description="Number of product atoms without atom map number")
+    error: Optional[str] = Field(default=None, description="Reason the indices could not be computed, if any")
+    error_type: Optional[str] = Field(
+        default=None,
+        description="Kind of error, e.g. 'RxsmilesAtomMappingException' or 'TaskTimeoutError'",
+    )
+
+
+class BalanceBatchResponse(BaseModel):
+    results: List[BalanceResult] = Field(default_factory=list, description="One result per reaction, in request order")
+
+
+##########################
+# Reaction Analysis Models
+##########################
+
+class ReactionAnalyzeRequest(RxsmilesRequest):
+    depict: bool = Field(default=False, description="Whether to include the depiction of the reaction")
+    normalize: bool = Field(default=True, description="Whether to depict the reaction with normalized roles")
+    highlight: bool = Field(default=True, description="Depiction only: highlight atoms based on atom mapping")
+    show_atom_indices: bool = Field(default=False, description="Depiction only: show atom map numbers")
+
+
+class ReactionAnalyzeResponse(BaseModel):
+    rxsmiles: str = Field(..., description="The reaction SMILES, as given in the request")
+    has_atom_mapping: bool = Field(..., description="Whether the reaction has atom mapping")
+    normalized_rxsmiles: Optional[str] = Field(default=None, description="The reaction SMILES with normalized roles")
+    normalize_error: Optional[str] = Field(default=None, description="Reason the roles could not be normalized, if any")
+    rbi: Optional[float] = Field(default=None, description="Reactant balance index, rounded to two decimals")
+    pbi: Optional[float] = Field(default=None, description="Product balance index, rounded to two decimals")
+    tbi: Optional[float] = Field(default=None, description="Total balance index, rounded to two decimals")
+    reactant_atoms: Optional[int] = Field(default=None, description="Number of reactant atoms")
+    product_atoms: Optional[int] = Field(default=None, description="Number of product atoms")
+    matched_atoms: Optional[int] = Field(default=None, description="Number of atom map numbers found on both sides")
+    unmapped_reactant_atoms: Optional[int] = Field(default=None, description="Number of reactant atoms without atom map number")
+    unmapped_product_atoms: Optional[int] = Field(default=None, description="Number of product atoms without atom map number")
+    depicted_rxsmiles: Optional[str] = Field(default=None, description="The reaction SMILES that was depicted")
+    svg_base64: Optional[str] = Field(default=None, description="Base64 encoded SVG of the reaction, if requested")
+    width: Optional[float] = Field(default=None, description="Width of the SVG in pixels")
+    height: Optional[float] = Field(default=None, description="Height of the SVG in pixels")
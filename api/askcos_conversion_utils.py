@@ -1,10 +1,24 @@
 import uuid
-from typing import Any, Dict, List, Tuple
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
 from networkx import DiGraph
-from rdkit import Chem
 from askcos_models import (
     TreeSearchResponse,
+    TreeSearchResult,
+)
+from cache_utils import MISSING
+from json_stream_utils import JsonScanner
+from reaction_key_utils import reaction_key
+from substance_index_utils import SubstanceIdentifiers, lookup_substance_identifiers
+from synth_graph_utils import (
+    REACTION,
+    ROLE_NAMES,
+    SUBSTANCE,
+    TARGET_MOLECULE,
+    SynthGraphBuilder,
+    node_type_code,
 )
 import logging
 
@@ -207,6 +221,18 @@ def convert_askcos_edge_to_synth_edge(
         raise ValueError(
             f"Invalid edge type found between nodes {source} and {target}")
 
+    return synth_edge_metadata(start_node, end_node, edge_type)
+
+
+def synth_edge_metadata(start_node: str, end_node: str, edge_type: str) -> Dict[str, Any]:
+    """
+    Builds the metadata of a predicted AICP SynthGraph edge.
+
+    :param start_node: Start node ID
+    :param end_node: End node ID
+    :param edge_type: AICP edge type (PRODUCT_OF or REACTANT_OF)
+    :return: Edge metadata dictionary
+    """
     # Directly create the edge metadata dictionary without using objects
     edge_metadata = {
         "uuid": f"{edge_type}_{uuid.uuid4().hex}",
@@ -258,12 +284,18 @@ def process_askcos_nodes_and_edges(askcos_nodes: List[Dict[Any, Any]], askcos_ed
     return graph
 
 
-def convert_askcos_node_to_synth_node(askcos_node: Dict[Any, Any], USE_RETRO_RXN_RENDERING: bool = False) -> Dict[Any, Any]:
+def convert_askcos_node_to_synth_node(
+    askcos_node: Dict[Any, Any],
+    USE_RETRO_RXN_RENDERING: bool = False,
+    identifiers: Any = MISSING,
+) -> Dict[Any, Any]:
     """
     Converts a node from an ASKCOS tree to a node recognized in an AICP SynthGraph.
 
     :param askcos_node: A node from an ASKCOS tree.
     :param USE_RETRO_RXN_RENDERING: Flag to enable retro reaction rendering for reactions.
+    :param identifiers: Canonical SMILES and InChIKey of a chemical node (None if they cannot be generated), if already
+        known. Otherwise they are looked up in the substance index.
     :return: Dictionary representation of the converted node.
     """
     node_type = askcos_node["type"]
@@ -303,12 +335,12 @@ def convert_askcos_node_to_synth_node(askcos_node: Dict[Any, Any], USE_RETRO_RXN
 
     # Handle substance nodes
     smiles = askcos_node.get("smiles", node_id)
-    try:
-        mol = Chem.MolFromSmiles(smiles)
-        inchikey = Chem.MolToInchiKey(mol)
-    except Exception:
+    if identifiers is MISSING:
+        identifiers = lookup_substance_identifiers(smiles)
+    if identifiers is None:
         raise ValueError(
             f"RDKit problem with parsing SMILES {smiles} and/or generating InChI-Key. ASKCOS Node ID: {node_id}")
+    canonical_smiles, inchikey = identifiers[0], identifiers[1] or ""
 
     # Directly build the substance dictionary
     substance_dict = {
@@ -316,7 +348,7 @@ def convert_askcos_node_to_synth_node(askcos_node: Dict[Any, Any], USE_RETRO_RXN
         "node_label": node_id,
         "uuid": f"substance_{uuid.uuid4().hex}",
         "inchikey": inchikey,
-        "canonical_smiles": Chem.CanonSmiles(smiles),
+        "canonical_smiles": canonical_smiles,
         "srole": askcos_node.get("srole", ""),
         "is_predicted": True,
         "node_type": AICP_SUBSTANCE_NODE_TYPE,
@@ -417,11 +449,14 @@ def askcos_tree2synth_paths_with_graph(tree: TreeSearchResponse, USE_RETRO_RXN_R
             {"nodes": path_nodes, "edges": path_edges, "path_index": path_index})
         path_index += 1
 
-    # Step 1: Merge nodes with same SMILES
+    # Step 1: Merge nodes with same SMILES, reactions are merged by their canonical key, so that the same reaction
+    # written with its fragments in another order is kept once
     smiles_to_node = {}
     old_id_to_new_id = {}
     for node in graph_nodes:
         smiles = node["smiles"]
+        if node.get("type") == "reaction":
+            smiles = reaction_key(smiles)
         if smiles not in smiles_to_node:
             smiles_to_node[smiles] = node
         old_id_to_new_id[node["id"]] = smiles_to_node[smiles]["id"]
@@ -452,3 +487,224 @@ def askcos_tree2synth_paths_with_graph(tree: TreeSearchResponse, USE_RETRO_RXN_R
 
     # Return
     return (synth_graph, graph_paths)
+
+
+class AskcosPathMerger:
+    """
+    Builds the AICP predictive synthesis graph of ASKCOS paths one path at a time, with the same result as
+    ``askcos_tree2synth_paths_with_graph``. Nodes are merged by SMILES (reactions by their canonical key) as soon as
+    they are first seen, and the graph is kept as a ``SynthGraphBuilder``, so only the unique nodes and the edges as
+    integer pairs are held, not the paths themselves. Chemical nodes are converted last, so the identifiers of all
+    unique SMILES (``substance_smiles``) can be computed in one batch and passed to ``to_aicp``.
+    """
+
+    def __init__(self, USE_RETRO_RXN_RENDERING: bool = False):
+        self.USE_RETRO_RXN_RENDERING = USE_RETRO_RXN_RENDERING
+        # Merge key (SMILES or reaction key) -> index of the node kept for it
+        self.merged_nodes: Dict[str, int] = {}
+        self.graph = SynthGraphBuilder()
+        # AICP node by node index. None for chemical nodes not converted yet
+        self.nodes: List[Optional[Dict[str, Any]]] = []
+        # Node index -> ASKCOS chemical node (only the fields used by the conversion) until it is converted
+        self.chemicals: Dict[int, Dict[str, Any]] = {}
+        # Node indices of every route
+        self.routes: List[array] = []
+
+    def _add_node(self, node: Dict[str, Any]) -> int:
+        index = self.graph.index.get(node["id"])
+        if index is not None:
+            # ID already used by a node with another SMILES, merged into that node
+            return index
+        if node["type"] == "chemical":
+            index = self.graph.add_node(node["id"], SUBSTANCE)
+            self.chemicals[index] = {key: node[key] for key in ["id", "type", "smiles", "srole"] if key in node}
+            self.nodes.append(None)
+            return index
+        synth_node = convert_askcos_node_to_synth_node(node, self.USE_RETRO_RXN_RENDERING)
+        index = self.graph.add_node(node["id"], node_type_code(synth_node["node_type"]))
+        self.nodes.append(synth_node)
+        return index
+
+    def substance_smiles(self) -> List[str]:
+        """The unique SMILES of the chemical nodes that are not converted yet."""
+        return [node.get("smiles", node["id"]) for node in self.chemicals.values()]
+
+    def add_path(self, path: Dict[str, Any]) -> None:
+        """Merge the nodes and edges of an ASKCOS path into the graph and add the path as a route."""
+        if not isinstance(path, dict):
+            raise ValueError(f"Invalid path {len(self.routes)} found in provided ASKCOS tree search response.")
+
+        path_nodes = {}
+        route = array("q")
+        for node in path["nodes"]:
+            smiles = node["smiles"]
+            if node.get("type") == "reaction":
+                smiles = reaction_key(smiles)
+            if smiles not in self.merged_nodes:
+                self.merged_nodes[smiles] = self._add_node(node)
+            path_nodes[node["id"]] = self.merged_nodes[smiles]
+            route.append(self.merged_nodes[smiles])
+
+        for edge in path["edges"]:
+            source = path_nodes.get(edge["from"])
+            target = path_nodes.get(edge["to"])
+            if source is None or target is None:
+                raise ValueError(f"Edge {edge['from']}|{edge['to']} of path {len(self.routes)} has unknown nodes.")
+            # ASKCOS edges point from products to reactions and from reactions to reactants, AICP edges the other way
+            if {self.graph.node_type(source), self.graph.node_type(target)} != {SUBSTANCE, REACTION}:
+                raise ValueError(
+                    f"Invalid edge type found between nodes {self.graph.ids[source]} and {self.graph.ids[target]}")
+            self.graph.add_edge(target, source)
+
+        self.routes.append(route)
+
+    def to_aicp(self, identifiers: Optional[Dict[str, Optional[SubstanceIdentifiers]]] = None) -> Dict[str, Any]:
+        """
+        Convert the chemical nodes, assign the synthesis roles (see ``assign_synth_roles``) and return the AICP payload.
+
+        :param identifiers: Canonical SMILES and InChIKey by SMILES of chemical nodes. Missing ones are looked up in the
+            substance index.
+        :return: Dictionary with the 'predictive_synth_graph' and 'routes' of the AICP format.
+        """
+        if not self.routes:
+            raise NoPathsFoundInAskcosResponse("No paths found in provided ASKCOS tree search response.")
+
+        identifiers = identifiers or {}
+        for index, node in self.chemicals.items():
+            self.nodes[index] = convert_askcos_node_to_synth_node(
+                node, self.USE_RETRO_RXN_RENDERING, identifiers.get(node.get("smiles", node["id"]), MISSING)
+            )
+        self.chemicals = {}
+
+        graph = self.graph.build()
+        roles = graph.substance_roles(single_target=True)
+        if not (roles == TARGET_MOLECULE).any():
+            raise ValueError("No target molecule found in the provided synthesis graph.")
+        for index in np.flatnonzero(graph.node_types == SUBSTANCE).tolist():
+            self.nodes[index]["srole"] = ROLE_NAMES[roles[index]]
+
+        ids = graph.ids
+        nodes = [
+            {**{k: v for k, v in attrs.items() if k != "node_id"}, "node_id": ids[index]}
+            for index, attrs in enumerate(self.nodes)
+        ]
+        edges = []
+        for start, end in graph.edges():
+            edge_type = AICP_PRODUCT_OF_EDGE_TYPE if graph.node_types[start] == REACTION else AICP_REACTANT_OF_EDGE_TYPE
+            edge_metadata = synth_edge_metadata(ids[start], ids[end], edge_type)
+            edges.append(dict(source=ids[start], target=ids[end], **edge_metadata))
+        routes = [
+            {
+                "aggregated_yield": 0.0,
+                "predicted": True,
+                "route_index": route_index,
+                "route_status": "Predicted Synthesis Route",
+                "method": "ASKCOS v2",
+                "route_node_labels": [ids[index] for index in route],
+            }
+            for route_index, route in enumerate(self.routes)
+        ]
+        return {"predictive_synth_graph": {"nodes": nodes, "edges": edges}, "routes": routes}
+
+
+def _check_tree_search_response(header: Dict[str, Any], result: Any) -> None:
+    """
+    Validate an ASKCOS tree search response against ``TreeSearchResponse``, except for the paths and the graph of its
+    result, which are read separately.
+
+    :param header: The members of the response other than 'result'.
+    :param result: The 'result' member with 'paths' and 'graph' set to None, or ``...`` if the response has none.
+    """
+    if result is ...:
+        # Raises, the result is required
+        TreeSearchResponse(**header)
+    TreeSearchResponse(**header, result=result if not isinstance(result, dict) else None)
+    if result is None:
+        raise NoResultFoundInAskcosResponse("No result found in provided ASKCOS tree search response.")
+    TreeSearchResult(**result)
+
+
+def iter_askcos_paths(document: Union[bytes, str]) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the paths of an ASKCOS tree search response one at a time from its raw JSON, without decoding the rest of
+    the result (the tree graph is skipped). The response is validated once all paths have been read.
+
+    :param document: The ASKCOS tree search response as JSON text or UTF-8 bytes.
+    :return: Iterator over the paths of the result.
+    """
+    scanner = JsonScanner(document)
+    header = {}
+    result: Any = ...
+    for key in scanner.members():
+        if key != "result":
+            header[key] = scanner.value()
+        elif scanner.peek() != "{":
+            result = scanner.value()
+        else:
+            result = {}
+            for result_key in scanner.members():
+                if result_key == "graph":
+                    scanner.skip()
+                    result[result_key] = None
+                elif result_key == "paths" and scanner.peek() == "[":
+                    for _ in scanner.elements():
+                        yield scanner.value()
+                    result[result_key] = None
+                else:
+                    result[result_key] = scanner.value()
+    scanner.end()
+    _check_tree_search_response(header, result)
+
+
+def _iter_tree_paths(source_data: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield the paths of an ASKCOS tree search response dictionary, validated like ``iter_askcos_paths``."""
+    header = {k: v for k, v in source_data.items() if k != "result"}
+    result = source_data.get("result", ...)
+    paths = None
+    if isinstance(result, dict):
+        paths = result.get("paths")
+        result = {k: (None if k in ["paths", "graph"] else v) for k, v in result.items()}
+    _check_tree_search_response(header, result)
+    if paths is not None and not isinstance(paths, list):
+        raise ValueError("Invalid paths found in provided ASKCOS tree search response.")
+    yield from paths or []
+
+
+def _merge_askcos_paths(paths: Iterable[Dict[str, Any]], USE_RETRO_RXN_RENDERING: bool) -> AskcosPathMerger:
+    merger = AskcosPathMerger(USE_RETRO_RXN_RENDERING)
+    for path in paths:
+        merger.add_path(path)
+    return merger
+
+
+def merge_askcos_json(document: Union[bytes, str], USE_RETRO_RXN_RENDERING: bool = False) -> AskcosPathMerger:
+    """Merge the paths of the raw JSON of an ASKCOS tree search response, see ``iter_askcos_paths``."""
+    return _merge_askcos_paths(iter_askcos_paths(document), USE_RETRO_RXN_RENDERING)
+
+
+def merge_askcos_tree(source_data: Dict[str, Any], USE_RETRO_RXN_RENDERING: bool = False) -> AskcosPathMerger:
+    """Merge the paths of an ASKCOS tree search response dictionary."""
+    return _merge_askcos_paths(_iter_tree_paths(source_data), USE_RETRO_RXN_RENDERING)
+
+
+def convert_askcos_json_to_aicp(document: Union[bytes, str], USE_RETRO_RXN_RENDERING: bool = False) -> Dict[str, Any]:
+    """
+    Converts the raw JSON of an ASKCOS tree search response to an AICP payload, like ``convert_askcos_to_aicp``, but
+    reads the paths one at a time, so the decoded response is never held in memory.
+
+    :param document: The ASKCOS tree search response as JSON text or UTF-8 bytes.
+    :param USE_RETRO_RXN_RENDERING: Whether to use retro rendering for reactions
+    :return: Dictionary with the 'predictive_synth_graph' and 'routes' of the AICP format.
+    """
+    return merge_askcos_json(document, USE_RETRO_RXN_RENDERING).to_aicp()
+
+
+def convert_askcos_to_aicp(source_data: Dict[str, Any], USE_RETRO_RXN_RENDERING: bool = False) -> Dict[str, Any]:
+    """
+    Converts an ASKCOS tree search response to an AICP payload with a predictive synthesis graph and its routes.
+
+    :param source_data: The ASKCOS tree search response as a dictionary.
+    :param USE_RETRO_RXN_RENDERING: Whether to use retro rendering for reactions
+    :return: Dictionary with the 'predictive_synth_graph' and 'routes' of the AICP format.
+    """
+    return merge_askcos_tree(source_data, USE_RETRO_RXN_RENDERING).to_aicp()
@@ -0,0 +1,318 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Small, dependency-free caching primitives shared by the API modules (bounded in-memory LRU, optional on-disk
+# tier and a negative cache for inputs that are known to fail).
+#
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Sentinel returned by the caches on a miss, so that falsy values (e.g. empty strings) can be cached as well
+MISSING = object()
+
+# Caches living in the worker processes of the process pool, their counters are sent back with every task result
+_WORKER_CACHES: Dict[str, "LRUCache"] = {}
+
+
+def make_cache_key(*parts: Any) -> str:
+    """
+    Build a content-addressed cache key from the given parts.
+
+    Args:
+        *parts: values identifying the cached content (e.g. canonical SMILES and draw options)
+
+    Returns:
+        str: hex encoded SHA-256 digest of the parts
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\x1f")  # unit separator, so that ("ab", "c") and ("a", "bc") differ
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe, bounded mapping that evicts the least recently used entry once full. If ``max_bytes`` is set, the
+    values must support ``len()`` (e.g. bytes) and entries are also evicted once their total length exceeds it.
+    """
+
+    def __init__(self, max_entries: int = 1024, name: str = "", max_bytes: Optional[int] = None):
+        self.name = name
+        self.max_entries = max(int(max_entries), 0)
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            if self.max_bytes is not None:
+                self.size_bytes += len(value) - len(self._data.get(key, b""))
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries or self._over_bytes():
+                _, evicted = self._data.popitem(last=False)
+                if self.max_bytes is not None:
+                    self.size_bytes -= len(evicted)
+                self.evictions += 1
+
+    def _over_bytes(self) -> bool:
+        return self.max_bytes is not None and self.size_bytes > self.max_bytes
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._data.pop(key, MISSING)
+            if value is MISSING:
+                return default
+            if self.max_bytes is not None:
+                self.size_bytes -= len(value)
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size_bytes = 0
+
+    def items(self) -> list:
+        """Snapshot of the entries, from least to most recently used."""
+        with self._lock:
+            return list(self._data.items())
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "name": self.name,
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+        if self.max_bytes is not None:
+            stats["size_bytes"] = self.size_bytes
+            stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+class DiskCache:
+    """
+    Directory backed key/value store that survives restarts. Keys must be file name safe (e.g. produced by
+    ``make_cache_key``). Values are pickled. If ``max_bytes`` is set, the least recently used files are removed once
+    the directory grows past that size.
+    """
+
+    def __init__(self, directory: str, max_bytes: Optional[int] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+        # Computed on first use, as walking a large cache directory is slow (and not needed by worker processes)
+        self._size_bytes: Optional[int] = None
+
+    @property
+    def size_bytes(self) -> int:
+        with self._lock:
+            if self._size_bytes is None:
+                self._size_bytes = sum(os.path.getsize(path) for path in self._iter_files())
+            return self._size_bytes
+
+    def _adjust_size(self, delta: int) -> None:
+        self.size_bytes  # noqa: B018 - initialize the size before adjusting it
+        with self._lock:
+            self._size_bytes += delta
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.pkl")
+
+    def _iter_files(self):
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                if file_name.endswith(".pkl"):
+                    yield os.path.join(root, file_name)
+
+    def get(self, key: str, default: Any = MISSING) -> Any:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+        except FileNotFoundError:
+            self.misses += 1
+            return default
+        except Exception as e:
+            # Corrupt or truncated entry, drop it and treat as a miss
+            logger.warning(f"Discarding unreadable disk cache entry {path}: {e}")
+            self._remove(path)
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        try:
+            os.utime(path)  # Mark as recently used for eviction
+        except OSError:
+            pass
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.size_bytes  # noqa: B018 - initialize the size before the new file is counted by it
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(payload)
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write disk cache entry {path}: {e}")
+            return
+
+        self._adjust_size(len(payload) - previous_size)
+        self._evict()
+
+    def _remove(self, path: str) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self._adjust_size(-size)
+
+    def _evict(self) -> None:
+        if not self.max_bytes or self.size_bytes <= self.max_bytes:
+            return
+        # Remove least recently used files until we are below 90% of the budget
+        files = sorted(self._iter_files(), key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in files:
+            if self.size_bytes <= self.max_bytes * 0.9:
+                break
+            self._remove(path)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        for path in list(self._iter_files()):
+            self._remove(path)
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def register_worker_cache(cache: LRUCache) -> LRUCache:
+    """Register a cache used inside the worker processes, so that its counters show up in the API metrics."""
+    _WORKER_CACHES[cache.name] = cache
+    return cache
+
+
+def worker_cache_counters() -> Dict[str, dict]:
+    """Counters of the worker caches of the current process, see ``register_worker_cache``."""
+    return {name: cache.stats() for name, cache in _WORKER_CACHES.items()}
+
+
+class TieredCache:
+    """
+    Memory LRU in front of an optional ``DiskCache``, plus a separate negative cache remembering keys whose
+    computation failed, so that known bad inputs can be answered without recomputation. ``max_bytes`` bounds the
+    memory tier by the total length of its values (see ``LRUCache``).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 1024,
+        directory: Optional[str] = None,
+        max_disk_bytes: Optional[int] = None,
+        max_negative_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+    ):
+        self.name = name
+        self.memory = LRUCache(max_entries, name=name, max_bytes=max_bytes)
+        self.negative = LRUCache(max_negative_entries, name=f"{name}_negative")
+        self.disk = DiskCache(directory, max_disk_bytes) if directory else None
+
+    def get(self, key: str, default: Any = MISSING) -> Any:
+        value = self.memory.get(key)
+        if value is not MISSING:
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not MISSING:
+                self.memory.put(key, value)
+                return value
+        return default
+
+    def put(self, key: str, value: Any) -> None:
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def get_failure(self, key: str) -> Any:
+        """Return the recorded failure for the key, or ``None`` if it is not known to fail."""
+        entry = self.negative.get(key, None)
+        if entry is None:
+            return None
+        failure, expires_at = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            self.negative.pop(key)
+            return None
+        return failure
+
+    def put_failure(self, key: str, failure: Any, ttl: Optional[float] = None) -> None:
+        """Record that the key fails, for ``ttl`` seconds or for as long as the entry is cached if ttl is None."""
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self.negative.put(key, (failure, expires_at))
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.negative.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        stats = self.memory.stats()
+        stats["negative"] = self.negative.stats()
+        stats["disk"] = self.disk.stats() if self.disk is not None else None
+        return stats
@@ -0,0 +1,125 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Cache of converted AICP payloads. Re-uploading the same ASKCOS tree search result (to another room or after a
+# browser refresh) is answered from the serialized AICP JSON of the first conversion, found by the result ID and a
+# hash of the raw request body before anything is parsed or validated.
+#
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from cache_utils import MISSING, TieredCache, make_cache_key
+from executor_utils import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+CONVERSION_CACHE = TieredCache(
+    "conversions",
+    max_entries=int(os.getenv("RW_CONVERSION_CACHE_SIZE", "256")),
+    max_bytes=int(os.getenv("RW_CONVERSION_CACHE_BYTES", str(256 * 1024 * 1024))),
+    directory=os.getenv("RW_CONVERSION_CACHE_DIR") or None,
+    max_disk_bytes=int(os.getenv("RW_CONVERSION_CACHE_DISK_BYTES", str(1024 * 1024 * 1024))),
+)
+CONVERSION_FLIGHTS = SingleFlight()
+
+# Called with the stage of a conversion and, where the stage has items, the number done and the total
+ProgressCallback = Callable[[str, Optional[int], Optional[int]], Awaitable[None]]
+
+# Progress callbacks of the callers waiting for each running conversion, and the last progress it reported
+_progress_listeners: Dict[str, List[ProgressCallback]] = {}
+_last_progress: Dict[str, Tuple[str, Optional[int], Optional[int]]] = {}
+
+# Changes whenever the conversion output changes, so that payloads converted by older versions are not reused
+CONVERSION_VERSION = 1
+
+# 'result_id' member of an ASKCOS tree search result, found without parsing the document
+_RESULT_ID = re.compile(rb'"result_id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def askcos_result_id(document: Union[bytes, str]) -> Optional[str]:
+    """
+    ``TreeSearchResult.result_id`` of the raw JSON of an ASKCOS tree search response (or of a request wrapping one),
+    taken from the first 'result_id' member of the document, or None if it has none.
+    """
+    if isinstance(document, str):
+        document = document.encode("utf-8")
+    match = _RESULT_ID.search(document)
+    return match.group(1).decode("utf-8", errors="replace") if match else None
+
+
+def conversion_cache_key(convert_from: str, document: Union[bytes, str]) -> str:
+    """
+    Cache key of the conversion of a raw request body: the source format, the ASKCOS result ID and the SHA-256 of the
+    body. Identical bodies share an entry, the result ID keeps entries of different results apart even if their
+    bodies were ever to collide.
+
+    Args:
+        convert_from (str): format the body is converted from, e.g. 'askcos'
+        document (bytes | str): the raw request body or uploaded file
+
+    Returns:
+        str: the cache key
+    """
+    if isinstance(document, str):
+        document = document.encode("utf-8")
+    digest = hashlib.sha256(document).hexdigest()
+    return make_cache_key("aicp", CONVERSION_VERSION, convert_from, askcos_result_id(document), digest)
+
+
+async def cached_conversion(
+    key: str,
+    convert: Callable[[ProgressCallback], Awaitable[Dict[str, Any]]],
+    progress: Optional[ProgressCallback] = None,
+) -> bytes:
+    """
+    AICP JSON of a conversion, from ``CONVERSION_CACHE`` or computed by ``convert(report)`` and added to it.
+    Concurrent conversions of the same key share one computation, which goes on as long as any caller waits for it.
+    The progress it reports with ``report`` is passed on to the ``progress`` callback of every waiting caller,
+    callers joining later first get the last progress reported. Failed conversions are not cached.
+
+    Args:
+        key (str): see ``conversion_cache_key``
+        convert (Callable): coroutine function returning the AICP payload, called with the report callback
+        progress (Callable, optional): called with the progress of the conversion while the caller waits for it
+
+    Returns:
+        bytes: the AICP payload as compact JSON
+    """
+    document = CONVERSION_CACHE.get(key)
+    if document is not MISSING:
+        return document
+
+    async def report(stage: str, done: Optional[int] = None, total: Optional[int] = None) -> None:
+        _last_progress[key] = (stage, done, total)
+        await asyncio.gather(*(listener(stage, done, total) for listener in list(_progress_listeners.get(key, ()))))
+
+    async def convert_and_cache() -> bytes:
+        document = json.dumps(await convert(report), separators=(",", ":")).encode("utf-8")
+        CONVERSION_CACHE.put(key, document)
+        return document
+
+    if progress is not None:
+        _progress_listeners.setdefault(key, []).append(progress)
+        if key in _last_progress:
+            await progress(*_last_progress[key])
+    try:
+        return await CONVERSION_FLIGHTS.run(key, convert_and_cache)
+    finally:
+        listeners = _progress_listeners.get(key, [])
+        if progress is not None and progress in listeners:
+            listeners.remove(progress)
+        if not listeners:
+            _progress_listeners.pop(key, None)
+            _last_progress.pop(key, None)
+
+
+def conversion_cache_stats() -> dict:
+    stats = CONVERSION_CACHE.stats()
+    stats["shared_computations"] = CONVERSION_FLIGHTS.shared
+    return stats
@@ -0,0 +1,245 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Reuse 2D depictions across renders. Coordinates are stored by canonical SMILES, MCS alignments by
+# (molecule, reference) pair, and both can be persisted to a local file so that warm coordinates survive restarts.
+#
+
+import logging
+import multiprocessing.util
+import os
+import pickle
+import threading
+from typing import List, Optional, Tuple
+
+from rdkit import Chem
+from rdkit.Chem import rdDepictor
+from rdkit.Geometry import rdGeometry
+
+from cache_utils import MISSING, LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Coordinates of the atoms of a molecule, in canonical SMILES output order
+Coordinates = List[Tuple[float, float]]
+
+# Seed of the depiction sampling, fixed so that the coordinates of a molecule do not depend on the process computing them
+DEPICTION_SEED = 42
+
+
+def canonical_atom_order(mol: Chem.Mol) -> Tuple[Optional[str], List[int]]:
+    """
+    Get the canonical SMILES of a molecule and the order in which its atoms appear in it.
+
+    Args:
+        mol (Chem.Mol): molecule or query molecule
+
+    Returns:
+        (str, list): canonical SMILES and atom indices in output order, or (None, []) if no SMILES can be written
+    """
+    try:
+        smiles = Chem.MolToSmiles(mol)
+        order = list(mol.GetPropsAsDict(True, True)["_smilesAtomOutputOrder"])
+    except Exception:
+        return None, []
+    if len(order) != mol.GetNumAtoms():
+        return None, []
+    return smiles, order
+
+
+def get_coordinates(mol: Chem.Mol, order: List[int]) -> Coordinates:
+    conf = mol.GetConformer()
+    return [(conf.GetAtomPosition(i).x, conf.GetAtomPosition(i).y) for i in order]
+
+
+def canonical_form(mol: Chem.Mol, smiles: str, order: List[int]) -> Chem.Mol:
+    """
+    Copy of a molecule whose atoms and bonds are in canonical order, so that layouts computed for it only depend on
+    the canonical SMILES and not on the order the molecule was written in. Its atom ``i`` is atom ``order[i]`` of the
+    molecule, and it carries the coordinates of the molecule if it has any.
+
+    Args:
+        mol (Chem.Mol): molecule, left unchanged
+        smiles (str): canonical SMILES of the molecule
+        order (list): atom indices of the molecule in SMILES output order (see ``canonical_atom_order``)
+
+    Returns:
+        Chem.Mol: the canonical copy
+    """
+    # Atoms and bonds of the parsed canonical SMILES come in output order. Molecules whose SMILES does not read back
+    # (e.g. query molecules) are renumbered into output order instead
+    canonical = Chem.MolFromSmiles(smiles, sanitize=False)
+    if canonical is None or canonical.GetNumAtoms() != mol.GetNumAtoms():
+        canonical = Chem.RenumberAtoms(Chem.Mol(mol, quickCopy=True), order)
+    canonical.UpdatePropertyCache(False)
+    Chem.FastFindRings(canonical)
+    if mol.GetNumConformers():
+        set_coordinates(canonical, range(canonical.GetNumAtoms()), get_coordinates(mol, order))
+    return canonical
+
+
+def canonical_coordinates(mol: Chem.Mol, smiles: str, order: List[int]) -> Coordinates:
+    """
+    Compute 2D coordinates for the canonical form of a molecule (see ``canonical_form``).
+
+    Returns:
+        Coordinates: coordinates in canonical SMILES output order
+    """
+    canonical = canonical_form(mol, smiles, order)
+    rdDepictor.Compute2DCoords(canonical, sampleSeed=DEPICTION_SEED)
+    return get_coordinates(canonical, range(canonical.GetNumAtoms()))
+
+
+def set_coordinates(mol: Chem.Mol, order: List[int], coords: Coordinates) -> None:
+    conf = Chem.Conformer(mol.GetNumAtoms())
+    conf.Set3D(False)
+    for i, (x, y) in zip(order, coords):
+        conf.SetAtomPosition(i, rdGeometry.Point3D(x, y, 0.0))
+    mol.RemoveAllConformers()
+    mol.AddConformer(conf, assignId=True)
+
+
+class CoordinateStore:
+    """
+    Bounded store of 2D coordinates (keyed by canonical SMILES) and of MCS aligned coordinates (keyed by the canonical
+    SMILES of the molecule and its reference). If ``path`` is set, the store is loaded from and saved to that file.
+    The file is merged on save, so several worker processes can share it.
+    """
+
+    def __init__(self, max_entries: int = 16384, path: Optional[str] = None, save_every: int = 256):
+        self.path = path
+        self.save_every = save_every
+        self.coords = LRUCache(max_entries, name="coordinates")
+        self.alignments = LRUCache(max_entries, name="alignments")
+        self.mcs_timeouts = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._unsaved = 0
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self.path:
+                return
+            data = self._read()
+            for key, value in data.get("coords", {}).items():
+                self.coords.put(key, value)
+            for key, value in data.get("alignments", {}).items():
+                self.alignments.put(key, value)
+            # Save the store when the (worker) process exits
+            multiprocessing.util.Finalize(self, self.save, exitpriority=10)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "rb") as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable coordinate store {self.path}: {e}")
+            return {}
+
+    def save(self) -> None:
+        """Merge the entries of this process into the store file."""
+        if not self.path:
+            return
+        with self._lock:
+            data = self._read()
+            coords = data.get("coords", {})
+            alignments = data.get("alignments", {})
+            coords.update(self.coords.items())
+            alignments.update(self.alignments.items())
+            # Keep the file within the size of the in-memory store, dropping the oldest entries
+            coords = dict(list(coords.items())[-self.coords.max_entries:]) if self.coords.max_entries else {}
+            alignments = dict(list(alignments.items())[-self.alignments.max_entries:]) if self.alignments.max_entries else {}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(tmp_path, "wb") as file:
+                    pickle.dump({"coords": coords, "alignments": alignments}, file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Failed to save coordinate store {self.path}: {e}")
+                return
+            self._unsaved = 0
+
+    def _mark_unsaved(self) -> None:
+        self._unsaved += 1
+        if self.path and self._unsaved >= self.save_every:
+            self.save()
+
+    def compute_2d_coords(self, mol: Chem.Mol) -> Chem.Mol:
+        """
+        Set 2D coordinates on the molecule, reusing the stored coordinates of the same canonical SMILES. New
+        coordinates are computed for the canonical form of the molecule (see ``canonical_coordinates``), so that a
+        molecule is drawn the same whether its coordinates were computed or stored, and by whichever process.
+
+        Args:
+            mol (Chem.Mol): molecule to lay out, updated in place
+
+        Returns:
+            Chem.Mol: the same molecule
+        """
+        self._load()
+        smiles, order = canonical_atom_order(mol)
+        if smiles is None:
+            rdDepictor.Compute2DCoords(mol, sampleSeed=DEPICTION_SEED)
+            return mol
+
+        coords = self.coords.get(smiles)
+        if coords is MISSING or len(coords) != mol.GetNumAtoms():
+            coords = canonical_coordinates(mol, smiles, order)
+            self.coords.put(smiles, coords)
+            self._mark_unsaved()
+        set_coordinates(mol, order, coords)
+        return mol
+
+    def get_alignment(self, mol: Chem.Mol, ref: Chem.Mol) -> bool:
+        """
+        Set the stored coordinates of ``mol`` aligned to ``ref``, if there are any.
+
+        Returns:
+            bool: whether stored coordinates were applied
+        """
+        self._load()
+        smiles, order = canonical_atom_order(mol)
+        ref_smiles, _ = canonical_atom_order(ref)
+        if smiles is None or ref_smiles is None:
+            return False
+        coords = self.alignments.get((smiles, ref_smiles))
+        if coords is MISSING or len(coords) != mol.GetNumAtoms():
+            return False
+        set_coordinates(mol, order, coords)
+        return True
+
+    def put_alignment(self, mol: Chem.Mol, ref: Chem.Mol) -> None:
+        """Store the current coordinates of ``mol`` as its alignment to ``ref``."""
+        smiles, order = canonical_atom_order(mol)
+        ref_smiles, _ = canonical_atom_order(ref)
+        if smiles is None or ref_smiles is None or not mol.GetNumConformers():
+            return
+        self.alignments.put((smiles, ref_smiles), get_coordinates(mol, order))
+        self._mark_unsaved()
+
+    def clear(self) -> None:
+        self.coords.clear()
+        self.alignments.clear()
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "coordinates": self.coords.stats(),
+            "alignments": self.alignments.stats(),
+            "mcs_timeouts": self.mcs_timeouts,
+        }
+
+
+COORD_STORE = CoordinateStore(
+    max_entries=int(os.getenv("RW_COORD_STORE_SIZE", "16384")),
+    path=os.getenv("RW_COORD_STORE_PATH") or None,
+)
+
+# Time budget in seconds for a single MCS search when aligning reactants to the product
+MCS_TIMEOUT = int(os.getenv("RW_MCS_TIMEOUT", "2"))
@@ -160,16 +160,126 @@ def extract_smiles_and_extension(rxsmiles: str) -> Tuple[str, str]:
     return smiles, extension
 
 
-def extract_original_reaction_components(smiles: str) -> ReactionComponents:
+class ReactionFragments:
     """
-    Extract reactants, reagents, and products from the SMILES string. Keep them as separate lists,
-    each including the original index of the component.
+    Fragments of a reaction SMILES in their original order. The role of a fragment follows from its index and the
+    indices at which the reagents and products start, so no per-fragment objects are needed.
+    """
+
+    __slots__ = ("fragments", "reagent_start", "product_start")
+
+    def __init__(self, fragments: List[str], reagent_start: int, product_start: int):
+        self.fragments = fragments
+        self.reagent_start = reagent_start
+        self.product_start = product_start
+
+    @property
+    def reactants(self) -> List[str]:
+        return self.fragments[: self.reagent_start]
+
+    @property
+    def reagents(self) -> List[str]:
+        return self.fragments[self.reagent_start : self.product_start]
+
+    @property
+    def products(self) -> List[str]:
+        return self.fragments[self.product_start :]
+
+    def role_of(self, index: int) -> Optional[str]:
+        """Role of the fragment with the given original index, None if there is no such fragment."""
+        if index < 0 or index >= len(self.fragments):
+            return None
+        if index < self.reagent_start:
+            return "reactant"
+        if index < self.product_start:
+            return "reagent"
+        return "product"
+
+    def to_model(self) -> ReactionComponents:
+        def components(start: int, end: int) -> List[ReactionComponent]:
+            return [
+                ReactionComponent(smiles=self.fragments[index], original_index=index)
+                for index in range(start, end)
+            ]
+
+        return ReactionComponents(
+            reactants=components(0, self.reagent_start),
+            reagents=components(self.reagent_start, self.product_start),
+            products=components(self.product_start, len(self.fragments)),
+        )
+
+
+class ReactionParse:
+    """
+    Parsed reaction SMILES, with the fragments joined according to the fragment groups. ``ParsedReaction`` is the
+    pydantic view of it, see ``to_model``.
+    """
+
+    __slots__ = (
+        "rxsmiles",
+        "fragment_groups",
+        "reactants",
+        "reagents",
+        "products",
+        "components",
+    )
+
+    def __init__(
+        self,
+        rxsmiles: str,
+        fragment_groups: Optional[List[List[int]]],
+        reactants: List[str],
+        reagents: List[str],
+        products: List[str],
+        components: ReactionFragments,
+    ):
+        self.rxsmiles = rxsmiles
+        self.fragment_groups = fragment_groups
+        self.reactants = reactants
+        self.reagents = reagents
+        self.products = products
+        self.components = components
+
+    @property
+    def reactant_smiles(self):
+        return ".".join(self.reactants)
+
+    @property
+    def reagent_smiles(self):
+        return ".".join(self.reagents)
+
+    @property
+    def product_smiles(self):
+        return ".".join(self.products)
+
+    @property
+    def rxsmiles_no_extension(self):
+        return self.rxsmiles.split("|")[0].strip()
+
+    def to_model(self) -> ParsedReaction:
+        return ParsedReaction(
+            rxsmiles=self.rxsmiles,
+            fragment_groups=self.fragment_groups,
+            reactants=self.reactants,
+            reagents=self.reagents,
+            products=self.products,
+        )
+
+
+def _split_fragments(section: str) -> List[str]:
+    return [smile.strip() for smile in section.strip().split(".")] if section else []
+
+
+def extract_original_reaction_components(smiles: str) -> ReactionFragments:
+    """
+    Extract reactants, reagents, and products from the SMILES string. The fragments keep their original order, so
+    the index of a fragment is its original index.
 
     Args:
         smiles (str): The reaction SMILES string without any extensions.
 
     Returns:
-        ReactionComponents: Parsed reactants, reagents, and products.
+        ReactionFragments: Parsed reactants, reagents, and products.
     """
     # Ensure smiles has atleast 2 '>'
     if smiles.count(">") < 2:
@@ -180,178 +290,104 @@ def extract_original_reaction_components(smiles: str) -> ReactionComponents:
     # Split the SMILES string into reactants, reagents, and products
     components = smiles.split(">")
 
-    reactants = (
-        [
-            ReactionComponent(smiles=smile.strip(), original_index=index)
-            for index, smile in enumerate(components[0].strip().split("."))
-            if components[0]
-        ]
-        if len(components) > 0
-        else []
-    )
-
+    reactants = _split_fragments(components[0])
     if len(reactants) == 0:
         raise ValueError(
             "Invalid reaction SMILES string. It should contain at least one reactant."
         )
 
-    reagents = (
-        [
-            ReactionComponent(
-                smiles=smile.strip(), original_index=index + len(reactants)
-            )
-            for index, smile in enumerate(components[1].strip().split("."))
-            if components[1]
-        ]
-        if len(components) > 1
-        else []
-    )
-
-    products = (
-        [
-            ReactionComponent(
-                smiles=smile.strip(),
-                original_index=index + len(reactants) + len(reagents),
-            )
-            for index, smile in enumerate(components[2].strip().split("."))
-            if components[2]
-        ]
-        if len(components) > 2
-        else []
-    )
-
+    reagents = _split_fragments(components[1])
+    products = _split_fragments(components[2])
     if len(products) == 0:
         raise ValueError(
             "Invalid reaction SMILES string. It should contain at least one product."
         )
 
-    return ReactionComponents(reactants=reactants, reagents=reagents, products=products)
+    return ReactionFragments(
+        fragments=reactants + reagents + products,
+        reagent_start=len(reactants),
+        product_start=len(reactants) + len(reagents),
+    )
+
+
+def _group_role(group: List[int], reaction_components: ReactionFragments) -> Optional[str]:
+    """Role shared by all fragments of the group, None if they do not share one or the group is empty."""
+    if not group:
+        return None
+    # Roles are contiguous ranges of indices, so the smallest and largest index decide
+    role = reaction_components.role_of(min(group))
+    return role if role == reaction_components.role_of(max(group)) else None
 
 
 def validate_fragment_groups(
-    fragment_groups: List[List[int]], reaction_components: ReactionComponents
+    fragment_groups: List[List[int]], reaction_components: ReactionFragments
 ) -> None:
     """
     Validate that each fragment group does not cross component boundaries.
 
     Args:
         fragment_groups (List[List[int]]): List of fragment groups, where each group is a list of indices.
-        reaction_components (ReactionComponents): Parsed reactants, reagents, and products.
+        reaction_components (ReactionFragments): Parsed reactants, reagents, and products.
 
     Raises:
-        FragmentGroupError: If any group spans across different components or if all booleans are false.
+        FragmentGroupError: If any group spans across different components or refers to unknown fragments.
     """
-    reactant_indices = [
-        reactant.original_index for reactant in reaction_components.reactants
-    ]
-    reagent_indices = [
-        reagent.original_index for reagent in reaction_components.reagents
-    ]
-    product_indices = [
-        product.original_index for product in reaction_components.products
-    ]
-
     for group in fragment_groups:
-        within_reactants = all(i in reactant_indices for i in group)
-        within_reagents = all(i in reagent_indices for i in group)
-        within_products = all(i in product_indices for i in group)
-
-        # Check if exactly one of the three is True
-        true_count = sum([within_reactants, within_reagents, within_products])
-
-        if true_count != 1:
+        if _group_role(group, reaction_components) is None:
             raise FragmentGroupError(
                 "Invalid fragment group. Fragments either span across components or are invalid."
             )
 
 
 def join_reaction_components(
-    reaction_components: ReactionComponents, fragment_groups: List[List[int]]
+    reaction_components: ReactionFragments, fragment_groups: List[List[int]]
 ) -> Tuple[List[str], List[str], List[str]]:
     """
     Join reactants, reagents, and products by '.' according to the fragment groups,
     and retain any reaction components not part of a fragment group.
 
     Args:
-        reaction_components (ReactionComponents): Parsed reactants, reagents, and products.
+        reaction_components (ReactionFragments): Parsed reactants, reagents, and products.
         fragment_groups (List[List[int]]): List of fragment groups, where each group is a list of indices.
 
     Returns:
-        ParsedReaction: An object containing lists of joined reactants, reagents, and products.
+        Tuple[List[str], List[str], List[str]]: Joined reactants, reagents, and products.
     """
-    # Create a dictionary to map original indices to their SMILES
-    index_to_smiles = {
-        comp.original_index: comp.smiles
-        for comp in reaction_components.reactants
-        + reaction_components.reagents
-        + reaction_components.products
-    }
+    fragments = reaction_components.fragments
 
     # Track indices that are part of a fragment group
     grouped_indices = set(i for group in fragment_groups for i in group)  # noqa: C401
 
-    # Initialize lists to collect grouped SMILES for reactants, reagents, and products
-    grouped_reactants = []
-    grouped_reagents = []
-    grouped_products = []
-
-    # Process each fragment group
+    grouped: dict[str, List[str]] = {"reactant": [], "reagent": [], "product": []}
     for group in fragment_groups:
-        try:
-            # Map each index in the group to its SMILES and join by '.'
-            group_smiles = ".".join(index_to_smiles[i] for i in group)
-        except KeyError as e:
-            raise FragmentGroupError(
-                f"Index {e.args[0]} not found in reaction components."
-            ) from e
-
-        # Determine which component list this group belongs to
-        if all(
-            i in [r.original_index for r in reaction_components.reactants]
-            for i in group
-        ):
-            grouped_reactants.append(group_smiles)
-        elif all(
-            i in [re.original_index for re in reaction_components.reagents]
-            for i in group
-        ):
-            grouped_reagents.append(group_smiles)
-        elif all(
-            i in [p.original_index for p in reaction_components.products] for i in group
-        ):
-            grouped_products.append(group_smiles)
-        else:
+        role = _group_role(group, reaction_components)
+        if role is None:
+            for i in group:
+                if reaction_components.role_of(i) is None:
+                    raise FragmentGroupError(
+                        f"Index {i} not found in reaction components."
+                    )
             raise FragmentGroupError(
                 "Fragment groups cannot span across reactants, reagents, and products."
             )
+        # Map each index in the group to its SMILES and join by '.'
+        grouped[role].append(".".join(fragments[i] for i in group))
 
-    # Add ungrouped components to their respective lists
-    ungrouped_reactants = [
-        r.smiles
-        for r in reaction_components.reactants
-        if r.original_index not in grouped_indices
-    ]
-    ungrouped_reagents = [
-        re.smiles
-        for re in reaction_components.reagents
-        if re.original_index not in grouped_indices
-    ]
-    ungrouped_products = [
-        p.smiles
-        for p in reaction_components.products
-        if p.original_index not in grouped_indices
-    ]
+    def ungrouped(start: int, end: int) -> List[str]:
+        return [fragments[i] for i in range(start, end) if i not in grouped_indices]
 
-    # Combine grouped and ungrouped components
-    final_reactants = grouped_reactants + ungrouped_reactants
-    final_reagents = grouped_reagents + ungrouped_reagents
-    final_products = grouped_products + ungrouped_products
+    reagent_start = reaction_components.reagent_start
+    product_start = reaction_components.product_start
 
-    # Return the ParsedReaction object with grouped reactants, reagents, and products
-    return (final_reactants, final_reagents, final_products)
+    # Combine grouped and ungrouped components
+    return (
+        grouped["reactant"] + ungrouped(0, reagent_start),
+        grouped["reagent"] + ungrouped(reagent_start, product_start),
+        grouped["product"] + ungrouped(product_start, len(fragments)),
+    )
 
 
-def parse_reaction_smiles(rxsmiles: str) -> ParsedReaction:
+def parse_reaction_smiles(rxsmiles: str) -> ReactionParse:
     """
     Parse the reaction SMILES string into components based on fragments.
 
@@ -359,7 +395,8 @@ def parse_reaction_smiles(rxsmiles: str) -> ParsedReaction:
         rxsmiles (str): The reaction SMILES string with an optional extension.
 
     Returns:
-        ParsedReaction: Parsed reaction components (reactants, reagents, products).
+        ReactionParse: Parsed reaction components (reactants, reagents, products), use ``to_model`` for the pydantic
+        ``ParsedReaction``.
     """
     # Step 1: Extract the SMILES and extension
     smiles, extension = extract_smiles_and_extension(rxsmiles)
@@ -369,12 +406,13 @@ def parse_reaction_smiles(rxsmiles: str) -> ParsedReaction:
 
     # Step 2b: If there are no fragment groups, return the components as is
     if not extension:
-        return ParsedReaction(
+        return ReactionParse(
             rxsmiles=rxsmiles,
             fragment_groups=None,
-            reactants=[comp.smiles for comp in components.reactants],
-            reagents=[comp.smiles for comp in components.reagents],
-            products=[comp.smiles for comp in components.products],
+            reactants=components.reactants,
+            reagents=components.reagents,
+            products=components.products,
+            components=components,
         )
 
     # Step 3: Parse fragment groups
@@ -389,10 +427,11 @@ def parse_reaction_smiles(rxsmiles: str) -> ParsedReaction:
     )
 
     # Step 6: Create the final reaction SMILES
-    return ParsedReaction(
+    return ReactionParse(
         rxsmiles=rxsmiles,
         fragment_groups=fragment_groups,
         reactants=reactants,
         reagents=reagents,
         products=products,
+        components=components,
     )
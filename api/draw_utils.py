@@ -13,7 +13,7 @@ logger = logging.getLogger(__name__)
 import rdkit.Chem as Chem
 import rdkit.Chem.Draw as Draw
 import svgutils.transform
-from PIL import Image
+from PIL import Image, ImageDraw
 from rdkit.Chem import (
     rdAbbreviations,
     rdChemReactions,
@@ -23,10 +23,25 @@ from rdkit.Chem import (
 from rdkit.Chem.Draw import rdMolDraw2D
 from rdkit.Geometry import rdGeometry
 
+from coord_store_utils import (
+    COORD_STORE,
+    DEPICTION_SEED,
+    MCS_TIMEOUT,
+    canonical_atom_order,
+    canonical_form,
+    get_coordinates,
+    set_coordinates,
+)
 from decomposition_utils import parse_reaction_smiles
+from mol_cache_utils import mol_from_smarts, mol_from_smiles
 
 ABBREVIATIONS = rdAbbreviations.GetDefaultAbbreviations()
 
+SVG_ROOT_PATTERN = re.compile(r"<svg\b[^>]*>", re.DOTALL)
+SVG_WIDTH_PATTERN = re.compile(r"\swidth=['\"]([\d.]+)(?:px)?['\"]")
+SVG_HEIGHT_PATTERN = re.compile(r"\sheight=['\"]([\d.]+)(?:px)?['\"]")
+SVG_VIEWBOX_PATTERN = re.compile(r"\sviewBox=['\"]\s*([-\d.]+)[\s,]+([-\d.]+)[\s,]+([\d.]+)[\s,]+([\d.]+)\s*['\"]")
+
 HIGHLIGHT_COLORS = [
     (153 / 255, 221 / 255, 255 / 255),  # baby-blue
     (255 / 255, 200 / 255, 153 / 255),  # peach-crayola
@@ -99,7 +114,7 @@ def get_size(mol):
         (float, float): x range, y range in molecule units
     """
     if not mol.GetNumConformers():
-        rdDepictor.Compute2DCoords(mol)
+        COORD_STORE.compute_2d_coords(mol)
     conf = mol.GetConformer()
     xs = [conf.GetAtomPosition(i).x for i in range(mol.GetNumAtoms())]
     ys = [conf.GetAtomPosition(i).y for i in range(mol.GetNumAtoms())]
@@ -108,38 +123,53 @@ def get_size(mol):
     return xrange, yrange
 
 
-def get_scaled_drawer(mol, svg=True, transparent=True, padding=1.0, options=None):
+def get_scaled_size(mol, padding=1.0, options=None):
     """
-    Create a drawing canvas which is sized appropriately for the molecule.
-    Uses the size of the molecule to get an approximate size for the image.
-    RDKit will still reduce the scale if necessary to fit the molecule.
+    Get an approximate image size for the molecule, based on its size in molecule units.
 
     Args:
         mol (Chem.Mol): molecule object to draw
-        svg (bool, optional): return SVG image (default: True)
-        transparent (bool, optional): use transparent background (default: True)
         padding (float, optional): extra padding width around border in molecule
             units (default: 1.0)
         options (MolDrawOptions, optional): custom options object
 
     Returns:
-        MolDraw2DSVG or MolDraw2DCairo instance
+        (int, int): width, height in pixels
     """
     xrange, yrange = get_size(mol)
 
     # Lower bound on size for small molecules
     xrange = max(xrange, 1.5 + 0.75 * xrange) + padding + 2.0
     yrange = max(yrange, 1.5) + padding
-    # print(xrange, yrange)
 
     options = options or get_options()
     scale = options.fixedBondLength
     rd_padding = options.padding
-    # print(scale, rd_padding)
 
     w = int(scale * xrange * (1 + 2 * rd_padding))
     h = int(scale * yrange * (1 + 2 * rd_padding))
-    # print(w, h)
+    return w, h
+
+
+def get_scaled_drawer(mol, svg=True, transparent=True, padding=1.0, options=None):
+    """
+    Create a drawing canvas which is sized appropriately for the molecule.
+    Uses the size of the molecule to get an approximate size for the image.
+    RDKit will still reduce the scale if necessary to fit the molecule.
+
+    Args:
+        mol (Chem.Mol): molecule object to draw
+        svg (bool, optional): return SVG image (default: True)
+        transparent (bool, optional): use transparent background (default: True)
+        padding (float, optional): extra padding width around border in molecule
+            units (default: 1.0)
+        options (MolDrawOptions, optional): custom options object
+
+    Returns:
+        MolDraw2DSVG or MolDraw2DCairo instance
+    """
+    options = options or get_options()
+    w, h = get_scaled_size(mol, padding=padding, options=options)
 
     d = get_drawer(w, h, svg=svg, transparent=transparent, options=options)
 
@@ -148,7 +178,8 @@ def get_scaled_drawer(mol, svg=True, transparent=True, padding=1.0, options=None
 
 def align_molecule(mol, ref):
     """
-    Generate conformer that is aligned to reference based on MCS.
+    Generate conformer that is aligned to reference based on MCS. Alignments are reused from ``COORD_STORE``.
+    If the MCS search exceeds ``MCS_TIMEOUT``, the molecule keeps its unaligned coordinates.
 
     Args:
         mol (Chem.Mol): molecule object to be aligned
@@ -158,32 +189,110 @@ def align_molecule(mol, ref):
         Chem.Mol: Updated mol with aligned conformer
     """
     if not ref.GetNumConformers():
-        rdDepictor.Compute2DCoords(ref)
+        COORD_STORE.compute_2d_coords(ref)
+
+    if COORD_STORE.get_alignment(mol, ref):
+        return mol
+
+    # Align the canonical forms, so that the MCS matches and the layout do not depend on the atom order of the inputs
+    smiles, order = canonical_atom_order(mol)
+    ref_smiles, ref_order = canonical_atom_order(ref)
+    target = canonical_form(mol, smiles, order) if smiles is not None else mol
+    ref_target = canonical_form(ref, ref_smiles, ref_order) if ref_smiles is not None else ref
 
     # Find maximum common substructure between mol and ref
     mcs = rdFMCS.FindMCS(
-        [ref, mol],
+        [ref_target, target],
         matchValences=True,
         ringMatchesRingOnly=True,
         completeRingsOnly=True,
         matchChiralTag=True,
+        timeout=MCS_TIMEOUT,
     )
-    scaffold = Chem.MolFromSmarts(mcs.smartsString)
+    if mcs.canceled:
+        logger.warning(f"MCS search timed out after {MCS_TIMEOUT}s, drawing molecule without alignment")
+        COORD_STORE.mcs_timeouts += 1
+        COORD_STORE.compute_2d_coords(mol)
+        COORD_STORE.put_alignment(mol, ref)
+        return mol
+    scaffold = mol_from_smarts(mcs.smartsString)
 
     # Generate atom mapping for MCS between mol and ref
-    mol_match = mol.GetSubstructMatch(scaffold)
-    ref_match = ref.GetSubstructMatch(scaffold)
-    conf = ref.GetConformer()
+    mol_match = target.GetSubstructMatch(scaffold)
+    ref_match = ref_target.GetSubstructMatch(scaffold)
+    conf = ref_target.GetConformer()
     coord_map = {}
     for i, j in zip(ref_match, mol_match):
         pt = conf.GetAtomPosition(i)
         coord_map[j] = rdGeometry.Point2D(pt.x, pt.y)
 
     # Generate conformer with predetermined coordinates
-    rdDepictor.Compute2DCoords(mol, coordMap=coord_map, canonOrient=False, clearConfs=True)
+    rdDepictor.Compute2DCoords(
+        target, coordMap=coord_map, canonOrient=False, clearConfs=True, sampleSeed=DEPICTION_SEED
+    )
+    if target is not mol:
+        set_coordinates(mol, order, get_coordinates(target, range(target.GetNumAtoms())))
+    COORD_STORE.put_alignment(mol, ref)
     return mol
 
 
+def prepare_mol_image(
+    mol,
+    padding=1.0,
+    clear_map=True,
+    abbreviate=True,
+    bw_atoms=True,
+    update=False,
+    highlight_atoms=None,
+    highlight_bonds=None,
+    show_atom_indices=False,
+    reference=None,
+    options=None,
+    **kwargs,
+):
+    """
+    Prepare the provided RDKit Mol object and its draw options for drawing. See ``mol_to_image`` for the arguments.
+
+    Returns:
+        (Chem.Mol, MolDrawOptions, float): prepared molecule, draw options and padding in molecule units
+    """
+    if not mol:
+        raise ValueError("Need a valid RDKit molecule to draw!")
+
+    options = options or get_options()
+
+    if bw_atoms:
+        options.useBWAtomPalette()
+    if show_atom_indices:
+        for atom in mol.GetAtoms():
+            atom.SetProp("atomNote", str(atom.GetAtomMapNum() if atom.GetAtomMapNum() > 0 else ""))
+    if clear_map:
+        [a.SetAtomMapNum(0) for a in mol.GetAtoms()]
+    if show_atom_indices:
+        mol.UpdatePropertyCache(False)
+    if abbreviate and not highlight_atoms and not highlight_bonds and clear_map:
+        mol.UpdatePropertyCache(False)
+        mol = rdAbbreviations.CondenseMolAbbreviations(mol, ABBREVIATIONS)
+    if update:
+        mol.UpdatePropertyCache(False)  # From legacy code, not sure if truly necessary
+    if highlight_atoms or not clear_map:
+        options.fixedBondLength = max(options.fixedBondLength, 20)
+        padding += 1.0
+    if reference:
+        reference = mol_from_smiles(reference)
+        if abbreviate and not highlight_atoms and not highlight_bonds and clear_map:
+            reference = rdAbbreviations.CondenseMolAbbreviations(reference, ABBREVIATIONS)
+        mol = align_molecule(mol, reference)
+    elif not mol.GetNumConformers():
+        COORD_STORE.compute_2d_coords(mol)
+
+
+    mol = Draw.PrepareMolForDrawing(mol, **kwargs)
+    options.prepareMolsBeforeDrawing = False  # Already prepared
+
+    return mol, options, padding
+
+
 def mol_to_image(
     mol,
     svg=True,
@@ -238,37 +347,20 @@ def mol_to_image(
         PIL.Image instance if svg=False and return_png=False
         bytes if svg=False and return_png=True
     """
-    if not mol:
-        raise ValueError("Need a valid RDKit molecule to draw!")
-
-    options = options or get_options()
-
-    if bw_atoms:
-        options.useBWAtomPalette()
-    if show_atom_indices:
-        for atom in mol.GetAtoms():
-            atom.SetProp("atomNote", str(atom.GetAtomMapNum() if atom.GetAtomMapNum() > 0 else ""))
-    if clear_map:
-        [a.SetAtomMapNum(0) for a in mol.GetAtoms()]
-    if show_atom_indices:
-        mol.UpdatePropertyCache(False)
-    if abbreviate and not highlight_atoms and not highlight_bonds and clear_map:
-        mol.UpdatePropertyCache(False)
-        mol = rdAbbreviations.CondenseMolAbbreviations(mol, ABBREVIATIONS)
-    if update:
-        mol.UpdatePropertyCache(False)  # From legacy code, not sure if truly necessary
-    if highlight_atoms or not clear_map:
-        options.fixedBondLength = max(options.fixedBondLength, 20)
-        padding += 1.0
-    if reference:
-        reference = Chem.MolFromSmiles(reference)
-        if abbreviate and not highlight_atoms and not highlight_bonds and clear_map:
-            reference = rdAbbreviations.CondenseMolAbbreviations(reference, ABBREVIATIONS)
-        mol = align_molecule(mol, reference)
-
-
-    mol = Draw.PrepareMolForDrawing(mol, **kwargs)
-    options.prepareMolsBeforeDrawing = False  # Already prepared
+    mol, options, padding = prepare_mol_image(
+        mol,
+        padding=padding,
+        clear_map=clear_map,
+        abbreviate=abbreviate,
+        bw_atoms=bw_atoms,
+        update=update,
+        highlight_atoms=highlight_atoms,
+        highlight_bonds=highlight_bonds,
+        show_atom_indices=show_atom_indices,
+        reference=reference,
+        options=options,
+        **kwargs,
+    )
 
     d = get_scaled_drawer(mol, svg=svg, transparent=transparent, padding=padding, options=options)
     d.DrawMolecule(
@@ -286,6 +378,174 @@ def mol_to_image(
         return Draw._drawerToImage(d)
 
 
+def draw_molecule_svg(mol, img_width, img_height):
+    """
+    Draw a molecule on a fixed size SVG canvas using the RDKit default drawing options.
+
+    Args:
+        mol (Chem.Mol): molecule object to draw
+        img_width (int): width of the image in pixels
+        img_height (int): height of the image in pixels
+
+    Returns:
+        str: SVG text
+    """
+    if not mol.GetNumConformers():
+        COORD_STORE.compute_2d_coords(mol)
+    d = rdMolDraw2D.MolDraw2DSVG(img_width, img_height)
+    d.DrawMolecule(mol)
+    d.FinishDrawing()
+    return d.GetDrawingText()
+
+
+def draw_molecule_png(mol, img_width, img_height):
+    """
+    Draw a molecule on a fixed size PNG canvas using the RDKit default drawing options.
+
+    Args:
+        mol (Chem.Mol): molecule object to draw
+        img_width (int): width of the image in pixels
+        img_height (int): height of the image in pixels
+
+    Returns:
+        bytes: PNG data
+    """
+    if not mol.GetNumConformers():
+        COORD_STORE.compute_2d_coords(mol)
+    d = get_drawer(img_width, img_height, svg=False, transparent=False)
+    d.DrawMolecule(mol)
+    d.FinishDrawing()
+    return d.GetDrawingText()
+
+
+def draw_molecule_degraded(mol, img_width, img_height, svg=True):
+    """
+    Cheap fixed size depiction, used for molecules whose regular drawing exceeds its time budget. Uses plain
+    ``Compute2DCoords`` coordinates and skips the molecule preparation (kekulization, wedging), abbreviations and
+    highlights.
+
+    Args:
+        mol (Chem.Mol): molecule object to draw
+        img_width (int): width of the image in pixels
+        img_height (int): height of the image in pixels
+        svg (bool, optional): return SVG text, otherwise PNG data (default: True)
+
+    Returns:
+        str if svg=True, bytes otherwise
+    """
+    rdDepictor.Compute2DCoords(mol)
+    d = get_drawer(img_width, img_height, svg=svg, transparent=False)
+    d.drawOptions().prepareMolsBeforeDrawing = False
+    d.DrawMolecule(mol)
+    d.FinishDrawing()
+    return d.GetDrawingText()
+
+
+def text_to_png(text, img_width, img_height):
+    """
+    Create a PNG image showing a line of text, e.g. as placeholder for a depiction that cannot be drawn.
+
+    Args:
+        text (str): text to show
+        img_width (int): width of the image in pixels
+        img_height (int): height of the image in pixels
+
+    Returns:
+        bytes: PNG data
+    """
+    image = Image.new("RGB", (img_width, img_height), (255, 255, 255))
+    ImageDraw.Draw(image).text((10, img_height // 2), text, fill=(0, 0, 0), anchor="lm", font_size=32)
+    bio = io.BytesIO()
+    image.save(bio, format="PNG")
+    return bio.getvalue()
+
+
+def get_svg_dimensions(svg):
+    """
+    Read the width and height of an SVG image from its root element. Falls back to the viewBox if the
+    width/height attributes are missing.
+
+    Args:
+        svg (str): SVG text
+
+    Returns:
+        (float, float): width, height in pixels, or (None, None) if they cannot be determined
+    """
+    root = SVG_ROOT_PATTERN.search(svg)
+    if not root:
+        return None, None
+    attributes = root.group(0)
+    width = SVG_WIDTH_PATTERN.search(attributes)
+    height = SVG_HEIGHT_PATTERN.search(attributes)
+    if width and height:
+        return float(width.group(1)), float(height.group(1))
+    view_box = SVG_VIEWBOX_PATTERN.search(attributes)
+    if view_box:
+        return float(view_box.group(3)), float(view_box.group(4))
+    return None, None
+
+
+def draw_arrow_lines(d, x, y, w, h, arrow_size=10, offset=5, padding=10, retro=False):
+    """
+    Draw a reaction arrow into the given box of a drawer.
+
+    Args:
+        d (MolDraw2D): drawer to draw on
+        x (int): left edge of the box in pixels
+        y (int): top edge of the box in pixels
+        w (int): width of the box in pixels
+        h (int): height of the box in pixels
+        arrow_size (int, optional): size of arrowhead in pixels (default: 10)
+        offset (int, optional): half distance between arrow body lines for retro arrow (default: 5)
+        padding (int, optional): width of padding around border in pixels (default: 10)
+        retro (int, optional): draw arrow style for retro reaction with two body lines (default: False)
+    """
+    midh = y + h // 2
+    left = x + padding
+    right = x + w - padding
+    if retro:
+        begin_top = rdGeometry.Point2D(left, midh + offset)
+        end_top = rdGeometry.Point2D(right - offset, midh + offset)
+        begin_bottom = rdGeometry.Point2D(left, midh - offset)
+        end_bottom = rdGeometry.Point2D(right - offset, midh - offset)
+        top = rdGeometry.Point2D(right - arrow_size, midh + arrow_size)
+        bottom = rdGeometry.Point2D(right - arrow_size, midh - arrow_size)
+        end = rdGeometry.Point2D(right, midh)
+        d.DrawLine(begin_top, end_top, rawCoords=True)
+        d.DrawLine(begin_bottom, end_bottom, rawCoords=True)
+        d.DrawLine(end, top, rawCoords=True)
+        d.DrawLine(end, bottom, rawCoords=True)
+    else:
+        begin = rdGeometry.Point2D(left, midh)
+        end = rdGeometry.Point2D(right, midh)
+        top = rdGeometry.Point2D(right - arrow_size, midh + arrow_size)
+        bottom = rdGeometry.Point2D(right - arrow_size, midh - arrow_size)
+        d.DrawLine(begin, end, rawCoords=True)
+        d.DrawLine(end, top, rawCoords=True)
+        d.DrawLine(end, bottom, rawCoords=True)
+
+
+def draw_plus_lines(d, x, y, w, h, padding=10):
+    """
+    Draw a plus sign into the given box of a drawer.
+
+    Args:
+        d (MolDraw2D): drawer to draw on
+        x (int): left edge of the box in pixels
+        y (int): top edge of the box in pixels
+        w (int): width of the box in pixels
+        h (int): height of the box in pixels
+        padding (int, optional): width of padding around border in pixels (default: 10)
+    """
+    left = rdGeometry.Point2D(x + padding, y + h // 2)
+    right = rdGeometry.Point2D(x + w - padding, y + h // 2)
+    top = rdGeometry.Point2D(x + w // 2, y + h - padding)
+    bottom = rdGeometry.Point2D(x + w // 2, y + padding)
+
+    d.DrawLine(left, right, rawCoords=True)
+    d.DrawLine(top, bottom, rawCoords=True)
+
+
 def draw_arrow(
     arrow_length=80,
     arrow_size=10,
@@ -325,27 +585,7 @@ def draw_arrow(
         d.ClearDrawing()
         d.SetColour((0, 0, 0))  # Reset drawing color to black
 
-    midh = h // 2
-    if retro:
-        begin_top = rdGeometry.Point2D(padding, midh + offset)
-        end_top = rdGeometry.Point2D(w - padding - offset, midh + offset)
-        begin_bottom = rdGeometry.Point2D(padding, midh - offset)
-        end_bottom = rdGeometry.Point2D(w - padding - offset, midh - offset)
-        top = rdGeometry.Point2D(w - padding - arrow_size, midh + arrow_size)
-        bottom = rdGeometry.Point2D(w - padding - arrow_size, midh - arrow_size)
-        end = rdGeometry.Point2D(w - padding, midh)
-        d.DrawLine(begin_top, end_top, rawCoords=True)
-        d.DrawLine(begin_bottom, end_bottom, rawCoords=True)
-        d.DrawLine(end, top, rawCoords=True)
-        d.DrawLine(end, bottom, rawCoords=True)
-    else:
-        begin = rdGeometry.Point2D(padding, midh)
-        end = rdGeometry.Point2D(w - padding, midh)
-        top = rdGeometry.Point2D(w - padding - arrow_size, midh + arrow_size)
-        bottom = rdGeometry.Point2D(w - padding - arrow_size, midh - arrow_size)
-        d.DrawLine(begin, end, rawCoords=True)
-        d.DrawLine(end, top, rawCoords=True)
-        d.DrawLine(end, bottom, rawCoords=True)
+    draw_arrow_lines(d, 0, 0, w, h, arrow_size=arrow_size, offset=offset, padding=padding, retro=retro)
 
     d.FinishDrawing()
     if svg or return_png:
@@ -377,13 +617,7 @@ def draw_plus(size=20, padding=10, svg=True, transparent=True, return_png=False)
         d.ClearDrawing()
         d.SetColour((0, 0, 0))  # Reset drawing color to black
 
-    left = rdGeometry.Point2D(padding, h // 2)
-    right = rdGeometry.Point2D(w - padding, h // 2)
-    top = rdGeometry.Point2D(w // 2, h - padding)
-    bottom = rdGeometry.Point2D(w // 2, padding)
-
-    d.DrawLine(left, right, rawCoords=True)
-    d.DrawLine(top, bottom, rawCoords=True)
+    draw_plus_lines(d, 0, 0, w, h, padding=padding)
 
     d.FinishDrawing()
     if svg or return_png:
@@ -455,6 +689,160 @@ def combine_images_horizontally(images, transparent=True, return_png=False):
             return image
 
 
+def mol_to_panel(
+    mol,
+    padding=1.0,
+    highlight_atoms=None,
+    highlight_bonds=None,
+    highlight_atom_colors=None,
+    highlight_bond_colors=None,
+    **kwargs,
+):
+    """
+    Prepare a molecule as a panel of ``draw_panels_horizontally``. Takes the same arguments as ``mol_to_image``,
+    except for the output format.
+
+    Returns:
+        dict: molecule panel with its size in pixels
+    """
+    mol, options, padding = prepare_mol_image(
+        mol, padding=padding, highlight_atoms=highlight_atoms, highlight_bonds=highlight_bonds, **kwargs
+    )
+    width, height = get_scaled_size(mol, padding=padding, options=options)
+    return {
+        "type": "molecule",
+        "width": width,
+        "height": height,
+        "mol": mol,
+        "options": options,
+        "highlights": {
+            "highlightAtoms": highlight_atoms,
+            "highlightBonds": highlight_bonds,
+            "highlightAtomColors": highlight_atom_colors,
+            "highlightBondColors": highlight_bond_colors,
+        },
+    }
+
+
+def plus_panel(size=20, padding=10):
+    """Plus sign panel of ``draw_panels_horizontally``, see ``draw_plus`` for the arguments."""
+    return {"type": "plus", "width": size + 2 * padding, "height": size + 2 * padding, "size": size, "padding": padding}
+
+
+def arrow_panel(arrow_length=80, arrow_size=10, offset=5, padding=10, retro=False):
+    """Reaction arrow panel of ``draw_panels_horizontally``, see ``draw_arrow`` for the arguments."""
+    return {
+        "type": "arrow",
+        "width": arrow_length + 2 * padding,
+        "height": 2 * arrow_size + 2 * padding,
+        "arrow_length": arrow_length,
+        "arrow_size": arrow_size,
+        "offset": offset,
+        "padding": padding,
+        "retro": retro,
+    }
+
+
+def draw_panel(panel, svg=True, transparent=True):
+    """
+    Draw a single panel on its own canvas, for use with ``combine_images_horizontally``.
+
+    Args:
+        panel (dict): panel created by ``mol_to_panel``, ``plus_panel`` or ``arrow_panel``
+        svg (bool, optional): return SVG image (default: True)
+        transparent (bool, optional): use transparent background (default: True)
+
+    Returns:
+        str if svg=True
+        PIL.Image instance if svg=False
+    """
+    if panel["type"] == "plus":
+        return draw_plus(size=panel["size"], padding=panel["padding"], svg=svg, transparent=transparent, return_png=False)
+    if panel["type"] == "arrow":
+        return draw_arrow(
+            arrow_length=panel["arrow_length"],
+            arrow_size=panel["arrow_size"],
+            offset=panel["offset"],
+            padding=panel["padding"],
+            retro=panel["retro"],
+            svg=svg,
+            transparent=transparent,
+            return_png=False,
+        )
+
+    d = get_drawer(panel["width"], panel["height"], svg=svg, transparent=transparent, options=panel["options"])
+    d.DrawMolecule(panel["mol"], **panel["highlights"])
+    d.FinishDrawing()
+    return d.GetDrawingText() if svg else Draw._drawerToImage(d)
+
+
+def draw_panels_horizontally(panels, svg=True, transparent=True, return_png=False):
+    """
+    Draw a list of panels side by side on a single canvas. Each panel will be vertically centered.
+    Unlike drawing every panel separately and combining the images with ``combine_images_horizontally``,
+    no intermediate images are created and parsed again.
+
+    Args:
+        panels (list): panels created by ``mol_to_panel``, ``plus_panel`` or ``arrow_panel``
+        svg (bool, optional): return SVG image (default: True)
+        transparent (bool, optional): use transparent background (default: True)
+        return_png (bool, optional): if True, return PNG string instead of PIL.Image (default: False)
+
+    Returns:
+        str if svg=True
+        PIL.Image instance if svg=False and return_png=False
+        bytes if svg=False and return_png=True
+    """
+    heights = [panel["height"] for panel in panels]
+    height = max(heights)
+    widths = [panel["width"] for panel in panels]
+    width = sum(widths)
+
+    # RDKit centers a molecule in a panel of fixed size, so every molecule is drawn in a panel as wide as the widest
+    # one, shifted such that it is centered on its own slot. The scale is set by fixedBondLength, not the panel size.
+    panel_width = max(widths)
+    if svg:
+        d = rdMolDraw2D.MolDraw2DSVG(width, height, panel_width, height)
+    else:
+        d = rdMolDraw2D.MolDraw2DCairo(width, height, panel_width, height)
+    if not transparent:
+        d.ClearDrawing()
+
+    offset_x = 0
+    for panel, w, h in zip(panels, widths, heights):
+        if panel["type"] == "molecule":
+            options = panel["options"]
+            options.clearBackground = False  # Background is cleared once for the whole canvas
+            d.SetDrawOptions(options)
+            d.SetOffset(offset_x + (w - panel_width) // 2, 0)
+            d.DrawMolecule(panel["mol"], **panel["highlights"])
+        else:
+            d.SetOffset(0, 0)
+            d.SetColour((0, 0, 0))
+            offset_y = (height - h) // 2
+            if panel["type"] == "plus":
+                draw_plus_lines(d, offset_x, offset_y, w, h, padding=panel["padding"])
+            else:
+                draw_arrow_lines(
+                    d,
+                    offset_x,
+                    offset_y,
+                    w,
+                    h,
+                    arrow_size=panel["arrow_size"],
+                    offset=panel["offset"],
+                    padding=panel["padding"],
+                    retro=panel["retro"],
+                )
+        offset_x += w
+    d.FinishDrawing()
+
+    if svg or return_png:
+        return d.GetDrawingText()
+    else:
+        return Draw._drawerToImage(d)
+
+
 def molecule_smiles_to_image(
     smiles,
     svg=True,
@@ -493,11 +881,11 @@ def molecule_smiles_to_image(
         bytes if svg=False and return_png=True
     """
     if not highlight and split:
-        mols = [Chem.MolFromSmarts(smi) if show_atom_indices else Chem.MolFromSmiles(smi) for smi in smiles.split(".")]
-        images = [mol_to_image(mol, svg=svg, transparent=transparent, abbreviate=abbreviate, reference=reference, **kwargs) for mol in mols]
+        panels = molecule_smiles_to_panels(smiles, abbreviate=abbreviate, reference=reference, show_atom_indices=show_atom_indices, **kwargs)
+        images = [draw_panel(panel, svg=svg, transparent=transparent) for panel in panels]
         return combine_images_horizontally(images, transparent=transparent, return_png=return_png)
 
-    mol = Chem.MolFromSmarts(smiles) if show_atom_indices else Chem.MolFromSmiles(smiles)
+    mol = mol_from_smarts(smiles) if show_atom_indices else mol_from_smiles(smiles)
     # iterate over mol to look for atom index property
     if highlight and reacting_atoms is not None:
         try:
@@ -542,6 +930,24 @@ def molecule_smiles_to_image(
     return mol_to_image(mol, svg=svg, transparent=transparent, return_png=return_png, abbreviate=abbreviate, reference=reference, **kwargs)
 
 
+def molecule_smiles_to_panels(smiles, abbreviate=True, reference=None, show_atom_indices=True, **kwargs):
+    """
+    Split the provided molecule SMILES string into fragments and prepare a panel for each of them.
+
+    Args:
+        smiles (str): SMILES string of molecule to draw
+        abbreviate (bool, optional): if True, use functional group abbreviations (default: True)
+        reference (str, optional): reference molecule to align drawing to based on MCS
+        show_atom_indices (bool, optional): if true parse the fragments as SMARTS to keep the atom maps
+        **kwargs: Passed to mol_to_panel
+
+    Returns:
+        list: molecule panels for ``draw_panels_horizontally``
+    """
+    mols = [mol_from_smarts(smi) if show_atom_indices else mol_from_smiles(smi) for smi in smiles.split(".")]
+    return [mol_to_panel(mol, abbreviate=abbreviate, reference=reference, **kwargs) for mol in mols]
+
+
 def determine_highlight_colors(mol, frag_map, frag_idx=None):
     """
     Determine highlight colors for reactants and products based on atom map.
@@ -593,7 +999,7 @@ def determine_highlight_colors(mol, frag_map, frag_idx=None):
 
 
 
-def reaction_smiles_to_image(smiles, svg=True, transparent=True, return_png=True, retro=False, highlight=False, align=False, plus=True, update=True, show_atom_indices=False,**kwargs):
+def reaction_smiles_to_image(smiles, svg=True, transparent=True, return_png=True, retro=False, highlight=False, align=False, plus=True, update=True, show_atom_indices=False, single_canvas=True, **kwargs):
     """
     Create image of the provided reaction SMILES string. Omits agents.
 
@@ -608,6 +1014,8 @@ def reaction_smiles_to_image(smiles, svg=True, transparent=True, return_png=True
         plus (bool, optional): whether include a plus sign between reactants (default: True)
         update (bool, optional): if True, run UpdatePropertyCache before drawing (default: False)
         show_atom_indices (bool, optional): if true show atom indices in reaction depiction 
+        single_canvas (bool, optional): if True, draw all components on one canvas, otherwise draw them separately
+            and combine the images with ``combine_images_horizontally`` (default: True)
         **kwargs: passed to mol_to_image
 
     Returns:
@@ -619,8 +1027,8 @@ def reaction_smiles_to_image(smiles, svg=True, transparent=True, return_png=True
     reactants = parsed_smiles.reactants
     products = parsed_smiles.products
     # agents = parsed_smiles.reagents # Commented out as agents are not currently used
-    r_mols = [Chem.MolFromSmiles(r) for r in reactants]
-    p_mols = [Chem.MolFromSmiles(p) for p in products]
+    r_mols = [mol_from_smiles(r) for r in reactants]
+    p_mols = [mol_from_smiles(p) for p in products]
 
 
     if highlight:
@@ -628,28 +1036,32 @@ def reaction_smiles_to_image(smiles, svg=True, transparent=True, return_png=True
         for i, mol in enumerate(p_mols if retro else r_mols):
             determine_highlight_colors(mol, atom_frag_map, i)
 
-    images = []
+    panels = []
     for i, mol in enumerate(r_mols):
         if highlight:
             kwargs.update(determine_highlight_colors(mol, atom_frag_map))
         if align:
             kwargs["reference"] = products[0]
         if plus and i > 0:
-            images.append(draw_plus(svg=svg, transparent=transparent))
+            panels.append(plus_panel())
         smiles = Chem.MolToSmarts(mol) if show_atom_indices else Chem.MolToSmiles(mol)
         if smiles.count(".") > 1:
-            images.append(molecule_smiles_to_image(smiles, svg=svg, transparent=transparent, **kwargs))
+            panels.extend(molecule_smiles_to_panels(smiles, **kwargs))
         else:
-            images.append(mol_to_image(mol, svg=svg, transparent=transparent, update=update, show_atom_indices=show_atom_indices, **kwargs))
+            panels.append(mol_to_panel(mol, update=update, show_atom_indices=show_atom_indices, **kwargs))
 
-    images.append(draw_arrow(retro=retro, svg=svg, transparent=transparent))
+    panels.append(arrow_panel(retro=retro))
 
     for i, mol in enumerate(p_mols):
 
         if highlight:
             kwargs.update(determine_highlight_colors(mol, atom_frag_map))
         if plus and i > 0:
-            images.append(draw_plus(svg=svg, transparent=transparent))
-        images.append(mol_to_image(mol, svg=svg, transparent=transparent, update=update, show_atom_indices=show_atom_indices, **kwargs))
+            panels.append(plus_panel())
+        panels.append(mol_to_panel(mol, update=update, show_atom_indices=show_atom_indices, **kwargs))
+
+    if single_canvas:
+        return draw_panels_horizontally(panels, svg=svg, transparent=transparent, return_png=return_png)
 
+    images = [draw_panel(panel, svg=svg, transparent=transparent) for panel in panels]
     return combine_images_horizontally(images, transparent=transparent, return_png=return_png)
@@ -0,0 +1,131 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Enrichment of uploaded graphs. Fills in the fields of substance and reaction nodes the upload did not provide
+# (canonical SMILES, InChIKey and role of substances, atom mapping flag, normalized roles and balance indices of
+# reactions), so that they are computed once per upload and stored with the graph.
+#
+
+import asyncio
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from precompute_utils import get_reaction_analysis_batch, iter_graph_nodes
+from substance_index_utils import get_substance_identifiers
+
+logger = logging.getLogger(__name__)
+
+ENRICH_TIMEOUT = float(os.getenv("RW_ENRICH_TIMEOUT", "30"))
+
+INCHIKEY_PATTERN = re.compile(r"^[A-Z]{14}-[A-Z]{10}-[A-Z]$")
+
+
+def _is_substance(node: Dict[str, Any]) -> bool:
+    return str(node.get("node_type", "")).lower() == "substance"
+
+
+def _is_reaction(node: Dict[str, Any]) -> bool:
+    return str(node.get("node_type", "")).lower() == "reaction"
+
+
+def assign_substance_roles(graph: Dict[str, Any], overwrite: bool = False) -> None:
+    """
+    Assign the role of every substance of a synthesis graph from its degree: substances that no edge starts from are
+    target molecules ('tm'), substances that no edge ends at are starting materials ('sm') and all others are
+    intermediates ('im').
+
+    The payload dicts already exist here, so the degrees are counted per substance label rather than on a
+    ``SynthGraph``, whose ID index costs more than the counters for dict payloads.
+
+    Args:
+        graph (dict): synthesis graph with 'nodes' and 'edges', modified in place
+        overwrite (bool): replace roles that are already set (default: False)
+    """
+    nodes = graph.get("nodes") or []
+    in_degrees = {node["node_label"]: 0 for node in nodes if _is_substance(node)}
+    out_degrees = dict(in_degrees)
+
+    for edge in graph.get("edges") or []:
+        if edge.get("start_node") in out_degrees:
+            out_degrees[edge["start_node"]] += 1
+        if edge.get("end_node") in in_degrees:
+            in_degrees[edge["end_node"]] += 1
+
+    for node in nodes:
+        if not _is_substance(node) or (node.get("srole") and not overwrite):
+            continue
+        if out_degrees[node["node_label"]] == 0:
+            node["srole"] = "tm"  # terminal material
+        elif in_degrees[node["node_label"]] == 0:
+            node["srole"] = "sm"  # starting material
+        else:
+            node["srole"] = "im"  # intermediate
+
+
+def _substance_smiles(node: Dict[str, Any]) -> Optional[str]:
+    """SMILES to compute the missing identifiers of a substance from: its canonical SMILES, else its label."""
+    if node.get("canonical_smiles"):
+        return node["canonical_smiles"]
+    label = node.get("node_label")
+    if label and not INCHIKEY_PATTERN.match(label):
+        return label
+    return None
+
+
+async def enrich_graph(graph_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fill in the missing fields of the nodes of an AICP payload. Substances get their 'srole', 'canonical_smiles' and
+    'inchikey', reactions with a 'rxsmiles' get 'has_atom_mapping' and, if atom mapped, 'normalized_rxsmiles' and the
+    rounded balance indices 'rbi', 'pbi' and 'tbi'. Fields given in the payload are kept. Every distinct SMILES and
+    reaction SMILES is computed once, on the process pool, and substances and reactions are computed concurrently.
+
+    Args:
+        graph_data (dict): validated AICP payload (``InputFile.dict()``), modified in place
+
+    Returns:
+        dict: the enriched payload
+    """
+    for graph_name in ["synth_graph", "predictive_synth_graph"]:
+        if graph_data.get(graph_name):
+            assign_substance_roles(graph_data[graph_name])
+
+    substances: Dict[str, List[Dict[str, Any]]] = {}
+    reactions: Dict[str, List[Dict[str, Any]]] = {}
+    for node in iter_graph_nodes(graph_data):
+        if _is_substance(node):
+            if not node.get("inchikey") and INCHIKEY_PATTERN.match(node.get("node_label") or ""):
+                node["inchikey"] = node["node_label"]
+            smiles = _substance_smiles(node)
+            if smiles and not (node.get("canonical_smiles") and node.get("inchikey")):
+                substances.setdefault(smiles, []).append(node)
+        elif _is_reaction(node) and node.get("rxsmiles") and node.get("has_atom_mapping") is None:
+            reactions.setdefault(node["rxsmiles"], []).append(node)
+
+    identifiers, analyses = await asyncio.gather(
+        get_substance_identifiers(list(substances)), get_reaction_analysis_batch(list(reactions))
+    )
+
+    for smiles, nodes in substances.items():
+        if identifiers.get(smiles) is None:
+            continue
+        canonical_smiles, inchikey = identifiers[smiles]
+        for node in nodes:
+            node["canonical_smiles"] = node.get("canonical_smiles") or canonical_smiles
+            node["inchikey"] = node.get("inchikey") or inchikey
+
+    for result in analyses:
+        if result.analysis is None:
+            logger.debug(f"Enriching reaction {result.rxsmiles} failed: {result.error}")
+            continue
+        analysis = result.analysis
+        for node in reactions[result.rxsmiles]:
+            node["has_atom_mapping"] = analysis.has_atom_mapping
+            if analysis.normalized_rxsmiles is not None and not node.get("normalized_rxsmiles"):
+                node["normalized_rxsmiles"] = analysis.normalized_rxsmiles
+            if analysis.balance is not None:
+                for index in ["rbi", "pbi", "tbi"]:
+                    if node.get(index) is None:
+                        node[index] = round(getattr(analysis.balance, index), 2)
+    return graph_data
@@ -0,0 +1,435 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Run CPU-bound RDKit and networkx work in a pool of worker processes, so that a slow render or conversion does
+# not block the asyncio event loop (and with it every other request and WebSocket of the server).
+#
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from cache_utils import worker_cache_counters
+
+logger = logging.getLogger(__name__)
+
+
+class TaskTimeoutError(Exception):
+    """Exception raised when a task dispatched to the process pool exceeds its time budget."""
+
+    def __init__(self, task_name: str, timeout: float):
+        self.task_name = task_name
+        self.timeout = timeout
+        self.message = f"Task {task_name} did not finish within {timeout} seconds"
+        super().__init__(self.message)
+
+
+class TaskQueueTimeoutError(TaskTimeoutError):
+    """Exception raised when a task dispatched to the process pool waits too long for a free worker."""
+
+    def __init__(self, task_name: str, timeout: float):
+        super().__init__(task_name, timeout)
+        self.message = f"Task {task_name} did not get a worker within {timeout} seconds"
+        self.args = (self.message,)
+
+
+# Queue the worker processes report the start of each task to, with their pid (set by ``warm_up_worker``)
+_task_starts = None
+
+
+def warm_up_worker(task_starts=None) -> None:
+    """
+    Process pool initializer. Imports RDKit and the API modules and draws a small molecule once, so that
+    ``ABBREVIATIONS``, the draw options and RDKit's drawing code are loaded before the first real task arrives.
+
+    Args:
+        task_starts (multiprocessing.Queue, optional): queue to report the start of every task to
+    """
+    global _task_starts
+    _task_starts = task_starts
+
+    import askcos_conversion_utils  # noqa: F401
+    import draw_utils
+    import role_assigner_utils  # noqa: F401
+    from mol_cache_utils import mol_from_smiles
+
+    draw_utils.get_options()
+    draw_utils.mol_to_image(mol_from_smiles("CCO"))
+
+
+def _noop() -> int:
+    return os.getpid()
+
+
+def _run_task(task_id: int, fn: Callable[..., Any], *args: Any) -> Tuple[Any, int, Dict[str, dict]]:
+    """
+    Runs ``fn(*args)`` in a worker, and returns its result with the pid and cache counters of the worker. The start of
+    the task is reported first, so that its time budget does not include the time it was queued.
+    """
+    if _task_starts is not None:
+        _task_starts.put((task_id, os.getpid()))
+    return fn(*args), os.getpid(), worker_cache_counters()
+
+
+def _set_started(started: asyncio.Future, pid: int) -> None:
+    if not started.done():
+        started.set_result(pid)
+
+
+class ProcessPool:
+    """
+    Thin asyncio wrapper around a ``ProcessPoolExecutor`` with pre-warmed workers, per-task timeouts and counters
+    for the queue depth. With ``max_workers=0`` tasks are run in a thread of the event loop instead.
+
+    The time budget of a task starts when a worker picks it up, which the workers report through a queue read by a
+    listener thread. The time a task waits for a worker is bounded separately by ``queue_timeout``.
+
+    A task that exceeds its time budget keeps its worker busy, as running code cannot be interrupted. The executor of
+    such a task is therefore retired: new tasks go to a fresh executor, the other tasks of the retired one finish
+    normally, and once no caller waits for any of its tasks anymore its idle workers are shut down and only the worker
+    running the expired task is killed.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        task_timeout: Optional[float] = None,
+        start_method: str = "spawn",
+        queue_timeout: Optional[float] = None,
+    ):
+        self.max_workers = max(int(max_workers), 0)
+        self.task_timeout = task_timeout
+        self.queue_timeout = queue_timeout
+        self.start_method = start_method
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Start reports of the workers, and the futures resolved with the worker pid when a task starts, by task id
+        self._task_starts: Optional[Any] = None
+        self._task_ids = itertools.count()
+        self._started: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        # Number of callers waiting for tasks of each executor, and the executors retired after a time-out
+        self._waiting: Dict[ProcessPoolExecutor, int] = {}
+        self._retired: Set[ProcessPoolExecutor] = set()
+        # Pids of the workers running expired tasks, by retired executor (None if a pid is not known)
+        self._stuck: Dict[ProcessPoolExecutor, Set[Optional[int]]] = {}
+        # Latest cache counters reported by each worker process, by pid
+        self._worker_caches: Dict[int, Dict[str, dict]] = {}
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.queue_timeouts = 0
+        self.total_task_seconds = 0.0
+        self.recycled = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.start_method)
+                if self._task_starts is None:
+                    self._task_starts = context.Queue()
+                    threading.Thread(
+                        target=self._listen, args=(self._task_starts,), name="task-starts", daemon=True
+                    ).start()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=warm_up_worker,
+                    initargs=(self._task_starts,),
+                )
+            return self._executor
+
+    def _listen(self, task_starts) -> None:
+        """Resolve the start futures of the tasks reported by the workers, until ``shutdown`` sends None."""
+        while True:
+            try:
+                message = task_starts.get()
+            except (EOFError, OSError):
+                return
+            if message is None:
+                return
+            task_id, pid = message
+            with self._lock:
+                entry = self._started.pop(task_id, None)
+            if entry is not None:
+                loop, started = entry
+                loop.call_soon_threadsafe(_set_started, started, pid)
+
+    async def _wait_started(self, task_name: str, future: asyncio.Future, started: asyncio.Future) -> Optional[int]:
+        """
+        Wait until a worker picks up the task of ``future`` (or the task is already done).
+
+        Returns:
+            int: pid of the worker running the task, or None if the task finished before its start was reported
+
+        Raises:
+            TaskQueueTimeoutError: if no worker picks up the task within ``queue_timeout``
+        """
+        await asyncio.wait({future, started}, timeout=self.queue_timeout, return_when=asyncio.FIRST_COMPLETED)
+        if started.done():
+            return started.result()
+        if future.done():
+            return None
+        future.cancel()
+        self.queue_timeouts += 1
+        raise TaskQueueTimeoutError(task_name, self.queue_timeout)
+
+    async def start(self) -> None:
+        """Spawn and warm up all workers, instead of doing so lazily on the first requests."""
+        if self.max_workers == 0:
+            return
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*(loop.run_in_executor(executor, _noop) for _ in range(self.max_workers)))
+        logger.info(f"Process pool started with {self.max_workers} warm workers")
+
+    async def run(self, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        """
+        Run ``fn(*args)`` in a worker and wait for its result.
+
+        Args:
+            fn (Callable): module level (picklable) function
+            *args: picklable arguments for ``fn``
+            timeout (float, optional): time budget in seconds, defaults to the pool's ``task_timeout``
+
+        Returns:
+            Any: the return value of ``fn``
+
+        Raises:
+            TaskTimeoutError: if the task does not finish in time, counted from when a worker picked it up
+            TaskQueueTimeoutError: if no worker picks up the task within ``queue_timeout``
+            Exception: any exception raised by ``fn``
+        """
+        timeout = timeout if timeout is not None else self.task_timeout
+        task_name = getattr(fn, "__name__", str(fn))
+        loop = asyncio.get_running_loop()
+
+        executor = self._get_executor() if self.max_workers else None
+        if executor is not None:
+            self._waiting[executor] = self._waiting.get(executor, 0) + 1
+
+        task_id = next(self._task_ids)
+        started_future = loop.create_future()
+        if executor is not None:
+            with self._lock:
+                self._started[task_id] = (loop, started_future)
+
+        self.pending += 1
+        self.submitted += 1
+        started = time.perf_counter()
+        future = None
+        worker_pid = None
+        try:
+            future = loop.run_in_executor(executor, _run_task, task_id, fn, *args)
+            if executor is not None:
+                worker_pid = await self._wait_started(task_name, future, started_future)
+            result, pid, cache_counters = await asyncio.wait_for(future, timeout)
+            self._worker_caches[pid] = cache_counters
+        except TaskQueueTimeoutError:
+            raise
+        except asyncio.CancelledError:
+            # The caller went away, drop the task if no worker picked it up yet
+            if future is not None:
+                future.cancel()
+            raise
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            if executor is not None:
+                self._retire(executor, worker_pid)
+            raise TaskTimeoutError(task_name, timeout)
+        except BrokenProcessPool:
+            # A worker died (e.g. crashed in RDKit), start over with a fresh pool for the next tasks
+            self.failed += 1
+            if executor is not None:
+                self._replace_broken(executor)
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._started.pop(task_id, None)
+            self.pending -= 1
+            self.total_task_seconds += time.perf_counter() - started
+            if executor is not None:
+                self._release(executor)
+
+        self.completed += 1
+        return result
+
+    def _retire(self, executor: ProcessPoolExecutor, pid: Optional[int]) -> None:
+        """
+        Stop sending tasks to an executor whose worker ``pid`` is stuck, the worker is killed by ``_release``.
+        """
+        with self._lock:
+            self._stuck.setdefault(executor, set()).add(pid)
+            if executor in self._retired:
+                return
+            self._retired.add(executor)
+            if self._executor is executor:
+                self._executor = None
+        self.recycled += 1
+        logger.warning(f"Retiring the process pool workers after a task in worker {pid} exceeded its time budget")
+
+    def _replace_broken(self, executor: ProcessPoolExecutor) -> None:
+        """
+        Stop sending tasks to an executor with a dead worker. All its tasks already failed with BrokenProcessPool, so
+        its remaining workers are shut down without cancelling anything. The callers of its other tasks learn about
+        the broken executor later, so the executor that replaced it in the meantime is left alone.
+        """
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        logger.error("Process pool is broken, replacing it")
+        for pid in list(getattr(executor, "_processes", None) or {}):
+            self._worker_caches.pop(pid, None)
+        executor.shutdown(wait=False, cancel_futures=False)
+
+    def _release(self, executor: ProcessPoolExecutor) -> None:
+        self._waiting[executor] -= 1
+        if self._waiting[executor] > 0:
+            return
+        del self._waiting[executor]
+        if executor in self._retired:
+            self._retired.discard(executor)
+            self._terminate(executor)
+
+    def _terminate(self, executor: ProcessPoolExecutor) -> None:
+        """
+        Shut down a retired executor whose tasks nobody waits for anymore: its idle workers exit normally, the
+        workers running expired tasks are killed. Only called without waiting callers, so no task is cancelled here.
+        """
+        with self._lock:
+            stuck = self._stuck.pop(executor, set())
+        processes = dict(getattr(executor, "_processes", None) or {})
+        executor.shutdown(wait=False, cancel_futures=False)
+        # ProcessPoolExecutor has no public API to stop running tasks, so stuck workers are killed directly. If the
+        # pid of an expired task is not known, all workers are
+        for pid, process in processes.items():
+            if (pid in stuck or None in stuck) and process.is_alive():
+                process.kill()
+            self._worker_caches.pop(pid, None)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            retired = list(self._retired)
+            self._retired.clear()
+            task_starts, self._task_starts = self._task_starts, None
+        if task_starts is not None:
+            # Stops the listener thread, a new queue and listener are created with the next executor
+            task_starts.put(None)
+        if executor is not None:
+            for pid in list(getattr(executor, "_processes", None) or {}):
+                self._worker_caches.pop(pid, None)
+            executor.shutdown(wait=False, cancel_futures=True)
+        for executor in retired:
+            self._terminate(executor)
+        with self._lock:
+            self._stuck.clear()
+
+    def worker_cache_stats(self) -> Dict[str, dict]:
+        """Counters of the caches inside the worker processes (see ``register_worker_cache``), summed over workers."""
+        totals: Dict[str, dict] = {}
+        for counters in list(self._worker_caches.values()):
+            for name, cache in counters.items():
+                total = totals.setdefault(name, dict.fromkeys(["workers", "entries", "hits", "misses", "evictions"], 0))
+                total["max_entries"] = cache["max_entries"]
+                total["workers"] += 1
+                for counter in ["entries", "hits", "misses", "evictions"]:
+                    total[counter] += cache[counter]
+                if "size_bytes" in cache:
+                    total["size_bytes"] = total.get("size_bytes", 0) + cache["size_bytes"]
+        for total in totals.values():
+            lookups = total["hits"] + total["misses"]
+            total["hit_rate"] = round(total["hits"] / lookups, 4) if lookups else 0.0
+        return totals
+
+    def stats(self) -> dict:
+        finished = self.completed + self.failed + self.timeouts
+        return {
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "queue_depth": max(self.pending - max(self.max_workers, 1), 0),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "queue_timeouts": self.queue_timeouts,
+            "recycled": self.recycled,
+            "mean_task_seconds": round(self.total_task_seconds / finished, 4) if finished else 0.0,
+        }
+
+
+class _Flight:
+    """The shared task of a ``SingleFlight`` key and the number of callers awaiting it."""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls by key: while a call for a key is running, further calls for the same key wait for
+    its result instead of starting the same work again.
+
+    The work runs in a task of its own, so that a caller going away (e.g. a cancelled request) does not cancel it for
+    the others. It is only cancelled once no caller awaits it anymore.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self.shared = 0
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await ``fn()``, or the result of the call already running for ``key``.
+
+        Args:
+            key (Hashable): identifies the work, e.g. a cache key
+            fn (Callable): coroutine function doing the work
+
+        Returns:
+            Any: the result of ``fn()``, exceptions are raised to every caller
+        """
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+        else:
+            self.shared += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # The last caller went away, nobody needs the result anymore
+                self._finish(key, flight)
+                flight.task.cancel()
+
+    def _finish(self, key: Hashable, flight: _Flight) -> None:
+        # Calls for the key from now on start new work
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        if flight.task.done() and not flight.task.cancelled():
+            flight.task.exception()  # Mark as retrieved, the callers may all have gone away
+
+
+PROCESS_POOL = ProcessPool(
+    max_workers=int(os.getenv("RW_WORKER_PROCESSES", str(os.cpu_count() or 1))),
+    task_timeout=float(os.getenv("RW_TASK_TIMEOUT", "60")),
+    queue_timeout=float(os.getenv("RW_TASK_QUEUE_TIMEOUT", "300")),
+)
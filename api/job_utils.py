@@ -0,0 +1,230 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Background jobs for long running work such as converting large ASKCOS trees. A job is started by a request
+# that returns at once, runs as an asyncio task that reports its progress to a callback (the server forwards it to
+# the room of the job), can be cancelled and is kept for a while after it finished, so that its status can be polled.
+#
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from executor_utils import PROCESS_POOL
+
+logger = logging.getLogger(__name__)
+
+# Jobs running at once, further jobs are queued
+JOB_CONCURRENCY = int(os.getenv("RW_JOB_CONCURRENCY", "2"))
+# Worker tasks all running jobs may occupy at once, so that the other workers stay free for rendering
+JOB_WORKER_TASKS = int(os.getenv("RW_JOB_WORKER_TASKS", str(max(PROCESS_POOL.max_workers // 2, 1))))
+# Finished jobs kept for status requests
+JOB_HISTORY_SIZE = int(os.getenv("RW_JOB_HISTORY_SIZE", "256"))
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+FINISHED_JOB_STATUSES = {JobStatus.completed, JobStatus.failed, JobStatus.cancelled}
+
+
+class JobNotFoundError(Exception):
+    """Exception raised when a job ID is unknown, or the job was removed from the history."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.message = f"Job {job_id} not found"
+        super().__init__(self.message)
+
+
+class Job:
+    """
+    State of a background job. ``stage`` names the step the job is at, ``done`` and ``total`` count the items of that
+    step if it has any. ``result`` holds a JSON serializable summary once the job completed.
+    """
+
+    def __init__(self, kind: str, room_id: Optional[str], notify: Optional[Callable[["Job"], Awaitable[None]]] = None):
+        self.job_id = str(uuid.uuid4())
+        self.kind = kind
+        self.room_id = room_id
+        self.status = JobStatus.queued
+        self.stage: Optional[str] = None
+        self.done: Optional[int] = None
+        self.total: Optional[int] = None
+        self.error: Optional[str] = None
+        self.result: Any = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._notify = notify
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_JOB_STATUSES
+
+    async def report(self, stage: str, done: Optional[int] = None, total: Optional[int] = None) -> None:
+        """Record the progress of the job and send it to the job's callback."""
+        self.stage = stage
+        self.done = done
+        self.total = total
+        await self.notify()
+
+    async def notify(self) -> None:
+        if self._notify is None:
+            return
+        try:
+            await self._notify(self)
+        except Exception as e:
+            # The job goes on, its status can still be requested
+            logger.warning(f"Sending the status of job {self.job_id} failed: {e}")
+
+    def dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "room_id": self.room_id,
+            "status": self.status.value,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "error": self.error,
+            "result": self.result,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Runs jobs as asyncio tasks, at most ``max_concurrent`` at once, and keeps the last ``history_size`` finished jobs.
+    ``bounded`` lets the jobs share ``max_worker_tasks`` process pool workers, so that they cannot occupy the whole
+    pool.
+
+    Cancelling a job cancels its task. Work already running in a worker process cannot be interrupted, it finishes in
+    the background and its result is dropped.
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_worker_tasks: int = 1, history_size: int = 256):
+        self.max_concurrent = max(int(max_concurrent), 1)
+        self.max_worker_tasks = max(int(max_worker_tasks), 1)
+        self.history_size = max(int(history_size), 0)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        # Created on first use, inside the event loop
+        self._job_semaphore: Optional[asyncio.Semaphore] = None
+        self._worker_semaphore: Optional[asyncio.Semaphore] = None
+        self.submitted = 0
+
+    def submit(
+        self,
+        kind: str,
+        room_id: Optional[str],
+        fn: Callable[[Job], Awaitable[Any]],
+        notify: Optional[Callable[[Job], Awaitable[None]]] = None,
+    ) -> Job:
+        """
+        Start a job. Must be called from the event loop.
+
+        Args:
+            kind (str): type of the job, e.g. 'convert'
+            room_id (str, optional): room the job belongs to
+            fn (Callable): coroutine function doing the work, called with the job to report its progress to. Its
+                return value becomes the result of the job
+            notify (Callable, optional): coroutine function called with the job whenever its status or progress
+                changes
+
+        Returns:
+            Job: the queued job
+        """
+        job = Job(kind, room_id, notify)
+        self._jobs[job.job_id] = job
+        self.submitted += 1
+        job._task = asyncio.create_task(self._run(job, fn))
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> Job:
+        """
+        Raises:
+            JobNotFoundError: if the job is not known
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFoundError(job_id)
+        return job
+
+    def cancel(self, job_id: str) -> Job:
+        """
+        Cancel a queued or running job. Finished jobs are left as they are.
+
+        Raises:
+            JobNotFoundError: if the job is not known
+        """
+        job = self.get(job_id)
+        if not job.finished and job._task is not None:
+            job._task.cancel()
+        return job
+
+    def cancel_all(self) -> None:
+        for job in list(self._jobs.values()):
+            if not job.finished and job._task is not None:
+                job._task.cancel()
+
+    async def bounded(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await ``fn()`` starting a process pool task of a job, once one of the worker slots of the jobs is free."""
+        if self._worker_semaphore is None:
+            self._worker_semaphore = asyncio.Semaphore(self.max_worker_tasks)
+        async with self._worker_semaphore:
+            return await fn()
+
+    async def _run(self, job: Job, fn: Callable[[Job], Awaitable[Any]]) -> None:
+        if self._job_semaphore is None:
+            self._job_semaphore = asyncio.Semaphore(self.max_concurrent)
+        try:
+            await job.notify()
+            async with self._job_semaphore:
+                job.status = JobStatus.running
+                job.started_at = time.time()
+                await job.notify()
+                job.result = await fn(job)
+            job.status = JobStatus.completed
+        except asyncio.CancelledError:
+            job.status = JobStatus.cancelled
+        except Exception as e:
+            logger.error(f"Job {job.job_id} ({job.kind}) failed: {e}", exc_info=True)
+            job.status = JobStatus.failed
+            job.error = str(getattr(e, "detail", None) or getattr(e, "message", None) or e)
+        job.finished_at = time.time()
+        await job.notify()
+        self._prune()
+
+    def _prune(self) -> None:
+        """Remove the oldest finished jobs beyond the history size."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(len(finished) - self.history_size, 0)]:
+            del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        counts = {status.value: 0 for status in JobStatus}
+        for job in list(self._jobs.values()):
+            counts[job.status.value] += 1
+        return {
+            "submitted": self.submitted,
+            "max_concurrent": self.max_concurrent,
+            "max_worker_tasks": self.max_worker_tasks,
+            **counts,
+        }
+
+
+JOBS = JobManager(JOB_CONCURRENCY, JOB_WORKER_TASKS, JOB_HISTORY_SIZE)
@@ -0,0 +1,113 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Incremental reading of large JSON documents. Objects and arrays are walked member by member with
+# ``json.JSONDecoder.raw_decode``, so only the values the caller asks for are decoded and the others are skipped
+# without building Python objects.
+#
+
+import json
+import re
+from typing import Any, Iterator, Union
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Run of text up to the next bracket that is not inside a string
+_NO_BRACKETS = re.compile(r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*')
+
+
+class JsonScanner:
+    """
+    Cursor over a JSON document. ``members`` and ``elements`` iterate over an object or array at the cursor, and
+    before asking for the next key or element the caller has to consume the current value with ``value``, ``skip``
+    or by walking it with ``members``/``elements``.
+
+    Raises:
+        json.JSONDecodeError: on malformed JSON
+    """
+
+    def __init__(self, document: Union[bytes, bytearray, str]):
+        if isinstance(document, (bytes, bytearray)):
+            document = document.decode("utf-8-sig")
+        self.text = document
+        self.pos = 0
+
+    def _error(self, message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, self.text, self.pos)
+
+    def peek(self) -> str:
+        """First character of the next value or delimiter ('' at the end of the document)."""
+        self.pos = _WHITESPACE.match(self.text, self.pos).end()
+        return self.text[self.pos : self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise self._error(f"Expecting '{char}'")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the value at the cursor."""
+        self.peek()
+        value, self.pos = _DECODER.raw_decode(self.text, self.pos)
+        return value
+
+    def skip(self) -> None:
+        """Move the cursor past the value at the cursor. Nested values are only checked for balanced brackets."""
+        if self.peek() not in ("[", "{"):
+            self.value()
+            return
+        depth = 0
+        pos = self.pos
+        while pos < len(self.text):
+            bracket = self.text[pos]
+            if bracket in "[{":
+                depth += 1
+            elif bracket in "]}":
+                depth -= 1
+                if depth == 0:
+                    self.pos = pos + 1
+                    return
+            else:
+                # Unterminated string
+                break
+            pos = _NO_BRACKETS.match(self.text, pos + 1).end()
+        raise self._error("Unterminated value")
+
+    def members(self) -> Iterator[str]:
+        """Yield the keys of the object at the cursor, leaving the cursor at the value of each key."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise self._error("Expecting property name enclosed in double quotes")
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def elements(self) -> Iterator[int]:
+        """Yield the indices of the elements of the array at the cursor, leaving the cursor at each element."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+    def end(self) -> None:
+        """Check that only whitespace follows the cursor."""
+        if self.peek():
+            raise self._error("Extra data")
@@ -0,0 +1,276 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Process-wide cache of parsed RDKit molecules. A SMILES (or SMARTS) is parsed and sanitized once, the molecule is
+# kept as its binary pickle (``Mol.ToBinary``) and every caller gets a fresh copy that it is free to modify. The pickles
+# can also be shared between the worker processes through an append-only, memory-mapped file.
+#
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Optional, Tuple, Union
+
+from rdkit import Chem, rdBase
+
+from cache_utils import MISSING, LRUCache, register_worker_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows, the shared file needs flock and is disabled there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Parse flavours, part of the cache keys
+SMILES = "smiles"
+SMILES_UNSANITIZED = "smiles_unsanitized"
+SMARTS = "smarts"
+
+# Stereo flags, CIP labels and the other computed properties are kept, so copies behave like freshly parsed molecules
+PICKLE_OPTIONS = Chem.PropertyPickleOptions.AllProps
+
+# Stored in place of a pickle for input that RDKit cannot parse
+UNPARSEABLE = b""
+
+
+def _parse(text: str, flavour: str) -> Optional[Chem.Mol]:
+    if flavour == SMARTS:
+        return Chem.MolFromSmarts(text)
+    return Chem.MolFromSmiles(text, sanitize=flavour == SMILES)
+
+
+class SharedMolFile:
+    """
+    Append-only file of molecule pickles shared by processes. Every process maps the file into memory and indexes the
+    records appended since it last looked. Records are appended under an exclusive ``flock`` and carry a CRC32, so a
+    record that is still being written is not read, and a complete record failing its CRC disables the file. Once the
+    file reaches ``max_bytes`` no records are added anymore, delete it while the API is stopped to start over. A file
+    written by another RDKit version is ignored.
+    """
+
+    RECORD_HEADER = struct.Struct("<III")  # key length, pickle length, CRC32 of key and pickle
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.signature = f"RWMOLS1 {rdBase.rdkitVersion}\n".encode("ascii")
+        self.disabled = fcntl is None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._fd: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+        self._mapped = 0
+        self._scanned = 0
+        self._index: Dict[str, Tuple[int, int]] = {}
+        if self.disabled:
+            logger.warning(f"Shared molecule cache file {path} needs fcntl.flock, which is not available")
+
+    def _open(self) -> None:
+        if self._pid == os.getpid():
+            return
+        # (Re)opened in every process, mappings and locks are not inherited in a useful state
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._pid = os.getpid()
+        self._map = None
+        self._mapped = 0
+        self._index = {}
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.write(self._fd, self.signature)
+            signature = os.pread(self._fd, len(self.signature), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if signature != self.signature:
+            self.disabled = True
+            logger.warning(f"Ignoring shared molecule cache file {self.path}, it was written by another RDKit version")
+        self._scanned = len(self.signature)
+
+    def _refresh(self) -> None:
+        """Map the records appended by any process since the last refresh and add them to the index."""
+        size = os.fstat(self._fd).st_size
+        if size <= self._mapped:
+            return
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+        self._mapped = size
+
+        offset = self._scanned
+        while offset + self.RECORD_HEADER.size <= size:
+            key_length, value_length, crc = self.RECORD_HEADER.unpack_from(self._map, offset)
+            start = offset + self.RECORD_HEADER.size
+            end = start + key_length + value_length
+            if end > size:
+                # Still being written, read it on a later refresh
+                break
+            if zlib.crc32(self._map[start:end]) != crc:
+                # Complete but damaged (e.g. its writer was killed mid-write), so the lengths in its header cannot be
+                # trusted to find the records after it either. The records indexed so far are still valid
+                self._disable(f"damaged record at offset {offset}")
+                break
+            self._index[self._map[start : start + key_length].decode("utf-8")] = (start + key_length, value_length)
+            offset = end
+        self._scanned = offset
+
+    def _disable(self, reason: Union[OSError, str]) -> None:
+        logger.warning(f"Disabling shared molecule cache file {self.path}: {reason}")
+        self.disabled = True
+
+    def get(self, key: str) -> bytes:
+        """Return the pickle stored under the key, or ``MISSING``."""
+        with self._lock:
+            if self.disabled:
+                return MISSING
+            try:
+                self._open()
+                if key not in self._index and not self.disabled:
+                    self._refresh()
+            except OSError as e:
+                self._disable(e)
+                return MISSING
+            location = self._index.get(key)
+            if location is None:
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+            start, length = location
+            return self._map[start : start + length]
+
+    def put(self, key: str, value: bytes) -> None:
+        with self._lock:
+            if self.disabled or key in self._index:
+                return
+            key_bytes = key.encode("utf-8")
+            header = self.RECORD_HEADER.pack(len(key_bytes), len(value), zlib.crc32(key_bytes + value))
+            record = header + key_bytes + value
+            try:
+                self._open()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(self._fd).st_size + len(record) > self.max_bytes:
+                        return
+                    os.write(self._fd, record)
+                finally:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+            except OSError as e:
+                self._disable(e)
+                return
+            self.writes += 1
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "size_bytes": self._mapped,
+            "max_bytes": self.max_bytes,
+            "records": len(self._index),
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "disabled": self.disabled,
+        }
+
+
+class MolCache:
+    """
+    Memory LRU of molecule pickles, bounded by entries and bytes, in front of an optional ``SharedMolFile``. Input that
+    RDKit cannot parse is cached as well, so it is only parsed once.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int,
+        max_bytes: int,
+        path: Optional[str] = None,
+        max_file_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.name = name
+        self.memory = LRUCache(max_entries, name=name, max_bytes=max_bytes)
+        self.shared = SharedMolFile(path, max_file_bytes) if path else None
+
+    def get_pickle(self, text: str, flavour: str) -> bytes:
+        """
+        Binary pickle of the parsed molecule, parsing it on a miss.
+
+        Returns:
+            bytes: pickle of the molecule, or ``UNPARSEABLE`` if RDKit cannot parse the input
+        """
+        key = (flavour, text)
+        pickle = self.memory.get(key)
+        if pickle is not MISSING:
+            return pickle
+
+        shared_key = f"{flavour}\t{text}"
+        if self.shared is not None:
+            pickle = self.shared.get(shared_key)
+            if pickle is not MISSING:
+                self.memory.put(key, pickle)
+                return pickle
+
+        mol = _parse(text, flavour)
+        pickle = mol.ToBinary(PICKLE_OPTIONS) if mol is not None else UNPARSEABLE
+        self.memory.put(key, pickle)
+        if self.shared is not None:
+            self.shared.put(shared_key, pickle)
+        return pickle
+
+    def get_mol(self, text: str, flavour: str) -> Optional[Chem.Mol]:
+        """Fresh copy of the parsed molecule, or None if RDKit cannot parse the input."""
+        pickle = self.get_pickle(text, flavour)
+        return Chem.Mol(pickle) if pickle else None
+
+    def clear(self) -> None:
+        self.memory.clear()
+
+    def stats(self) -> dict:
+        stats = self.memory.stats()
+        stats["shared_file"] = self.shared.stats() if self.shared is not None else None
+        return stats
+
+
+MOL_CACHE = register_worker_cache(
+    MolCache(
+        "molecules",
+        max_entries=int(os.getenv("RW_MOL_CACHE_SIZE", "65536")),
+        max_bytes=int(os.getenv("RW_MOL_CACHE_BYTES", str(64 * 1024 * 1024))),
+        path=os.getenv("RW_MOL_CACHE_FILE") or None,
+        max_file_bytes=int(os.getenv("RW_MOL_CACHE_FILE_BYTES", str(256 * 1024 * 1024))),
+    )
+)
+
+
+def mol_from_smiles(smiles: str, sanitize: bool = True) -> Optional[Chem.Mol]:
+    """
+    Cached replacement of ``Chem.MolFromSmiles``.
+
+    Args:
+        smiles (str): SMILES string
+        sanitize (bool): whether the molecule is sanitized (default: True)
+
+    Returns:
+        Chem.Mol: a fresh copy of the molecule, or None if RDKit cannot parse the SMILES
+    """
+    return MOL_CACHE.get_mol(smiles, SMILES if sanitize else SMILES_UNSANITIZED)
+
+
+def smiles_sanitizes(smiles: str) -> bool:
+    """Whether RDKit can parse and sanitize the SMILES, answered from the cache without copying the molecule."""
+    return bool(MOL_CACHE.get_pickle(smiles, SMILES))
+
+
+def mol_from_smarts(smarts: str) -> Optional[Chem.Mol]:
+    """
+    Cached replacement of ``Chem.MolFromSmarts``.
+
+    Returns:
+        Chem.Mol: a fresh copy of the query molecule, or None if RDKit cannot parse the SMARTS
+    """
+    return MOL_CACHE.get_mol(smarts, SMARTS)
@@ -0,0 +1,451 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Cached role normalization and balance indices, and the upload-side pipeline that renders and computes
+# everything a freshly uploaded graph needs, so the UI finds the caches warm when it opens the graph.
+#
+
+import asyncio
+import logging
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import decomposition_utils
+import role_assigner_utils
+from cache_utils import MISSING, TieredCache
+from reaction_key_utils import reaction_key
+from executor_utils import PROCESS_POOL, SingleFlight
+from render_utils import get_molecule_svg, get_reaction_svg
+
+logger = logging.getLogger(__name__)
+
+CHEMISTRY_CACHE = TieredCache(
+    "chemistry",
+    max_entries=int(os.getenv("RW_CHEMISTRY_CACHE_SIZE", "16384")),
+    max_negative_entries=int(os.getenv("RW_CHEMISTRY_CACHE_SIZE", "16384")),
+)
+CHEMISTRY_FLIGHTS = SingleFlight()
+
+# Draw options of the depictions requested by the UI, which are rendered ahead of time on upload
+PRECOMPUTE_MOLECULE_SIZE = (300, 300)
+PRECOMPUTE_REACTION_OPTIONS = {"highlight": True, "show_atom_indices": False}
+
+# Bounds the worker tasks of the upload pipelines, so that interactive requests are not queued behind them
+PRECOMPUTE_CONCURRENCY = int(os.getenv("RW_PRECOMPUTE_CONCURRENCY", str(max(PROCESS_POOL.max_workers, 1))))
+PRECOMPUTE_TIMEOUT = float(os.getenv("RW_PRECOMPUTE_TIMEOUT", "120"))
+
+# Number of reactions of a balance index batch computed by one worker task
+BALANCE_BATCH_CHUNK_SIZE = 256
+# Number of reactions of a role normalization batch normalized by one worker task. Normalization is slower than the
+# balance indices, so the chunks are smaller to spread a batch over all workers and to stream results sooner
+NORMALIZE_BATCH_CHUNK_SIZE = 32
+_precompute_semaphore: Optional[asyncio.Semaphore] = None
+
+# Errors the chemistry functions raise for invalid or unsupported reactions. Only these are cached: other errors, e.g.
+# of the process pool itself, do not depend on the input
+INPUT_ERRORS = (ValueError, role_assigner_utils.RxsmilesAtomMappingException, decomposition_utils.FragmentGroupError)
+
+# Called with a graph node and its depiction (SVG text) as soon as the depiction is rendered
+DepictionCallback = Callable[[Dict[str, Any], str], Awaitable[None]]
+
+
+def _for_input(value: Any, rxsmiles: str) -> Any:
+    """Result cached for an equivalent reaction, with its 'rxsmiles' field (if any) set to the requested one."""
+    if getattr(value, "rxsmiles", rxsmiles) == rxsmiles:
+        return value
+    return value.copy(update={"rxsmiles": rxsmiles})
+
+
+async def _cached_run(name: str, fn, rxsmiles: str, invariant: bool = False) -> Any:
+    """
+    Run ``fn(rxsmiles)`` on the process pool, memoized in ``CHEMISTRY_CACHE``. Input errors (``INPUT_ERRORS``) raised
+    by ``fn`` are cached as well and raised again for the same input. Time-outs and pool failures are not cached.
+
+    With ``invariant``, the result does not depend on how the reaction is written, so it is also cached by the
+    canonical reaction key (``reaction_key_utils.reaction_key`` with the atom mapping), and shared by reactions that
+    only differ in their atom map numbers, fragment order or fragment group numbering.
+    """
+    key = (name, rxsmiles)
+    value = CHEMISTRY_CACHE.memory.get(key)
+    if value is not MISSING:
+        return value
+    failure = CHEMISTRY_CACHE.get_failure(key)
+    if failure is not None:
+        raise failure
+
+    shared_key = None
+    if invariant:
+        shared_key = (name, reaction_key(rxsmiles, keep_atom_maps=True))
+        value = CHEMISTRY_CACHE.memory.get(shared_key)
+        if value is not MISSING:
+            value = _for_input(value, rxsmiles)
+            CHEMISTRY_CACHE.memory.put(key, value)
+            return value
+
+    try:
+        value = await CHEMISTRY_FLIGHTS.run(key, lambda: PROCESS_POOL.run(fn, rxsmiles))
+    except INPUT_ERRORS as e:
+        CHEMISTRY_CACHE.put_failure(key, e)
+        raise
+
+    CHEMISTRY_CACHE.memory.put(key, value)
+    if shared_key is not None:
+        CHEMISTRY_CACHE.memory.put(shared_key, value)
+    return value
+
+
+async def get_has_atom_mapping(rxsmiles: str) -> bool:
+    """Cached ``role_assigner_utils.rxsmiles_has_atommapping``."""
+    return await _cached_run("has_atom_mapping", role_assigner_utils.rxsmiles_has_atommapping, rxsmiles, True)
+
+
+async def get_normalized_roles(rxsmiles: str) -> str:
+    """Cached ``role_assigner_utils.normalize_roles``. Keyed by the input only, as the result is written like it."""
+    return await _cached_run("normalize_roles", role_assigner_utils.normalize_roles, rxsmiles)
+
+
+async def get_balance_indices(rxsmiles: str) -> role_assigner_utils.RxnBalanceDetails:
+    """Cached ``role_assigner_utils.compute_balance_details``."""
+    return await _cached_run("balance_indices", role_assigner_utils.compute_balance_details, rxsmiles, True)
+
+
+async def get_reaction_analysis(rxsmiles: str) -> role_assigner_utils.RxnAnalysis:
+    """
+    Cached ``role_assigner_utils.analyze_reaction``. Its results are shared with the caches of the single stages, so
+    that a later ``/normalize_roles`` or ``/compute_all_bi`` call for the same reaction does not parse it again.
+    """
+    analysis = await _cached_run("reaction_analysis", role_assigner_utils.analyze_reaction, rxsmiles)
+    _share_analysis(analysis)
+    return analysis
+
+
+def _share_analysis(analysis: role_assigner_utils.RxnAnalysis) -> None:
+    """Put the results of a reaction analysis into the caches of the single stages."""
+    rxsmiles = analysis.rxsmiles
+    CHEMISTRY_CACHE.memory.put(("has_atom_mapping", rxsmiles), analysis.has_atom_mapping)
+    if analysis.normalized_rxsmiles is not None:
+        CHEMISTRY_CACHE.memory.put(("normalize_roles", rxsmiles), analysis.normalized_rxsmiles)
+    if analysis.balance is not None:
+        CHEMISTRY_CACHE.memory.put(("balance_indices", rxsmiles), analysis.balance)
+
+
+async def get_reaction_analysis_batch(rxsmiles_list: List[str]) -> List[role_assigner_utils.RxnAnalysisBatchOutput]:
+    """
+    Batched ``get_reaction_analysis``: reactions found in ``CHEMISTRY_CACHE`` are answered from it, the others are
+    analyzed with ``role_assigner_utils.analyze_reactions_batch`` in chunks spread over the process pool.
+
+    Returns:
+        List[RxnAnalysisBatchOutput]: one result per input, in order, with an 'error' for reactions that failed
+        (including time-outs of their worker task)
+    """
+    results: Dict[str, role_assigner_utils.RxnAnalysisBatchOutput] = {}
+    missing = []
+    for rxsmiles in dict.fromkeys(rxsmiles_list):
+        key = ("reaction_analysis", rxsmiles)
+        analysis = CHEMISTRY_CACHE.memory.get(key)
+        failure = CHEMISTRY_CACHE.get_failure(key) if analysis is MISSING else None
+        if analysis is not MISSING:
+            results[rxsmiles] = role_assigner_utils.RxnAnalysisBatchOutput(rxsmiles=rxsmiles, analysis=analysis)
+        elif failure is not None:
+            results[rxsmiles] = role_assigner_utils.RxnAnalysisBatchOutput(
+                rxsmiles=rxsmiles,
+                error=getattr(failure, "message", None) or str(failure),
+                error_type=type(failure).__name__,
+            )
+        else:
+            missing.append(rxsmiles)
+
+    chunks = [missing[i:i + NORMALIZE_BATCH_CHUNK_SIZE] for i in range(0, len(missing), NORMALIZE_BATCH_CHUNK_SIZE)]
+    chunk_results = await asyncio.gather(
+        *(
+            _run_batch_chunk(
+                role_assigner_utils.analyze_reactions_batch, chunk, role_assigner_utils.RxnAnalysisBatchOutput
+            )
+            for chunk in chunks
+        )
+    )
+    for chunk_result in chunk_results:
+        for result in chunk_result:
+            results[result.rxsmiles] = result
+            if result.analysis is not None:
+                CHEMISTRY_CACHE.memory.put(("reaction_analysis", result.rxsmiles), result.analysis)
+                _share_analysis(result.analysis)
+
+    return [results[rxsmiles] for rxsmiles in rxsmiles_list]
+
+
+async def get_balance_indices_batch(rxsmiles_list: List[str]) -> List[role_assigner_utils.RxnBalanceBatchOutput]:
+    """
+    Batched ``get_balance_indices``: reactions found in ``CHEMISTRY_CACHE`` are answered from it, the others are
+    computed with ``role_assigner_utils.compute_balance_indices_batch`` in chunks spread over the process pool.
+
+    Returns:
+        List[RxnBalanceBatchOutput]: one result per input, in order, with an 'error' for reactions that failed
+    """
+    results: Dict[str, role_assigner_utils.RxnBalanceBatchOutput] = {}
+    missing = []
+    for rxsmiles in dict.fromkeys(rxsmiles_list):
+        key = ("balance_indices", rxsmiles)
+        balance = CHEMISTRY_CACHE.memory.get(key)
+        failure = CHEMISTRY_CACHE.get_failure(key) if balance is MISSING else None
+        if balance is not MISSING:
+            results[rxsmiles] = role_assigner_utils.RxnBalanceBatchOutput(**balance.dict())
+        elif failure is not None:
+            message = getattr(failure, "message", None) or str(failure)
+            results[rxsmiles] = role_assigner_utils.RxnBalanceBatchOutput(
+                rxsmiles=rxsmiles, error=message, error_type=type(failure).__name__
+            )
+        else:
+            missing.append(rxsmiles)
+
+    chunks = [missing[i:i + BALANCE_BATCH_CHUNK_SIZE] for i in range(0, len(missing), BALANCE_BATCH_CHUNK_SIZE)]
+    chunk_results = await asyncio.gather(
+        *(
+            _run_batch_chunk(
+                role_assigner_utils.compute_balance_indices_batch, chunk, role_assigner_utils.RxnBalanceBatchOutput
+            )
+            for chunk in chunks
+        )
+    )
+    for chunk_result in chunk_results:
+        for result in chunk_result:
+            results[result.rxsmiles] = result
+            if result.error is None:
+                details = role_assigner_utils.RxnBalanceDetails(**result.dict(exclude={"error"}))
+                CHEMISTRY_CACHE.memory.put(("balance_indices", result.rxsmiles), details)
+
+    return [results[rxsmiles] for rxsmiles in rxsmiles_list]
+
+
+async def _run_batch_chunk(fn: Callable[[List[str]], List[Any]], chunk: List[str], output_type) -> List[Any]:
+    """
+    Run the batch function ``fn`` on a chunk of reactions in a worker. If the task fails (e.g. times out), every
+    reaction of the chunk gets an ``output_type`` result with the error instead.
+    """
+    try:
+        return await PROCESS_POOL.run(fn, chunk)
+    except Exception as e:
+        message = getattr(e, "message", None) or str(e) or type(e).__name__
+        return [output_type(rxsmiles=rxsmiles, error=message, error_type=type(e).__name__) for rxsmiles in chunk]
+
+
+async def iter_normalized_roles_batch(
+    rxsmiles_list: List[str],
+) -> AsyncIterator[Tuple[int, role_assigner_utils.RxnNormalizeBatchOutput]]:
+    """
+    Batched ``get_normalized_roles``, yielding ``(index, result)`` pairs as soon as they are available: reactions
+    found in ``CHEMISTRY_CACHE`` first, then the others chunk by chunk as the worker tasks complete. Duplicates are
+    normalized once and yielded for each of their indices.
+
+    Yields:
+        (int, RxnNormalizeBatchOutput): index in ``rxsmiles_list`` and its result, with an 'error' and 'error_type' for
+        reactions that failed (including time-outs of their worker task)
+    """
+    indices: Dict[str, List[int]] = {}
+    for index, rxsmiles in enumerate(rxsmiles_list):
+        indices.setdefault(rxsmiles, []).append(index)
+
+    missing = []
+    for rxsmiles in indices:
+        key = ("normalize_roles", rxsmiles)
+        normalized = CHEMISTRY_CACHE.memory.get(key)
+        failure = CHEMISTRY_CACHE.get_failure(key) if normalized is MISSING else None
+        if normalized is not MISSING:
+            result = role_assigner_utils.RxnNormalizeBatchOutput(rxsmiles=rxsmiles, normalized_rxsmiles=normalized)
+        elif failure is not None:
+            result = role_assigner_utils.RxnNormalizeBatchOutput(
+                rxsmiles=rxsmiles,
+                error=getattr(failure, "message", None) or str(failure),
+                error_type=type(failure).__name__,
+            )
+        else:
+            missing.append(rxsmiles)
+            continue
+        for index in indices[rxsmiles]:
+            yield index, result
+
+    chunks = [missing[i:i + NORMALIZE_BATCH_CHUNK_SIZE] for i in range(0, len(missing), NORMALIZE_BATCH_CHUNK_SIZE)]
+    tasks = [
+        asyncio.ensure_future(
+            _run_batch_chunk(
+                role_assigner_utils.normalize_roles_batch, chunk, role_assigner_utils.RxnNormalizeBatchOutput
+            )
+        )
+        for chunk in chunks
+    ]
+    try:
+        for next_chunk in asyncio.as_completed(tasks):
+            for result in await next_chunk:
+                if result.error is None:
+                    CHEMISTRY_CACHE.memory.put(("normalize_roles", result.rxsmiles), result.normalized_rxsmiles)
+                for index in indices[result.rxsmiles]:
+                    yield index, result
+    finally:
+        # The client went away (e.g. stopped reading the stream), the remaining chunks are not needed anymore
+        for task in tasks:
+            task.cancel()
+
+
+async def get_normalized_roles_batch(rxsmiles_list: List[str]) -> List[role_assigner_utils.RxnNormalizeBatchOutput]:
+    """
+    Batched ``get_normalized_roles``, see ``iter_normalized_roles_batch``.
+
+    Returns:
+        List[RxnNormalizeBatchOutput]: one result per input, in order
+    """
+    results: List[Optional[role_assigner_utils.RxnNormalizeBatchOutput]] = [None] * len(rxsmiles_list)
+    async for index, result in iter_normalized_roles_batch(rxsmiles_list):
+        results[index] = result
+    return results
+
+
+def iter_graph_nodes(graph_data: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield the nodes of all synthesis graphs of an AICP payload."""
+    for graph_name in ["synth_graph", "predictive_synth_graph"]:
+        graph = graph_data.get(graph_name) or {}
+        yield from graph.get("nodes") or []
+
+
+async def _bounded(coro) -> Any:
+    global _precompute_semaphore
+    if _precompute_semaphore is None:
+        _precompute_semaphore = asyncio.Semaphore(max(PRECOMPUTE_CONCURRENCY, 1))
+    async with _precompute_semaphore:
+        return await coro
+
+
+def prioritize_nodes(graph_data: Dict[str, Any], route_index: int = 0) -> List[Dict[str, Any]]:
+    """
+    Order the nodes of an AICP payload by how soon the UI shows them: target molecules first, then the nodes of the
+    route displayed by default, then all other nodes. Nodes listed in both synthesis graphs (same uuid) are returned
+    once.
+
+    Args:
+        graph_data (dict): validated AICP payload (``InputFile.dict()``)
+        route_index (int, optional): index of the displayed route in 'routes' (default: 0)
+
+    Returns:
+        list: node dicts in priority order
+    """
+    routes = graph_data.get("routes") or []
+    route_labels = set()
+    if 0 <= route_index < len(routes):
+        route_labels = set(routes[route_index].get("route_node_labels") or [])
+
+    def priority(node: Dict[str, Any]) -> int:
+        if str(node.get("srole") or "").lower() == "tm":
+            return 0
+        if node.get("node_label") in route_labels:
+            return 1
+        return 2
+
+    unique_nodes = {}
+    for node in iter_graph_nodes(graph_data):
+        unique_nodes.setdefault(node.get("uuid"), node)
+    return sorted(unique_nodes.values(), key=priority)
+
+
+async def _notify(on_depiction: Optional[DepictionCallback], nodes: List[Dict[str, Any]], svg: str) -> None:
+    if on_depiction is None:
+        return
+    for node in nodes:
+        try:
+            await on_depiction(node, svg)
+        except Exception as e:
+            logger.debug(f"Streaming the depiction of node {node.get('node_label')} failed: {e}")
+
+
+async def _precompute_molecule(
+    smiles: str, nodes: List[Dict[str, Any]], on_depiction: Optional[DepictionCallback] = None
+) -> None:
+    try:
+        svg = await _bounded(get_molecule_svg(smiles, *PRECOMPUTE_MOLECULE_SIZE))
+    except Exception as e:
+        logger.debug(f"Pre-render of molecule {smiles} failed: {e}")
+        return
+    await _notify(on_depiction, nodes, svg)
+
+
+async def _precompute_reaction(
+    rxsmiles: str, nodes: List[Dict[str, Any]], on_depiction: Optional[DepictionCallback] = None
+) -> Dict[str, Any]:
+    """
+    Render a reaction and, if it is atom mapped, normalize its roles, render the normalized reaction and compute its
+    balance indices. The depiction of the reaction is passed to ``on_depiction`` for each of its nodes as soon as it
+    is rendered.
+
+    Returns:
+        dict: 'has_atom_mapping', 'normalized_rxsmiles' and the rounded 'rbi', 'pbi' and 'tbi' (None if not available)
+    """
+
+    async def render() -> None:
+        svg = await _bounded(get_reaction_svg(rxsmiles, **PRECOMPUTE_REACTION_OPTIONS))
+        await _notify(on_depiction, nodes, svg)
+
+    result = {"has_atom_mapping": None, "normalized_rxsmiles": None, "rbi": None, "pbi": None, "tbi": None}
+    rendered = asyncio.ensure_future(render())
+    try:
+        result["has_atom_mapping"] = await _bounded(get_has_atom_mapping(rxsmiles))
+        if result["has_atom_mapping"]:
+            normalized, balance = await asyncio.gather(
+                _bounded(get_normalized_roles(rxsmiles)),
+                _bounded(get_balance_indices(rxsmiles)),
+                return_exceptions=True,
+            )
+            if isinstance(normalized, str):
+                result["normalized_rxsmiles"] = normalized
+                await _bounded(get_reaction_svg(normalized, **PRECOMPUTE_REACTION_OPTIONS))
+            if isinstance(balance, role_assigner_utils.RxnBalanceOutput):
+                result.update(rbi=round(balance.rbi, 2), pbi=round(balance.pbi, 2), tbi=round(balance.tbi, 2))
+    except Exception as e:
+        logger.debug(f"Pre-computing reaction {rxsmiles} failed: {e}")
+    await rendered
+    return result
+
+
+async def precompute_graph(
+    graph_data: Dict[str, Any], on_depiction: Optional[DepictionCallback] = None, route_index: int = 0
+) -> Dict[str, Any]:
+    """
+    Render every substance and reaction of an AICP payload and compute the normalized roles and balance indices of
+    its reactions, filling the render and chemistry caches. Work is deduplicated by SMILES and queued in the order of
+    ``prioritize_nodes``, so that the depictions shown first by the UI are rendered first.
+
+    Args:
+        graph_data (dict): validated AICP payload (``InputFile.dict()``)
+        on_depiction (callable, optional): coroutine function called with each node and its depiction as soon as the
+            depiction is rendered
+        route_index (int, optional): index of the route displayed by the UI (default: 0)
+
+    Returns:
+        dict: 'reactions' mapping reaction node uuids to the result of the reaction pre-computation
+    """
+    work: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for node in prioritize_nodes(graph_data, route_index):
+        node_type = str(node.get("node_type", "")).lower()
+        if node_type == "substance" and node.get("canonical_smiles"):
+            work.setdefault((node_type, node["canonical_smiles"]), []).append(node)
+        elif node_type == "reaction" and node.get("rxsmiles"):
+            work.setdefault((node_type, node["rxsmiles"]), []).append(node)
+
+    # gather() schedules the jobs in order and the semaphore of _bounded is FIFO, so the priority order is kept
+    results = await asyncio.gather(
+        *(
+            _precompute_molecule(smiles, nodes, on_depiction)
+            if node_type == "substance"
+            else _precompute_reaction(smiles, nodes, on_depiction)
+            for (node_type, smiles), nodes in work.items()
+        )
+    )
+
+    reactions = {}
+    for ((node_type, _), nodes), result in zip(work.items(), results):
+        if node_type == "reaction":
+            reactions.update((node["uuid"], result) for node in nodes)
+    return {"reactions": reactions}
+
+
+def chemistry_cache_stats() -> dict:
+    stats = CHEMISTRY_CACHE.stats()
+    stats["shared_computations"] = CHEMISTRY_FLIGHTS.shared
+    return stats
@@ -0,0 +1,108 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Canonical form and hash of a reaction SMILES, so that the same transformation written with renumbered atom maps,
+# reordered fragments or differently numbered fragment groups ('|f:...|') gets the same key. Used to key caches of
+# results that do not depend on how the reaction was written, and to merge duplicate reactions of a graph.
+#
+
+from typing import Dict, List, Tuple
+
+from rdkit import Chem
+
+from cache_utils import make_cache_key
+from decomposition_utils import FragmentGroupError, parse_reaction_smiles
+from mol_cache_utils import mol_from_smiles
+
+
+class ReactionCanonicalizationError(Exception):
+    """Exception raised for reaction SMILES that cannot be canonicalized, e.g. because a component cannot be parsed."""
+
+    def __init__(self, rxsmiles: str, message: str):
+        self.rxsmiles = rxsmiles
+        self.message = message
+        super().__init__(self.message)
+
+
+def _parse_components(rxsmiles: str) -> Tuple[List[str], List[str], List[str]]:
+    try:
+        parsed = parse_reaction_smiles(rxsmiles)
+    except (ValueError, FragmentGroupError) as e:
+        raise ReactionCanonicalizationError(rxsmiles, f"Invalid reaction SMILES {rxsmiles}: {e}") from e
+    return parsed.reactants, parsed.reagents, parsed.products
+
+
+def _parse_component(rxsmiles: str, smiles: str) -> Chem.Mol:
+    mol = mol_from_smiles(smiles)
+    if mol is None:
+        raise ReactionCanonicalizationError(rxsmiles, f"RDKit cannot parse component {smiles} of {rxsmiles}")
+    return mol
+
+
+def _unmapped_smiles(mol: Chem.Mol) -> Tuple[str, List[int]]:
+    """Canonical SMILES of the molecule without atom maps, and the atom indices in the order they are written."""
+    unmapped = Chem.Mol(mol)
+    for atom in unmapped.GetAtoms():
+        atom.SetAtomMapNum(0)
+    smiles = Chem.MolToSmiles(unmapped)
+    return smiles, list(unmapped.GetPropsAsDict(True, True)["_smilesAtomOutputOrder"])
+
+
+def canonicalize_reaction(rxsmiles: str, keep_atom_maps: bool = False) -> str:
+    """
+    Canonical form of a reaction SMILES. Every component (a fragment, or the fragments of a fragment group) is written
+    as RDKit canonical SMILES, and the components of the reactants, reagents and products are sorted. Fragment groups
+    are kept as components, so only the numbering of the '|f:...|' extension is lost.
+
+    With ``keep_atom_maps`` the atom mapping is kept, but renumbered: atoms are numbered in the order they are written
+    in the canonical SMILES of the products, then of the reactants and reagents. So two reactions get the same form if
+    they map the same atoms onto each other, whatever map numbers they use. Symmetric atoms, and identical components
+    on the same side, may still be numbered differently depending on the input order.
+
+    Args:
+        rxsmiles (str): reaction SMILES with an optional extension
+        keep_atom_maps (bool): keep the (renumbered) atom mapping instead of dropping the atom map numbers
+
+    Returns:
+        str: canonical reaction SMILES without extension, e.g. 'CCO.CC(=O)O>>CCOC(C)=O'
+
+    Raises:
+        ReactionCanonicalizationError: if the reaction SMILES is invalid or RDKit cannot parse one of its components
+    """
+    sections = [
+        [_parse_component(rxsmiles, smiles) for smiles in section] for section in _parse_components(rxsmiles)
+    ]
+    # Unmapped canonical SMILES and atom output order of the components, sorted within the reactants, reagents and
+    # products
+    unmapped = [sorted((_unmapped_smiles(mol) + (mol,) for mol in section), key=lambda x: x[0]) for section in sections]
+    if not keep_atom_maps:
+        return ">".join(".".join(smiles for smiles, _, _ in section) for section in unmapped)
+
+    renumbered: Dict[int, int] = {}
+    reactants, reagents, products = unmapped
+    for section in [products, reactants, reagents]:
+        for _, atom_order, mol in section:
+            for index in atom_order:
+                atom = mol.GetAtomWithIdx(index)
+                map_number = atom.GetAtomMapNum()
+                if map_number:
+                    atom.SetAtomMapNum(renumbered.setdefault(map_number, len(renumbered) + 1))
+    return ">".join(".".join(sorted(Chem.MolToSmiles(mol) for _, _, mol in section)) for section in unmapped)
+
+
+def reaction_key(rxsmiles: str, keep_atom_maps: bool = False) -> str:
+    """
+    Stable hash of the canonical form of a reaction SMILES (see ``canonicalize_reaction``). Reactions that cannot
+    be canonicalized are keyed by the stripped input instead, so they only match themselves.
+
+    Args:
+        rxsmiles (str): reaction SMILES with an optional extension
+        keep_atom_maps (bool): whether the atom mapping is part of the key
+
+    Returns:
+        str: hex encoded SHA-256 digest
+    """
+    try:
+        return make_cache_key("reaction", keep_atom_maps, canonicalize_reaction(rxsmiles, keep_atom_maps))
+    except ReactionCanonicalizationError:
+        return make_cache_key("reaction_input", rxsmiles.strip())
@@ -0,0 +1,625 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Cached rendering of molecule and reaction SMILES to SVG and PNG. Renders are keyed by canonical SMILES plus the draw
+# options, so a molecule that has been drawn once is served from memory (or from disk after a restart).
+#
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+from rdkit import Chem
+
+from cache_utils import MISSING, LRUCache, TieredCache, make_cache_key
+from draw_utils import (
+    SVG_ROOT_PATTERN,
+    draw_molecule_degraded,
+    draw_molecule_png,
+    draw_molecule_svg,
+    get_svg_dimensions,
+    mol_to_image,
+    reaction_smiles_to_image,
+    text_to_png,
+)
+from executor_utils import PROCESS_POOL, SingleFlight, TaskQueueTimeoutError, TaskTimeoutError
+from mol_cache_utils import mol_from_smiles
+
+logger = logging.getLogger(__name__)
+
+# Returned for reactions that cannot be drawn
+UNRENDERABLE_REACTION_SVG = """
+        <svg width="450" height="75" xmlns="http://www.w3.org/2000/svg">
+          <rect width="100%" height="100%" fill="white" />
+          <text x="10" y="50" font-size="32" fill="black">Unable to generate reaction SVG</text>
+        </svg>
+        """.strip()
+
+# Media types of the supported image formats
+IMAGE_MEDIA_TYPES = {"svg": "image/svg+xml", "png": "image/png"}
+
+# Part of every render key, bump it whenever the depictions change so that clients and caches fetch them again
+RENDER_VERSION = 2
+
+RENDER_CACHE = TieredCache(
+    "render",
+    max_entries=int(os.getenv("RW_RENDER_CACHE_SIZE", "4096")),
+    directory=os.getenv("RW_RENDER_CACHE_DIR") or None,
+    max_disk_bytes=int(os.getenv("RW_RENDER_CACHE_DISK_BYTES", str(512 * 1024 * 1024))),
+    max_negative_entries=int(os.getenv("RW_RENDER_NEGATIVE_CACHE_SIZE", "1024")),
+)
+
+# Render keys by the raw input and draw options, so that repeated requests do not parse their SMILES with RDKit again
+RENDER_KEYS = LRUCache(int(os.getenv("RW_RENDER_KEY_CACHE_SIZE", "16384")), name="render_keys")
+
+# Concurrent renders of the same depiction (e.g. by the upload pre-render and the UI) share one worker task
+RENDER_FLIGHTS = SingleFlight()
+
+# Number of batch items whose cache keys are computed by one worker task
+KEY_CHUNK_SIZE = 64
+
+# Elements of an SVG body and their inline style / class attributes, used to share styles across sprite symbols
+SVG_ELEMENT_PATTERN = re.compile(r"<(\w+)\b([^<>]*?)(\s*/?)>")
+SVG_STYLE_ATTRIBUTE_PATTERN = re.compile(r"\sstyle=(['\"])(.*?)\1", re.DOTALL)
+SVG_CLASS_ATTRIBUTE_PATTERN = re.compile(r"\sclass=(['\"])(.*?)\1", re.DOTALL)
+
+# Draw reactions on a single canvas ("canvas"), or draw every component separately and combine the SVGs ("composite")
+REACTION_DRAWING_MODE = os.getenv("RW_REACTION_DRAWING", "canvas").lower()
+
+
+# Time budget of a single render, and of the degraded depiction returned instead if a render exceeds it
+RENDER_TIMEOUT = float(os.getenv("RW_RENDER_TIMEOUT", "10"))
+DEGRADED_RENDER_TIMEOUT = float(os.getenv("RW_DEGRADED_RENDER_TIMEOUT", "2"))
+
+# Recorded in the negative cache for inputs that exceeded the render budget, they are answered with the degraded
+# depiction straight away until the entry expires after RENDER_TIMEOUT_TTL seconds
+RENDER_TIMED_OUT = "timed out"
+RENDER_TIMEOUT_TTL = float(os.getenv("RW_RENDER_TIMEOUT_TTL", "600"))
+
+# Skips the expensive steps of a reaction depiction: abbreviations, alignment, highlights and molecule preparation
+DEGRADED_REACTION_OPTIONS = {
+    "highlight": False,
+    "align": False,
+    "abbreviate": False,
+    "show_atom_indices": False,
+    "kekulize": False,
+    "addChiralHs": False,
+    "wedgeBonds": False,
+}
+
+
+class MoleculeRenderError(Exception):
+    """Exception raised when a molecule SMILES cannot be parsed or drawn."""
+
+    def __init__(self, smiles: str, message: str, invalid_smiles: bool = False):
+        self.smiles = smiles
+        self.message = message
+        self.invalid_smiles = invalid_smiles
+        super().__init__(self.message)
+
+    def __reduce__(self):
+        # Raised in the worker processes, so it must survive pickling with all of its arguments
+        return self.__class__, (self.smiles, self.message, self.invalid_smiles)
+
+
+class ReactionRenderError(Exception):
+    """Exception raised when a reaction SMILES cannot be parsed or drawn."""
+
+    def __init__(self, rxsmiles: str, message: str):
+        self.rxsmiles = rxsmiles
+        self.message = message
+        super().__init__(self.message)
+
+    def __reduce__(self):
+        # Raised in the worker processes, so it must survive pickling with all of its arguments
+        return self.__class__, (self.rxsmiles, self.message)
+
+
+def canonical_reaction_smiles(rxsmiles: str, clear_atom_maps: bool = False) -> str:
+    """
+    Canonicalize every fragment of a reaction SMILES in place. The order of fragments, the atom map numbers and any
+    extension (e.g. '|f:1.2|') are preserved, as these all influence the depiction. The atom map numbers only do so
+    with highlighting or atom indices, otherwise they can be cleared.
+
+    Args:
+        rxsmiles (str): reaction SMILES with an optional extension
+        clear_atom_maps (bool): drop the atom map numbers, so that renumbered reactions get the same SMILES
+
+    Returns:
+        str: reaction SMILES with canonical fragments, or the stripped input if any fragment cannot be parsed
+    """
+    rxsmiles = rxsmiles.strip()
+    smiles, _, extension = rxsmiles.partition("|")
+    sections = smiles.strip().split(">")
+    canonical_sections = []
+    for section in sections:
+        fragments = []
+        for fragment in section.split(".") if section else []:
+            mol = mol_from_smiles(fragment)
+            if mol is None:
+                return rxsmiles
+            if clear_atom_maps:
+                for atom in mol.GetAtoms():
+                    atom.SetAtomMapNum(0)
+            fragments.append(Chem.MolToSmiles(mol))
+        canonical_sections.append(".".join(fragments))
+    canonical = ">".join(canonical_sections)
+    return f"{canonical} |{extension.strip()}" if extension else canonical
+
+
+def reaction_render_key(
+    rxsmiles: str, highlight: bool, show_atom_indices: bool, retro: bool = False, image_format: str = "svg"
+) -> str:
+    raw = ("reaction", rxsmiles, highlight, show_atom_indices, retro, image_format)
+    key = RENDER_KEYS.get(raw)
+    if key is MISSING:
+        key = make_cache_key(
+            "reaction",
+            RENDER_VERSION,
+            image_format,
+            canonical_reaction_smiles(rxsmiles, clear_atom_maps=not (highlight or show_atom_indices)),
+            highlight,
+            show_atom_indices,
+            retro,
+            REACTION_DRAWING_MODE,
+        )
+        RENDER_KEYS.put(raw, key)
+    return key
+
+
+def molecule_render_key(smiles: str, img_width: int, img_height: int, image_format: str = "svg") -> str:
+    raw = ("molecule", smiles, img_width, img_height, image_format)
+    key = RENDER_KEYS.get(raw)
+    if key is MISSING:
+        mol = mol_from_smiles(smiles) if smiles else None
+        canonical = Chem.MolToSmiles(mol) if mol is not None else smiles
+        key = make_cache_key("molecule", RENDER_VERSION, image_format, canonical, img_width, img_height)
+        RENDER_KEYS.put(raw, key)
+    return key
+
+
+def render_etag(key: str, *variant: Any) -> str:
+    """
+    Build a strong HTTP ETag for a render. The render key already covers the canonical input, the draw options and
+    ``RENDER_VERSION``. ``variant`` distinguishes different response bodies of the same render (e.g. JSON wrapping).
+    """
+    return f'"{make_cache_key(key, *variant) if variant else key}"'
+
+
+@functools.lru_cache(maxsize=None)
+def unrenderable_reaction_image(image_format: str = "svg") -> Any:
+    """Return the placeholder depiction for reactions that cannot be drawn, as SVG text or PNG bytes."""
+    if image_format == "png":
+        return text_to_png("Unable to generate reaction PNG", 450, 75)
+    return UNRENDERABLE_REACTION_SVG
+
+
+def render_reaction_svg(
+    rxsmiles: str, highlight: bool, show_atom_indices: bool, retro: bool = False, image_format: str = "svg"
+) -> Any:
+    """
+    Draw a reaction SMILES to SVG (or PNG) without consulting the cache.
+
+    Returns:
+        str: SVG text, or bytes of the PNG if image_format is 'png'
+
+    Raises:
+        ReactionRenderError: if the reaction cannot be parsed or drawn
+    """
+    try:
+        return reaction_smiles_to_image(
+            rxsmiles,
+            svg=image_format != "png",
+            return_png=True,
+            align=False,
+            transparent=False,
+            highlight=highlight,
+            retro=retro,
+            show_atom_indices=show_atom_indices,
+            single_canvas=REACTION_DRAWING_MODE != "composite",
+        )
+    except Exception as e:
+        raise ReactionRenderError(rxsmiles, f"Failed to draw reaction {rxsmiles}: {e}") from e
+
+
+def render_molecule_svg(smiles: str, img_width: int, img_height: int, image_format: str = "svg") -> Any:
+    """
+    Draw a molecule SMILES to SVG (or PNG) without consulting the cache.
+
+    Returns:
+        str: SVG text, or bytes of the PNG if image_format is 'png'
+
+    Raises:
+        MoleculeRenderError: if the SMILES is empty, cannot be parsed or cannot be drawn
+    """
+    if not smiles:
+        raise MoleculeRenderError(smiles, "Empty SMILES string provided", invalid_smiles=True)
+
+    mol = mol_from_smiles(smiles)
+    if mol is None:
+        raise MoleculeRenderError(smiles, f"Invalid SMILES string: {smiles}", invalid_smiles=True)
+
+    try:
+        if image_format == "png":
+            return draw_molecule_png(mol, img_width, img_height)
+        return draw_molecule_svg(mol, img_width, img_height)
+    except Exception as e:
+        raise MoleculeRenderError(smiles, f"Failed to draw molecule: {smiles}") from e
+
+
+def render_degraded_reaction(rxsmiles: str, retro: bool = False, image_format: str = "svg") -> Any:
+    """
+    Draw the cheap depiction of a reaction SMILES (see ``DEGRADED_REACTION_OPTIONS``) without consulting the cache.
+
+    Returns:
+        str: SVG text, or bytes of the PNG if image_format is 'png'
+    """
+    return reaction_smiles_to_image(
+        rxsmiles,
+        svg=image_format != "png",
+        return_png=True,
+        transparent=False,
+        retro=retro,
+        single_canvas=REACTION_DRAWING_MODE != "composite",
+        **DEGRADED_REACTION_OPTIONS,
+    )
+
+
+def render_degraded_molecule(smiles: str, img_width: int, img_height: int, image_format: str = "svg") -> Any:
+    """
+    Draw the cheap depiction of a molecule SMILES (see ``draw_molecule_degraded``) without consulting the cache.
+
+    Returns:
+        str: SVG text, or bytes of the PNG if image_format is 'png'
+    """
+    mol = mol_from_smiles(smiles)
+    if mol is None:
+        raise MoleculeRenderError(smiles, f"Invalid SMILES string: {smiles}", invalid_smiles=True)
+    return draw_molecule_degraded(mol, img_width, img_height, svg=image_format != "png")
+
+
+async def get_degraded_image(key: str, fn, *args: Any) -> Optional[Any]:
+    """
+    Return the degraded depiction for the render with the given key, rendering it with ``fn(*args)`` on the process
+    pool within ``DEGRADED_RENDER_TIMEOUT`` if it is not cached yet.
+
+    Returns:
+        str or bytes: the depiction, or None if it cannot be drawn within its time budget either
+    """
+    degraded_key = make_cache_key(key, "degraded")
+    image = RENDER_CACHE.get(degraded_key)
+    if image is not MISSING:
+        return image
+
+    try:
+        image = await RENDER_FLIGHTS.run(
+            degraded_key, lambda: PROCESS_POOL.run(fn, *args, timeout=DEGRADED_RENDER_TIMEOUT)
+        )
+    except Exception as e:
+        logger.warning(f"Degraded render {getattr(fn, '__name__', fn)}{args} failed: {e}")
+        return None
+
+    RENDER_CACHE.put(degraded_key, image)
+    return image
+
+
+async def get_reaction_svg(
+    rxsmiles: str,
+    highlight: bool,
+    show_atom_indices: bool,
+    retro: bool = False,
+    key: Optional[str] = None,
+    image_format: str = "svg",
+) -> Any:
+    """
+    Return the SVG for a reaction SMILES, rendering it on the process pool only if it is not cached yet. Reactions
+    that fail to render are remembered and answered with ``UNRENDERABLE_REACTION_SVG`` straight away. Reactions that
+    exceed ``RENDER_TIMEOUT`` are remembered as well and answered with a degraded depiction.
+
+    Args:
+        rxsmiles (str): reaction SMILES with an optional extension
+        highlight (bool): highlight atoms based on atom mapping
+        show_atom_indices (bool): show atom map numbers as atom notes
+        retro (bool, optional): draw a retrosynthetic arrow (default: False)
+        key (str, optional): precomputed ``reaction_render_key``
+        image_format (str, optional): 'svg' or 'png' (default: 'svg')
+
+    Returns:
+        str: SVG text, or bytes of the PNG if image_format is 'png'
+    """
+    key = key or reaction_render_key(rxsmiles, highlight, show_atom_indices, retro, image_format)
+    image = RENDER_CACHE.get(key)
+    if image is not MISSING:
+        return image
+    failure = RENDER_CACHE.get_failure(key)
+    if failure == RENDER_TIMED_OUT:
+        image = await get_degraded_image(key, render_degraded_reaction, rxsmiles, retro, image_format)
+        return image if image is not None else unrenderable_reaction_image(image_format)
+    if failure is not None:
+        return unrenderable_reaction_image(image_format)
+
+    try:
+        image = await RENDER_FLIGHTS.run(
+            key,
+            lambda: PROCESS_POOL.run(
+                render_reaction_svg, rxsmiles, highlight, show_atom_indices, retro, image_format, timeout=RENDER_TIMEOUT
+            ),
+        )
+    except TaskTimeoutError as e:
+        logger.warning(f"Rendering reaction {rxsmiles} exceeded its time budget, drawing a degraded depiction: {e}")
+        remember_timeout(key, e)
+        image = await get_degraded_image(key, render_degraded_reaction, rxsmiles, retro, image_format)
+        return image if image is not None else unrenderable_reaction_image(image_format)
+    except ReactionRenderError as e:
+        logger.warning(e.message)
+        RENDER_CACHE.put_failure(key, e.message)
+        return unrenderable_reaction_image(image_format)
+    except Exception as e:
+        # The process pool failed (e.g. a worker crashed or the pool shut down), not the input: try again next time
+        logger.warning(f"Failed to render reaction {rxsmiles}: {e}")
+        return unrenderable_reaction_image(image_format)
+
+    RENDER_CACHE.put(key, image)
+    return image
+
+
+async def get_molecule_svg(
+    smiles: str, img_width: int, img_height: int, key: Optional[str] = None, image_format: str = "svg"
+) -> Any:
+    """
+    Return the SVG for a molecule SMILES, rendering it on the process pool only if it is not cached yet. Molecules
+    that exceed ``RENDER_TIMEOUT`` are remembered and answered with a degraded depiction.
+
+    Args:
+        smiles (str): molecule SMILES
+        img_width (int): width of the SVG in pixels
+        img_height (int): height of the SVG in pixels
+        key (str, optional): precomputed ``molecule_render_key``
+        image_format (str, optional): 'svg' or 'png' (default: 'svg')
+
+    Returns:
+        str: SVG text, or bytes of the PNG if image_format is 'png'
+
+    Raises:
+        MoleculeRenderError: if the SMILES is invalid or cannot be drawn (also for known failures)
+        TaskTimeoutError: if neither the molecule nor its degraded depiction can be drawn within their time budgets
+    """
+    key = key or molecule_render_key(smiles, img_width, img_height, image_format)
+    image = RENDER_CACHE.get(key)
+    if image is not MISSING:
+        return image
+    failure = RENDER_CACHE.get_failure(key)
+    if failure == RENDER_TIMED_OUT:
+        return await get_degraded_molecule_svg(key, smiles, img_width, img_height, image_format)
+    if failure is not None:
+        message, invalid_smiles = failure
+        raise MoleculeRenderError(smiles, message, invalid_smiles=invalid_smiles)
+
+    try:
+        image = await RENDER_FLIGHTS.run(
+            key,
+            lambda: PROCESS_POOL.run(
+                render_molecule_svg, smiles, img_width, img_height, image_format, timeout=RENDER_TIMEOUT
+            ),
+        )
+    except MoleculeRenderError as e:
+        RENDER_CACHE.put_failure(key, (e.message, e.invalid_smiles))
+        raise
+    except TaskTimeoutError as e:
+        logger.warning(f"Rendering molecule {smiles} exceeded its time budget, drawing a degraded depiction: {e}")
+        remember_timeout(key, e)
+        return await get_degraded_molecule_svg(key, smiles, img_width, img_height, image_format)
+
+    RENDER_CACHE.put(key, image)
+    return image
+
+
+def remember_timeout(key: str, error: TaskTimeoutError) -> None:
+    """
+    Answer the key with its degraded depiction for ``RENDER_TIMEOUT_TTL`` seconds. Only renders that exceeded their
+    budget while running are remembered: a render that did not get a worker in time says nothing about its input.
+    """
+    if not isinstance(error, TaskQueueTimeoutError):
+        RENDER_CACHE.put_failure(key, RENDER_TIMED_OUT, ttl=RENDER_TIMEOUT_TTL)
+
+
+async def get_degraded_molecule_svg(key: str, smiles: str, img_width: int, img_height: int, image_format: str) -> Any:
+    image = await get_degraded_image(key, render_degraded_molecule, smiles, img_width, img_height, image_format)
+    if image is None:
+        raise TaskTimeoutError(render_molecule_svg.__name__, RENDER_TIMEOUT)
+    return image
+
+
+def render_item_key(item: Dict[str, Any]) -> str:
+    """Return the render cache key of a batch item (see ``render_batch``)."""
+    if item["kind"] == "reaction":
+        return reaction_render_key(item["smiles"], item["highlight"], item["show_atom_indices"], item["retro"])
+    return molecule_render_key(item["smiles"], item["img_width"], item["img_height"])
+
+
+def render_item_keys(items: List[Dict[str, Any]]) -> List[str]:
+    return [render_item_key(item) for item in items]
+
+
+async def render_item(item: Dict[str, Any], key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Render a single batch item (see ``render_batch``).
+
+    Returns:
+        dict: with the keys 'svg', 'width', 'height' and 'error'. On failure 'error' holds the reason, 'svg' is the
+        fallback depiction for reactions and None for molecules.
+    """
+    error = None
+    if item["kind"] == "reaction":
+        svg = await get_reaction_svg(
+            item["smiles"], item["highlight"], item["show_atom_indices"], item["retro"], key=key
+        )
+        if svg == UNRENDERABLE_REACTION_SVG:
+            error = "Unable to generate reaction SVG"
+    else:
+        try:
+            svg = await get_molecule_svg(item["smiles"], item["img_width"], item["img_height"], key=key)
+        except (MoleculeRenderError, TaskTimeoutError) as e:
+            svg, error = None, e.message
+
+    width, height = get_svg_dimensions(svg) if svg else (None, None)
+    return {"svg": svg, "width": width, "height": height, "error": error}
+
+
+async def render_batch(items: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Render a batch of molecules and reactions on the process pool. Items resolving to the same depiction (same
+    canonical SMILES and draw options) are rendered only once.
+
+    Args:
+        items (list): dicts with the keys 'id', 'kind' ('molecule' or 'reaction'), 'smiles', 'highlight',
+            'show_atom_indices', 'retro', 'img_width' and 'img_height'
+
+    Returns:
+        dict: item id -> result of ``render_item``
+    """
+    # Canonicalizing the SMILES for the cache keys is CPU bound as well, so it is done in chunks on the pool
+    chunks = [items[i:i + KEY_CHUNK_SIZE] for i in range(0, len(items), KEY_CHUNK_SIZE)]
+    chunk_keys = await asyncio.gather(*(PROCESS_POOL.run(render_item_keys, chunk) for chunk in chunks))
+    keys = [key for chunk in chunk_keys for key in chunk]
+
+    unique_items: Dict[str, Dict[str, Any]] = {}
+    for item, key in zip(items, keys):
+        unique_items.setdefault(key, item)
+
+    rendered = await asyncio.gather(*(render_item(item, key) for key, item in unique_items.items()))
+    results_by_key = dict(zip(unique_items.keys(), rendered))
+    return {item["id"]: dict(results_by_key[key]) for item, key in zip(items, keys)}
+
+
+def symbol_render_key(smiles: str) -> str:
+    mol = mol_from_smiles(smiles) if smiles else None
+    canonical = Chem.MolToSmiles(mol) if mol is not None else smiles
+    return make_cache_key("symbol", RENDER_VERSION, canonical)
+
+
+def render_symbol_svg(smiles: str) -> str:
+    """
+    Draw a substance for a sprite sheet with ``mol_to_image``, i.e. sized to the molecule on a transparent canvas.
+
+    Raises:
+        MoleculeRenderError: if the SMILES is empty, cannot be parsed or cannot be drawn
+    """
+    mol = mol_from_smiles(smiles) if smiles else None
+    if mol is None:
+        raise MoleculeRenderError(smiles, f"Invalid SMILES string: {smiles}", invalid_smiles=True)
+    try:
+        return mol_to_image(mol)
+    except Exception as e:
+        raise MoleculeRenderError(smiles, f"Failed to draw molecule: {smiles}") from e
+
+
+async def get_symbol_svg(smiles: str) -> Optional[str]:
+    """
+    Return the sprite sheet depiction of a substance, rendering it on the process pool only if it is not cached yet.
+
+    Returns:
+        str: SVG text, or None if the substance cannot be drawn
+    """
+    key = symbol_render_key(smiles)
+    svg = RENDER_CACHE.get(key)
+    if svg is not MISSING:
+        return svg
+    if RENDER_CACHE.get_failure(key) is not None:
+        return None
+
+    try:
+        svg = await RENDER_FLIGHTS.run(key, lambda: PROCESS_POOL.run(render_symbol_svg, smiles, timeout=RENDER_TIMEOUT))
+    except (MoleculeRenderError, TaskTimeoutError) as e:
+        logger.warning(f"Failed to render sprite symbol {smiles}: {e.message}")
+        if isinstance(e, MoleculeRenderError):
+            RENDER_CACHE.put_failure(key, (e.message, e.invalid_smiles))
+        return None
+
+    RENDER_CACHE.put(key, svg)
+    return svg
+
+
+def build_sprite_sheet(symbols: List[Tuple[str, str]]) -> str:
+    """
+    Combine SVG depictions into a single SVG document with one ``<symbol>`` per depiction. Inline styles, which RDKit
+    repeats on every element, are replaced by classes of a shared style sheet. An index of the symbol sizes is
+    included as JSON in the ``<metadata id='index'>`` element.
+
+    Args:
+        symbols (list): (symbol id, SVG text) pairs
+
+    Returns:
+        str: SVG sprite sheet
+    """
+    style_classes: Dict[str, str] = {}
+
+    def share_style(match: re.Match) -> str:
+        name, attributes, end = match.groups()
+        style = SVG_STYLE_ATTRIBUTE_PATTERN.search(attributes)
+        if not style:
+            return match.group(0)
+        style_class = style_classes.setdefault(style.group(2), f"rw-s{len(style_classes)}")
+        attributes = attributes[:style.start()] + attributes[style.end():]
+        if SVG_CLASS_ATTRIBUTE_PATTERN.search(attributes):
+            attributes = SVG_CLASS_ATTRIBUTE_PATTERN.sub(
+                lambda m: f" class={m.group(1)}{m.group(2)} {style_class}{m.group(1)}", attributes, count=1
+            )
+        else:
+            attributes += f" class='{style_class}'"
+        return f"<{name}{attributes}{end}>"
+
+    index = {}
+    symbol_elements = []
+    for symbol_id, svg in symbols:
+        root = SVG_ROOT_PATTERN.search(svg)
+        width, height = get_svg_dimensions(svg)
+        if not root or width is None:
+            continue
+        body = svg[root.end():svg.rindex("</svg>")].replace("<!-- END OF HEADER -->", "").strip()
+        body = SVG_ELEMENT_PATTERN.sub(share_style, body)
+        symbol_elements.append(f"<symbol id={quoteattr(symbol_id)} viewBox='0 0 {width:g} {height:g}'>\n{body}\n</symbol>")
+        index[symbol_id] = {"width": width, "height": height}
+
+    styles = "\n".join(f".{name} {{ {style} }}" for style, name in style_classes.items())
+    return "\n".join([
+        "<?xml version='1.0' encoding='utf-8'?>",
+        "<svg xmlns='http://www.w3.org/2000/svg' xmlns:xlink='http://www.w3.org/1999/xlink'>",
+        f"<metadata id='index'>{escape(json.dumps(index))}</metadata>",
+        f"<defs>\n<style type='text/css'>\n{styles}\n</style>\n</defs>",
+        *symbol_elements,
+        "</svg>",
+    ])
+
+
+async def render_sprite_sheet(substances: Dict[str, str]) -> str:
+    """
+    Render substances into an SVG sprite sheet (see ``build_sprite_sheet``). Substances that cannot be drawn are
+    left out, and so are missing from the index.
+
+    Args:
+        substances (dict): symbol id (e.g. InChIKey) -> SMILES
+
+    Returns:
+        str: SVG sprite sheet
+    """
+    ids = list(substances)
+    svgs = await asyncio.gather(*(get_symbol_svg(substances[symbol_id]) for symbol_id in ids))
+    symbols = [(symbol_id, svg) for symbol_id, svg in zip(ids, svgs) if svg]
+    return await PROCESS_POOL.run(build_sprite_sheet, symbols)
+
+
+def sprite_sheet_etag(substances: Dict[str, str]) -> str:
+    return render_etag(make_cache_key("sprite", RENDER_VERSION, sorted(substances.items())))
+
+
+def render_cache_stats() -> dict:
+    stats = RENDER_CACHE.stats()
+    stats["shared_renders"] = RENDER_FLIGHTS.shared
+    stats["keys"] = RENDER_KEYS.stats()
+    return stats
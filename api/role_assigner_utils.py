@@ -15,14 +15,25 @@
 # the root of the repository. Additionally some code was adapted as part of 'decomposition_utils'.
 #
 
-from typing import Any, List
+import os
+from typing import Any, FrozenSet, List, NamedTuple, Optional
 
+import numpy as np
 from pydantic import BaseModel
 from rdkit import Chem
 from rdkit.Chem import AllChem
 from rdkit.Chem.rdMolDescriptors import CalcNumHeavyAtoms
 
 import decomposition_utils
+import smiles_tokenizer_utils
+from cache_utils import MISSING, LRUCache, register_worker_cache
+from mol_cache_utils import mol_from_smiles, smiles_sanitizes
+
+# Properties of the substances and fragments seen by normalize_roles. The same reagents and solvents come up in
+# nearly every reaction, so they are parsed by RDKit once per worker process
+FRAGMENT_CACHE = register_worker_cache(
+    LRUCache(int(os.getenv("RW_FRAGMENT_CACHE_SIZE", "16384")), name="fragment_properties")
+)
 
 class RxsmilesAtomMappingException(Exception):
     """Exception raised when a reaction smiles has no atom mapping or cannot get one."""
@@ -44,7 +55,7 @@ def determine_max_reactant_index(rxsmiles: str) -> int:
 
 
 def determine_max_reactant_index_from_parsed_rxn(
-    parsed_rxn: decomposition_utils.ParsedReaction,
+    parsed_rxn: decomposition_utils.ReactionParse,
 ) -> int:
     return determine_max_reactant_index(parsed_rxn.rxsmiles)
 
@@ -64,7 +75,7 @@ def determine_min_product_index(rxsmiles: str) -> int:
 
 
 def determine_min_product_index_from_parsed_rxn(
-    parsed_rxn: decomposition_utils.ParsedReaction,
+    parsed_rxn: decomposition_utils.ReactionParse,
 ) -> int:
     return determine_min_product_index(parsed_rxn.rxsmiles)
 
@@ -85,7 +96,7 @@ def determine_max_product_index(rxsmiles: str) -> int:
 
 
 def determine_max_product_index_from_parsed_rxn(
-    parsed_rxn: decomposition_utils.ParsedReaction,
+    parsed_rxn: decomposition_utils.ReactionParse,
 ) -> int:
     return determine_max_product_index(parsed_rxn.rxsmiles)
 
@@ -124,6 +135,11 @@ def are_fragment_indices_coherent(
 
 def validate_f_section_indices(rxsmiles: str) -> bool:
     parsed_rxn = decomposition_utils.parse_reaction_smiles(rxsmiles)
+    return _validate_f_section_indices(parsed_rxn)
+
+
+def _validate_f_section_indices(parsed_rxn: decomposition_utils.ReactionParse) -> bool:
+    rxsmiles = parsed_rxn.rxsmiles
 
     if not parsed_rxn.fragment_groups:
         raise ValueError(
@@ -175,6 +191,12 @@ def rxsmiles_has_atommapping(rxsmiles: str) -> bool:
     Returns:
         bool: True if atom mapping is found, False otherwise.
     """
+    try:
+        # Fast path, RDKit only has to parse what the tokenizer rejects
+        return smiles_tokenizer_utils.reaction_has_atom_mapping(rxsmiles)
+    except smiles_tokenizer_utils.SmilesTokenizerError:
+        pass
+
     try:
         # Parse the reaction SMILES into a reaction object
         rxn = AllChem.ReactionFromSmarts(rxsmiles)
@@ -194,6 +216,41 @@ def rxsmiles_has_atommapping(rxsmiles: str) -> bool:
         return False
 
 
+class FragmentProperties(NamedTuple):
+    parsed: bool  # Whether RDKit could parse the SMILES, the other properties are empty otherwise
+    charge: int
+    heavy_atoms: int
+    map_numbers: FrozenSet[int]
+
+
+def get_fragment_properties(smiles: str) -> FragmentProperties:
+    """
+    Formal charge, heavy atom count and atom map numbers of a (multi-fragment) SMILES, memoized in ``FRAGMENT_CACHE``.
+
+    Args:
+        smiles (str): SMILES of a substance or fragment
+
+    Returns:
+        FragmentProperties: the properties, with ``parsed`` False if RDKit cannot parse the SMILES
+    """
+    properties = FRAGMENT_CACHE.get(smiles)
+    if properties is not MISSING:
+        return properties
+
+    mol = mol_from_smiles(smiles)
+    if mol is None:
+        properties = FragmentProperties(parsed=False, charge=0, heavy_atoms=0, map_numbers=frozenset())
+    else:
+        properties = FragmentProperties(
+            parsed=True,
+            charge=Chem.GetFormalCharge(mol),
+            heavy_atoms=CalcNumHeavyAtoms(mol),
+            map_numbers=frozenset(atom.GetAtomMapNum() for atom in mol.GetAtoms() if atom.GetAtomMapNum() > 0),
+        )
+    FRAGMENT_CACHE.put(smiles, properties)
+    return properties
+
+
 def reassign_roles(
     substances: List[dict[str, Any]]
 ) -> List[dict[str, Any]]:  # noqa: C901
@@ -201,44 +258,24 @@ def reassign_roles(
     product_atom_indices: set[int] = set()
     for substance in substances:
         if substance["role"] == "product":
-            mol = Chem.MolFromSmiles(substance["smiles"])
-            if mol:
-                p_indices = set()
-                p_indices = {
-                    atom.GetAtomMapNum()
-                    for atom in mol.GetAtoms()
-                    if atom.GetAtomMapNum() > 0
-                }
-                product_atom_indices = product_atom_indices.union(p_indices)
+            properties = get_fragment_properties(substance["smiles"])
+            if properties.parsed:
+                product_atom_indices = product_atom_indices.union(properties.map_numbers)
 
     # Now scan reactants and see if any of them should be reagent instead
     for substance in substances:
         if substance["role"] == "reactant":
-            mol = Chem.MolFromSmiles(substance["smiles"])
-            if mol:
-                rc_indices = set()
-                rc_indices = {
-                    atom.GetAtomMapNum()
-                    for atom in mol.GetAtoms()
-                    if atom.GetAtomMapNum() > 0
-                }
-
-                if len(rc_indices.intersection(product_atom_indices)) == 0:
+            properties = get_fragment_properties(substance["smiles"])
+            if properties.parsed:
+                if len(properties.map_numbers.intersection(product_atom_indices)) == 0:
                     substance["role"] = "reagent"
 
     # Now scan reagents and see if any of them should be reactant instead
     for substance in substances:
         if substance["role"] == "reagent":
-            mol = Chem.MolFromSmiles(substance["smiles"])
-            if mol:
-                rg_indices = set()
-                rg_indices = {
-                    atom.GetAtomMapNum()
-                    for atom in mol.GetAtoms()
-                    if atom.GetAtomMapNum() > 0
-                }
-
-                if len(rg_indices.intersection(product_atom_indices)) > 0:
+            properties = get_fragment_properties(substance["smiles"])
+            if properties.parsed:
+                if len(properties.map_numbers.intersection(product_atom_indices)) > 0:
                     substance["role"] = "reactant"
 
     return substances
@@ -246,12 +283,12 @@ def reassign_roles(
 
 # by ChatGPT
 def get_charge(smiles):
-    mol = Chem.MolFromSmiles(smiles)
-    if mol is None:
+    properties = get_fragment_properties(smiles)
+    if not properties.parsed:
         raise ValueError(
             f"[ERROR] SMILES not parseable in the get_charge function. Please check the SMILES {smiles}. Skipping RXSMILES."  # noqa: E501
         )
-    return Chem.GetFormalCharge(mol)
+    return properties.charge
 
 
 def reconstruct_rxsmiles(substances: List[dict[str, Any]]) -> str:  # noqa: C901
@@ -261,9 +298,12 @@ def reconstruct_rxsmiles(substances: List[dict[str, Any]]) -> str:  # noqa: C901
 
     # Calculate heavy atom count for each substance and assign to the needed array
     for substance in substances:
-        mol = Chem.MolFromSmiles(substance["smiles"])
-        heavy_atom_count = CalcNumHeavyAtoms(mol)
-        substance["heavy_atom_count"] = heavy_atom_count
+        properties = get_fragment_properties(substance["smiles"])
+        if not properties.parsed:
+            raise ValueError(
+                f"[ERROR] SMILES not parseable in the reconstruct_rxsmiles function. Please check the SMILES {substance['smiles']}."  # noqa: E501
+            )
+        substance["heavy_atom_count"] = properties.heavy_atoms
         if substance["role"] == "reactant":
             reactants.append(substance)
         elif substance["role"] == "reagent":
@@ -339,12 +379,15 @@ def normalize_roles(rxsmiles: str) -> str:
 
     # Parse the reaction SMILES into a reaction object
     parsed_rxn = decomposition_utils.parse_reaction_smiles(rxsmiles)
+    return _normalize_parsed_roles(parsed_rxn)
 
+
+def _normalize_parsed_roles(parsed_rxn: decomposition_utils.ReactionParse) -> str:
     # Check if the reaction SMILES has a fragment extension
     has_fragment_extension = False
     if parsed_rxn.fragment_groups and len(parsed_rxn.fragment_groups) > 0:
         has_fragment_extension = True  # noqa: F841
-        validate_f_section_indices(rxsmiles)
+        _validate_f_section_indices(parsed_rxn)
 
     rxsmiles_no_extension = parsed_rxn.rxsmiles_no_extension  # noqa: F841
     fragments_groups = parsed_rxn.fragment_groups  # noqa: F841
@@ -392,213 +435,368 @@ def compute_rbi(rxsmiles: str) -> float:
     return _compute_rbi(parsed_rxn)
 
 
-def _compute_rbi(parsed_reaction: decomposition_utils.ParsedReaction) -> float:
-    rxsmiles = parsed_reaction.rxsmiles
+def _compute_rbi(parsed_reaction: decomposition_utils.ReactionParse) -> float:
+    return _compute_balance_details(parsed_reaction).rbi
 
-    # Throw error if rxsmiles has no atom mapping
-    if not rxsmiles_has_atommapping(parsed_reaction.rxsmiles):
-        raise RxsmilesAtomMappingException(
-            rxsmiles=rxsmiles,
-            message=f"No atom mapping found in the RXSMILES: {rxsmiles}.",
-        )
 
-    all_reactant_atoms: list[Chem.Atom] = []
-    all_reactant_atom_indices: set[int] = set()
-    reactant_atom_indices: set[int] = set()
-
-    # This is by ChatGPT
-    for substance in parsed_reaction.reactants:
-        mol = Chem.MolFromSmiles(substance)
-        if mol:
-            atoms = set([atom for atom in mol.GetAtoms()])  # noqa: C403,C416
-            all_reactant_atoms.extend(atoms)
-            reactant_atom_indices = set()
-            reactant_atom_indices = {
-                atom.GetAtomMapNum()
-                for atom in mol.GetAtoms()
-                if atom.GetAtomMapNum() > 0
-            }
-
-            all_reactant_atom_indices = all_reactant_atom_indices.union(
-                reactant_atom_indices
-            )
+def compute_pbi(rxsmiles: str) -> float:
+    # Parse the reaction SMILES into a reaction object
+    parsed_rxn = decomposition_utils.parse_reaction_smiles(rxsmiles)
+    return _compute_pbi(parsed_rxn)
 
-    # See what fraction of reactant atoms are accounted for in product side
-    all_product_atom_indices: set[int] = set()
-    product_atom_indices: set[int] = set()
 
-    # This is by ChatGPT
-    for substance in parsed_reaction.products:
-        mol = Chem.MolFromSmiles(substance)
-        if mol:
-            product_atom_indices = set()
-            product_atom_indices = {
-                atom.GetAtomMapNum()
-                for atom in mol.GetAtoms()
-                if atom.GetAtomMapNum() > 0
-            }
-            all_product_atom_indices = all_product_atom_indices.union(
-                product_atom_indices
-            )
+def _compute_pbi(parsed_reaction: decomposition_utils.ReactionParse) -> float:
+    return _compute_balance_details(parsed_reaction).pbi
 
-    matching_indices = all_product_atom_indices.intersection(all_reactant_atom_indices)
 
-    # Evade div by zero
-    if len(all_reactant_atoms) == 0:
-        return 0.0
+def compute_tbi(rxsmiles: str) -> float:
+    # Parse the reaction SMILES into a reaction object
+    parsed_rxn = decomposition_utils.parse_reaction_smiles(rxsmiles)
+    return _compute_tbi(parsed_rxn)
 
-    rbi = float(100.0 * float(len(matching_indices)) / float(len(all_reactant_atoms)))
-    return rbi
 
+def _compute_tbi(parsed_reaction: decomposition_utils.ReactionParse) -> float:
+    return _compute_balance_details(parsed_reaction).tbi
 
-def compute_pbi(rxsmiles: str) -> float:
-    # Parse the reaction SMILES into a reaction object
-    parsed_rxn = decomposition_utils.parse_reaction_smiles(rxsmiles)
-    return _compute_pbi(parsed_rxn)
 
+class RxnBalanceOutput(BaseModel):
+    rxsmiles: str
+    rbi: float
+    pbi: float
+    tbi: float
 
-def _compute_pbi(parsed_reaction: decomposition_utils.ParsedReaction) -> float:
+
+class RxnBalanceDetails(RxnBalanceOutput):
+    reactant_atoms: int
+    product_atoms: int
+    matched_atoms: int
+    unmapped_reactant_atoms: int
+    unmapped_product_atoms: int
+
+
+class _SideAtoms:
+    """
+    Atom count and atom map numbers of one side of a reaction, collected in a single pass over its atoms. Substances
+    that RDKit sanitizes are read by the SMILES tokenizer where possible, all others are handled by the RDKit parse.
+    """
+
+    __slots__ = ("atoms", "unmapped_atoms", "map_numbers", "has_unsanitized_mapping", "parse_failed")
+
+    def __init__(self):
+        self.atoms = 0
+        self.unmapped_atoms = 0
+        self.map_numbers: set[int] = set()
+        # Atom maps of substances that fail sanitization, which count as atom mapping but not towards the indices
+        self.has_unsanitized_mapping = False
+        # A substance that is not even valid SMILES syntax, rxsmiles_has_atommapping reports no atom mapping then
+        self.parse_failed = False
+
+    def add(self, substances: List[str]) -> "_SideAtoms":
+        for substance in substances:
+            try:
+                scanned = smiles_tokenizer_utils.scan_smiles(substance)
+            except smiles_tokenizer_utils.SmilesTokenizerError:
+                scanned = None
+            # The tokenizer only checks the syntax, substances that fail sanitization (e.g. valence or kekulization
+            # errors) are left to the RDKit parse below so that they are not counted
+            if scanned is not None and smiles_sanitizes(substance):
+                self.map_numbers.update(scanned.map_numbers)
+                self.unmapped_atoms += scanned.atoms - len(scanned.map_numbers)
+                self.atoms += scanned.atoms
+                continue
+
+            mol = mol_from_smiles(substance)
+            if mol is None:
+                # Not counted, like in the original indices. Its atom maps still count as atom mapping though, as
+                # rxsmiles_has_atommapping does not sanitize the reaction
+                mol = mol_from_smiles(substance, sanitize=False)
+                if mol is None:
+                    self.parse_failed = True
+                elif any(atom.GetAtomMapNum() > 0 for atom in mol.GetAtoms()):
+                    self.has_unsanitized_mapping = True
+                continue
+            for atom in mol.GetAtoms():
+                map_number = atom.GetAtomMapNum()
+                if map_number > 0:
+                    self.map_numbers.add(map_number)
+                else:
+                    self.unmapped_atoms += 1
+            self.atoms += mol.GetNumAtoms()
+        return self
+
+
+def _has_atommapping(
+    parsed_reaction: decomposition_utils.ReactionParse, reactants: _SideAtoms, products: _SideAtoms
+) -> bool:
+    """Same result as ``rxsmiles_has_atommapping``, reusing the atom map numbers already collected."""
+    if reactants.parse_failed or products.parse_failed:
+        return False
+    reagents = _SideAtoms().add(parsed_reaction.reagents)
+    if reagents.parse_failed:
+        return False
+    return any(side.map_numbers or side.has_unsanitized_mapping for side in (reactants, products, reagents))
+
+
+def _compute_balance_details(parsed_reaction: decomposition_utils.ReactionParse) -> RxnBalanceDetails:
     rxsmiles = parsed_reaction.rxsmiles
 
+    reactants = _SideAtoms().add(parsed_reaction.reactants)
+    products = _SideAtoms().add(parsed_reaction.products)
+
     # Throw error if rxsmiles has no atom mapping
-    if not rxsmiles_has_atommapping(parsed_reaction.rxsmiles):
+    if not _has_atommapping(parsed_reaction, reactants, products):
         raise RxsmilesAtomMappingException(
             rxsmiles=rxsmiles,
             message=f"No atom mapping found in the RXSMILES: {rxsmiles}.",
         )
 
-    all_product_atoms: list[Chem.Atom] = []
-    all_product_atom_indices: set[int] = set()
-    product_atom_indices: set[int] = set()
+    return _balance_details(rxsmiles, reactants, products)
 
-    # This is by ChatGPT
-    for substance in parsed_reaction.products:
-        mol = Chem.MolFromSmiles(substance)
-        if mol:
-            atoms = set([atom for atom in mol.GetAtoms()])  # noqa: C403,C416
-            all_product_atoms.extend(atoms)
-            product_atom_indices = set()
-            product_atom_indices = {
-                atom.GetAtomMapNum()
-                for atom in mol.GetAtoms()
-                if atom.GetAtomMapNum() > 0
-            }
-            all_product_atom_indices = all_product_atom_indices.union(
-                product_atom_indices
-            )
-
-    # See what fraction of product atoms are accounted for in reactant side
-    all_reactant_atom_indices: set[int] = set()
-    reactant_atom_indices: set[int] = set()
-
-    # This is by ChatGPT
-    for substance in parsed_reaction.reactants:
-        mol = Chem.MolFromSmiles(substance)
-        if mol:
-            reactant_atom_indices = set()
-            reactant_atom_indices = {
-                atom.GetAtomMapNum()
-                for atom in mol.GetAtoms()
-                if atom.GetAtomMapNum() > 0
-            }
-            all_reactant_atom_indices = all_reactant_atom_indices.union(
-                reactant_atom_indices
-            )
 
-    matching_indices = all_reactant_atom_indices.intersection(all_product_atom_indices)
+def _balance_details(rxsmiles: str, reactants: _SideAtoms, products: _SideAtoms) -> RxnBalanceDetails:
+    matched_atoms = len(reactants.map_numbers & products.map_numbers)
+    all_atoms = reactants.atoms + products.atoms
 
     # Evade div by zero
-    if len(all_product_atoms) == 0:
-        return 0.0
+    rbi = 100.0 * matched_atoms / reactants.atoms if reactants.atoms else 0.0
+    pbi = 100.0 * matched_atoms / products.atoms if products.atoms else 0.0
+    # Matching atom indices are only accounted for one time due to the intersection, hence they are subtracted once
+    tbi = 100.0 * matched_atoms / (all_atoms - matched_atoms) if all_atoms else 0.0
+
+    return RxnBalanceDetails(
+        rxsmiles=rxsmiles,
+        rbi=rbi,
+        pbi=pbi,
+        tbi=tbi,
+        reactant_atoms=reactants.atoms,
+        product_atoms=products.atoms,
+        matched_atoms=matched_atoms,
+        unmapped_reactant_atoms=reactants.unmapped_atoms,
+        unmapped_product_atoms=products.unmapped_atoms,
+    )
 
-    pbi = float(100.0 * float(len(matching_indices)) / float(len(all_product_atoms)))
 
-    return pbi
+def compute_balance_details(rxsmiles: str) -> RxnBalanceDetails:
+    """
+    Compute the reactant, product and total balance indices (RBI, PBI, TBI) of a reaction together, parsing each
+    reactant and product only once.
 
+    Args:
+        rxsmiles (str): atom mapped reaction SMILES with an optional extension
 
-def compute_tbi(rxsmiles: str) -> float:
-    # Parse the reaction SMILES into a reaction object
+    Returns:
+        RxnBalanceDetails: the balance indices, plus the atom counts they are based on
+
+    Raises:
+        RxsmilesAtomMappingException: if the reaction has no atom mapping
+    """
     parsed_rxn = decomposition_utils.parse_reaction_smiles(rxsmiles)
-    return _compute_tbi(parsed_rxn)
+    return _compute_balance_details(parsed_rxn)
 
 
-def _compute_tbi(parsed_reaction: decomposition_utils.ParsedReaction) -> float:
-    rxsmiles = parsed_reaction.rxsmiles
+def compute_rxn_balance_indices(rxsmiles: str) -> RxnBalanceOutput:
+    return compute_balance_details(rxsmiles)
 
-    # Throw error if rxsmiles has no atom mapping
-    if not rxsmiles_has_atommapping(parsed_reaction.rxsmiles):
-        raise RxsmilesAtomMappingException(
-            rxsmiles=rxsmiles,
-            message=f"No atom mapping found in the RXSMILES: {rxsmiles}.",
-        )
 
-    # We only need to consider reactant and product atoms, reagents by definition are not accounted for
-    all_atoms: list[Chem.Atom] = []
-    all_reactant_atom_indices: set[int] = set()
-    reactant_atom_indices: set[int] = set()
-
-    # This is by ChatGPT
-    for substance in parsed_reaction.reactants:
-        mol = Chem.MolFromSmiles(substance)
-        if mol:
-            atoms = set([atom for atom in mol.GetAtoms()])  # noqa: C403,C416
-            all_atoms.extend(atoms)
-            reactant_atom_indices = set()
-            reactant_atom_indices = {
-                atom.GetAtomMapNum()
-                for atom in mol.GetAtoms()
-                if atom.GetAtomMapNum() > 0
-            }
-            all_reactant_atom_indices = all_reactant_atom_indices.union(
-                reactant_atom_indices
-            )
+class RxnAnalysis(BaseModel):
+    rxsmiles: str
+    has_atom_mapping: bool
+    normalized_rxsmiles: Optional[str] = None
+    # Reason the roles could not be normalized, the balance indices are computed regardless
+    normalize_error: Optional[str] = None
+    balance: Optional[RxnBalanceDetails] = None
 
-    # See what fraction of reactant atoms are accounted for in product side
-    all_product_atom_indeces: set[int] = set()
-    product_atom_indices: set[int] = set()
 
-    # This is by ChatGPT
-    for substance in parsed_reaction.products:
-        mol = Chem.MolFromSmiles(substance)
-        if mol:
-            atoms = set([atom for atom in mol.GetAtoms()])  # noqa: C403,C416
-            all_atoms.extend(atoms)
-            product_atom_indices = set()
-            product_atom_indices = {
-                atom.GetAtomMapNum()
-                for atom in mol.GetAtoms()
-                if atom.GetAtomMapNum() > 0
-            }
-            all_product_atom_indeces = all_product_atom_indeces.union(
-                product_atom_indices
-            )
+def analyze_reaction(rxsmiles: str) -> RxnAnalysis:
+    """
+    Check the atom mapping of a reaction, normalize its roles and compute its balance indices, sharing a single parse
+    of the reaction SMILES between the three.
 
-    matching_indices = all_product_atom_indeces.intersection(all_reactant_atom_indices)
+    Args:
+        rxsmiles (str): reaction SMILES with an optional extension
 
-    # Evade div by zero
-    if len(all_atoms) == 0:
-        return 0.0
+    Returns:
+        RxnAnalysis: the atom mapping flag, and for atom mapped reactions the normalized reaction SMILES (or the reason
+        it could not be normalized) and the balance indices
 
-    # factor of 2 incorporated that matching atom indices are only accounted for only one time up to this point due to
-    # the intersection operation
-    tbi = float(100.0 * float(len(matching_indices))/float(len(all_atoms)-len(matching_indices)))
-    return tbi
+    Raises:
+        ValueError: if the reaction SMILES cannot be parsed
+        FragmentGroupError: if the fragment groups of the extension are invalid
+    """
+    parsed_rxn = decomposition_utils.parse_reaction_smiles(rxsmiles)
+    reactants = _SideAtoms().add(parsed_rxn.reactants)
+    products = _SideAtoms().add(parsed_rxn.products)
+    if not _has_atommapping(parsed_rxn, reactants, products):
+        return RxnAnalysis(rxsmiles=rxsmiles, has_atom_mapping=False)
+
+    analysis = RxnAnalysis(
+        rxsmiles=rxsmiles, has_atom_mapping=True, balance=_balance_details(rxsmiles, reactants, products)
+    )
+    try:
+        analysis.normalized_rxsmiles = _normalize_parsed_roles(parsed_rxn)
+    except Exception as e:
+        # E.g. substances RDKit cannot sanitize, which normalize_roles fails on as well
+        analysis.normalize_error = str(e) or type(e).__name__
+    return analysis
 
 
-class RxnBalanceOutput(BaseModel):
+class RxnBalanceBatchOutput(BaseModel):
     rxsmiles: str
-    rbi: float
-    pbi: float
-    tbi: float
+    rbi: Optional[float] = None
+    pbi: Optional[float] = None
+    tbi: Optional[float] = None
+    reactant_atoms: Optional[int] = None
+    product_atoms: Optional[int] = None
+    matched_atoms: Optional[int] = None
+    unmapped_reactant_atoms: Optional[int] = None
+    unmapped_product_atoms: Optional[int] = None
+    error: Optional[str] = None
+    # Class name of the exception, e.g. 'RxsmilesAtomMappingException' or 'TaskTimeoutError'
+    error_type: Optional[str] = None
+
+
+def compute_balance_indices_batch(rxsmiles_list: List[str]) -> List[RxnBalanceBatchOutput]:
+    """
+    Compute the balance indices of many reactions at once. Every reaction is parsed once to collect its atom counts
+    and atom map numbers. The map numbers are then packed into flat NumPy arrays (one per side, with the offsets of
+    each reaction), and the matched atoms and the RBI, PBI and TBI of all reactions are computed in vectorized form.
 
+    Args:
+        rxsmiles_list (List[str]): atom mapped reaction SMILES with optional extensions
 
-def compute_rxn_balance_indices(rxsmiles: str) -> RxnBalanceOutput:
-    # Parse the reaction SMILES into a reaction object
-    parsed_rxn = decomposition_utils.parse_reaction_smiles(rxsmiles)
+    Returns:
+        List[RxnBalanceBatchOutput]: one result per input, in order. Reactions that cannot be parsed or have no atom
+        mapping get an 'error' instead of indices.
+    """
+    n = len(rxsmiles_list)
+    errors: List[Optional[str]] = [None] * n
+    error_types: List[Optional[str]] = [None] * n
+    reactant_maps: List[List[int]] = []
+    product_maps: List[List[int]] = []
+    counts = np.zeros((4, n), dtype=np.int64)  # reactant atoms, product atoms, unmapped reactant/product atoms
+
+    for i, rxsmiles in enumerate(rxsmiles_list):
+        try:
+            parsed_rxn = decomposition_utils.parse_reaction_smiles(rxsmiles)
+            reactants = _SideAtoms().add(parsed_rxn.reactants)
+            products = _SideAtoms().add(parsed_rxn.products)
+            if not _has_atommapping(parsed_rxn, reactants, products):
+                raise RxsmilesAtomMappingException(
+                    rxsmiles=rxsmiles,
+                    message=f"No atom mapping found in the RXSMILES: {rxsmiles}.",
+                )
+        except Exception as e:
+            errors[i] = getattr(e, "message", None) or str(e)
+            error_types[i] = type(e).__name__
+            reactant_maps.append([])
+            product_maps.append([])
+            continue
+        reactant_maps.append(list(reactants.map_numbers))
+        product_maps.append(list(products.map_numbers))
+        counts[:, i] = (reactants.atoms, products.atoms, reactants.unmapped_atoms, products.unmapped_atoms)
+
+    reactant_atoms, product_atoms, unmapped_reactant_atoms, unmapped_product_atoms = counts
+
+    # Flat map numbers of all reactions, reaction i owns the slice offsets[i]:offsets[i + 1]
+    reactant_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(maps) for maps in reactant_maps], out=reactant_offsets[1:])
+    product_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(maps) for maps in product_maps], out=product_offsets[1:])
+    flat_reactant_maps = np.fromiter(
+        (m for maps in reactant_maps for m in maps), dtype=np.int64, count=reactant_offsets[-1]
+    )
+    flat_product_maps = np.fromiter(
+        (m for maps in product_maps for m in maps), dtype=np.int64, count=product_offsets[-1]
+    )
 
-    # Compute RBI, PBI, and TBI
-    rbi = _compute_rbi(parsed_rxn)
-    pbi = _compute_pbi(parsed_rxn)
-    tbi = _compute_tbi(parsed_rxn)
+    # Make the map numbers unique across reactions by combining them with the reaction index, so that a single
+    # intersection finds the matched atoms of all reactions. Map numbers are unique within each side already.
+    stride = int(max(flat_reactant_maps.max(initial=0), flat_product_maps.max(initial=0))) + 1
+    reactant_keys = np.repeat(np.arange(n, dtype=np.int64), np.diff(reactant_offsets)) * stride + flat_reactant_maps
+    product_keys = np.repeat(np.arange(n, dtype=np.int64), np.diff(product_offsets)) * stride + flat_product_maps
+    matched_keys = np.intersect1d(reactant_keys, product_keys, assume_unique=True)
+    matched_atoms = np.bincount(matched_keys // stride, minlength=n)
+
+    # Evade div by zero, reactions without atoms get indices of 0
+    all_atoms = reactant_atoms + product_atoms
+    rbi = np.divide(100.0 * matched_atoms, reactant_atoms, out=np.zeros(n), where=reactant_atoms > 0)
+    pbi = np.divide(100.0 * matched_atoms, product_atoms, out=np.zeros(n), where=product_atoms > 0)
+    tbi = np.divide(100.0 * matched_atoms, all_atoms - matched_atoms, out=np.zeros(n), where=all_atoms > 0)
+
+    results = []
+    for i, rxsmiles in enumerate(rxsmiles_list):
+        if errors[i] is not None:
+            results.append(RxnBalanceBatchOutput(rxsmiles=rxsmiles, error=errors[i], error_type=error_types[i]))
+            continue
+        results.append(
+            RxnBalanceBatchOutput(
+                rxsmiles=rxsmiles,
+                rbi=float(rbi[i]),
+                pbi=float(pbi[i]),
+                tbi=float(tbi[i]),
+                reactant_atoms=int(reactant_atoms[i]),
+                product_atoms=int(product_atoms[i]),
+                matched_atoms=int(matched_atoms[i]),
+                unmapped_reactant_atoms=int(unmapped_reactant_atoms[i]),
+                unmapped_product_atoms=int(unmapped_product_atoms[i]),
+            )
+        )
+    return results
 
-    return RxnBalanceOutput(rxsmiles=rxsmiles, rbi=rbi, pbi=pbi, tbi=tbi)
+
+class RxnNormalizeBatchOutput(BaseModel):
+    rxsmiles: str
+    normalized_rxsmiles: Optional[str] = None
+    error: Optional[str] = None
+    # Class name of the exception, e.g. 'RxsmilesAtomMappingException' or 'FragmentGroupError'
+    error_type: Optional[str] = None
+
+
+def normalize_roles_batch(rxsmiles_list: List[str]) -> List[RxnNormalizeBatchOutput]:
+    """
+    Normalize the roles of many reactions in one worker task, see ``normalize_roles``.
+
+    Args:
+        rxsmiles_list (List[str]): atom mapped reaction SMILES with optional extensions
+
+    Returns:
+        List[RxnNormalizeBatchOutput]: one result per input, in order. Reactions that fail (e.g. have no atom mapping
+        or invalid fragment groups) get an 'error' and 'error_type' instead of the normalized reaction SMILES.
+    """
+    results = []
+    for rxsmiles in rxsmiles_list:
+        try:
+            normalized_rxsmiles = normalize_roles(rxsmiles)
+        except Exception as e:
+            message = getattr(e, "message", None) or str(e) or type(e).__name__
+            results.append(RxnNormalizeBatchOutput(rxsmiles=rxsmiles, error=message, error_type=type(e).__name__))
+            continue
+        results.append(RxnNormalizeBatchOutput(rxsmiles=rxsmiles, normalized_rxsmiles=normalized_rxsmiles))
+    return results
+
+
+class RxnAnalysisBatchOutput(BaseModel):
+    rxsmiles: str
+    analysis: Optional[RxnAnalysis] = None
+    error: Optional[str] = None
+    error_type: Optional[str] = None
+
+
+def analyze_reactions_batch(rxsmiles_list: List[str]) -> List[RxnAnalysisBatchOutput]:
+    """
+    Analyze many reactions in one worker task, see ``analyze_reaction``.
+
+    Returns:
+        List[RxnAnalysisBatchOutput]: one result per input, in order. Reactions that cannot be parsed get an 'error'
+        and 'error_type' instead of the analysis.
+    """
+    results = []
+    for rxsmiles in rxsmiles_list:
+        try:
+            analysis = analyze_reaction(rxsmiles)
+        except Exception as e:
+            message = getattr(e, "message", None) or str(e) or type(e).__name__
+            results.append(RxnAnalysisBatchOutput(rxsmiles=rxsmiles, error=message, error_type=type(e).__name__))
+            continue
+        results.append(RxnAnalysisBatchOutput(rxsmiles=rxsmiles, analysis=analysis))
+    return results
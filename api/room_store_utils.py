@@ -0,0 +1,45 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Graphs of the rooms. The graph published to a room (enriched, if the enrichment finished in time) is kept here,
+# so that later requests for the room (e.g. its sprite sheet) read it after the room's WebSocket has been sent it.
+#
+
+import json
+import os
+from typing import Any, Dict, Optional
+
+from cache_utils import MISSING, TieredCache, make_cache_key
+
+# Graphs are kept as compact JSON, so that the memory tier is bounded by their size
+ROOM_STORE = TieredCache(
+    "rooms",
+    max_entries=int(os.getenv("RW_ROOM_STORE_SIZE", "256")),
+    max_bytes=int(os.getenv("RW_ROOM_STORE_BYTES", str(256 * 1024 * 1024))),
+    directory=os.getenv("RW_ROOM_STORE_DIR") or None,
+    max_disk_bytes=int(os.getenv("RW_ROOM_STORE_DISK_BYTES", str(1024 * 1024 * 1024))),
+)
+
+
+def _room_key(room_id: str) -> str:
+    return make_cache_key("room", room_id)
+
+
+def store_room_graph(room_id: str, graph_data: Dict[str, Any]) -> None:
+    """Keep the graph published to a room, replacing the previous one."""
+    ROOM_STORE.put(_room_key(room_id), json.dumps(graph_data, separators=(",", ":")).encode("utf-8"))
+
+
+def get_room_graph(room_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns:
+        dict: the graph last published to the room, or None if there is none (or it was evicted)
+    """
+    document = ROOM_STORE.get(_room_key(room_id))
+    if document is MISSING:
+        return None
+    return json.loads(document)
+
+
+def room_store_stats() -> dict:
+    return ROOM_STORE.stats()
@@ -4,9 +4,10 @@
 
 from enum import Enum
 from typing import List, Optional, Union
-from fastapi import FastAPI, Query, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Form, Body
+from fastapi import FastAPI, Query, Request, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Form, Body
 from pydantic import ConfigDict, ValidationError, BaseModel
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import json
@@ -16,29 +17,74 @@ import logging
 from uvicorn.logging import DefaultFormatter
 import json
 import asyncio
-from askcos_models import TreeSearchResponse
-from draw_utils import reaction_smiles_to_image
+from render_utils import (
+    IMAGE_MEDIA_TYPES,
+    MoleculeRenderError,
+    get_molecule_svg,
+    get_reaction_svg,
+    molecule_render_key,
+    reaction_render_key,
+    render_batch,
+    render_cache_stats,
+    render_etag,
+    render_sprite_sheet,
+    sprite_sheet_etag,
+    unrenderable_reaction_image,
+)
 from askcos_conversion_utils import (
     NoPathsFoundInAskcosResponse,
     NoResultFoundInAskcosResponse,
-    askcos_tree2synth_paths_with_graph
+    merge_askcos_json,
+    merge_askcos_tree
+)
+from conversion_cache_utils import ProgressCallback, cached_conversion, conversion_cache_key, conversion_cache_stats
+from draw_utils import get_svg_dimensions
+from enrichment_utils import ENRICH_TIMEOUT, assign_substance_roles, enrich_graph
+from executor_utils import PROCESS_POOL, TaskTimeoutError
+from job_utils import JOBS, Job, JobNotFoundError
+from precompute_utils import (
+    PRECOMPUTE_TIMEOUT,
+    chemistry_cache_stats,
+    get_balance_indices,
+    get_balance_indices_batch,
+    get_has_atom_mapping,
+    get_normalized_roles,
+    get_normalized_roles_batch,
+    get_reaction_analysis,
+    iter_normalized_roles_batch,
+    iter_graph_nodes,
+    precompute_graph,
 )
-from rdkit import Chem
-from rdkit.Chem import Draw
 import base64
 import role_assigner_utils
 from api_models import (
+    BalanceBatchRequest,
+    BalanceBatchResponse,
+    NormalizeRoleBatchRequest,
+    NormalizeRoleBatchResponse,
     NormalizeRoleRequest,
     NormalizeRoleResponse,
+    NormalizeRoleResult,
     ConvertToAicpRequest,
+    ReactionAnalyzeRequest,
+    ReactionAnalyzeResponse,
+    RenderBatchRequest,
+    RenderBatchResponse,
+    RenderFormat,
 )
 from role_assigner_utils import RxsmilesAtomMappingException
+from room_store_utils import get_room_graph, room_store_stats, store_room_graph
+from substance_index_utils import get_substance_identifiers, substance_index_stats
+from decomposition_utils import FragmentGroupError
 import re
 from werkzeug.utils import secure_filename
 from collections.abc import MutableMapping
 
 
 CYTOSCAPE_URL = os.getenv("CYTOSCAPE_URL", "http://localhost:1234/v1")
+
+# Renders are content addressed (see render_etag), so clients and proxies may keep them for a long time
+RENDER_CACHE_CONTROL = f"public, max-age={int(os.getenv('RW_RENDER_MAX_AGE', '31536000'))}, immutable"
 DEFAULT_STYLE_NAME = "New SynGPS API"
 
 # Set up logging
@@ -155,22 +201,6 @@ def is_valid_filename(filename):
         re.match(r'^[\w\-]+$', filename) is not None
     )
 
-# Save room data
-
-
-def save_room_data(room_id, data):
-    # Step 1: Clean filename using werkzeug
-    filename = secure_filename(room_id)
-
-    # Step 2: Custom validation
-    if not is_valid_filename(filename):
-        raise ValueError(f"Invalid room ID: {room_id}")
-
-    # Step 3: Save as .json
-    room_file = os.path.join(DATA_DIR, f"{filename}.json")
-    with open(room_file, "w") as file:
-        json.dump(data, file)
-
 # Load example payload
 
 
@@ -190,6 +220,11 @@ async def root():
 
 
 async def get_room_data(room_id: str):
+    # The graph published to the room (enriched, if the enrichment finished in time) outlives the room's data file,
+    # which is removed once the room's WebSocket was sent it
+    room_data = get_room_graph(room_id)
+    if room_data is not None:
+        return room_data
     room_file = os.path.join(DATA_DIR, f"{room_id}.json")
     if not os.path.exists(room_file):
         raise HTTPException(status_code=404, detail="Room not found")
@@ -205,6 +240,24 @@ async def status():
     return {"status": "OK"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Returns runtime counters of the API, e.g. hit/miss counts of the SVG render and chemistry caches, of the caches
+    inside the worker processes (summed over workers) and the queue depth of the process pool that runs the RDKit work.
+    """
+    return {
+        "render_cache": render_cache_stats(),
+        "chemistry_cache": chemistry_cache_stats(),
+        "substance_index": substance_index_stats(),
+        "conversion_cache": conversion_cache_stats(),
+        "room_store": room_store_stats(),
+        "jobs": JOBS.stats(),
+        "worker_caches": PROCESS_POOL.worker_cache_stats(),
+        "process_pool": PROCESS_POOL.stats(),
+    }
+
+
 class Node(BaseModel):
     node_label: str
     node_type: str
@@ -224,6 +277,12 @@ class ReactionNode(Node):
     evidence_protocol: Optional[dict] = None
     evidence_conditions_info: Optional[dict] = None
     predicted_conditions_info: Optional[dict] = None
+    # Filled in on upload if missing, see enrichment_utils.enrich_graph
+    has_atom_mapping: Optional[bool] = None
+    normalized_rxsmiles: Optional[str] = None
+    rbi: Optional[float] = None
+    pbi: Optional[float] = None
+    tbi: Optional[float] = None
 
 
 class SubstanceNode(Node):
@@ -277,8 +336,95 @@ class ConvertFromOptions(str, Enum):
     # Add more options here in the future, e.g.
 
 
+# Keep references to the running upload pipelines, so that they are not garbage collected
+precompute_tasks: set = set()
+
+
+def node_svg_message(room_id: str, node: dict, svg: str) -> dict:
+    """WebSocket message carrying the depiction of a graph node, as sent while an uploaded graph is rendered."""
+    width, height = get_svg_dimensions(svg)
+    return {
+        "type": "node-svg",
+        "room_id": room_id,
+        "node_label": node.get("node_label"),
+        "uuid": node.get("uuid"),
+        "node_type": str(node.get("node_type", "")).lower(),
+        "svg_base64": base64.b64encode(svg.encode("utf-8")).decode("utf-8"),
+        "width": width,
+        "height": height,
+    }
+
+
+async def precompute_room(room_id: str, graph_data: dict):
+    """
+    Warm the render and chemistry caches for an uploaded graph, streaming each depiction to the room as a 'node-svg'
+    message as soon as it is rendered (target molecules and the first route first). Then tell the room that its graph
+    is ready, together with the normalized roles and balance indices of its reactions (keyed by reaction node uuid).
+    """
+    async def send_depiction(node: dict, svg: str):
+        websocket = room_connections.get(room_id)
+        if websocket is not None:
+            await websocket.send_json(node_svg_message(room_id, node, svg))
+
+    try:
+        precomputed = await asyncio.wait_for(precompute_graph(graph_data, send_depiction), PRECOMPUTE_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Pre-computing the graph of room {room_id} did not finish within {PRECOMPUTE_TIMEOUT}s")
+        precomputed = None
+    except Exception as e:
+        logger.error(f"Pre-computing the graph of room {room_id} failed: {e}", exc_info=True)
+        precomputed = None
+
+    websocket = room_connections.get(room_id)
+    if websocket is None:
+        return
+    try:
+        await websocket.send_json({"type": "graph-ready", "room_id": room_id, "data": precomputed})
+    except Exception as e:
+        logger.warning(f"WebSocket send error: {e}")
+
+
+def start_precompute(room_id: str, graph_data: dict):
+    task = asyncio.create_task(precompute_room(room_id, graph_data))
+    precompute_tasks.add(task)
+    task.add_done_callback(precompute_tasks.discard)
+
+
+async def publish_graph(room_id: str, validated_data: InputFile) -> dict:
+    """
+    Enrich an uploaded graph, store it as the graph of the room, send it to the room and start its pre-computation.
+    If the enrichment does not finish within RW_ENRICH_TIMEOUT seconds, the graph is stored as uploaded.
+
+    Returns:
+        dict: the stored graph
+    """
+    graph_data = validated_data.dict()
+    try:
+        graph_data = await asyncio.wait_for(enrich_graph(validated_data.dict()), ENRICH_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Enriching the graph of room {room_id} did not finish within {ENRICH_TIMEOUT}s")
+    except Exception as e:
+        logger.error(f"Enriching the graph of room {room_id} failed: {e}", exc_info=True)
+    # The graph is sent to the room below rather than written to the data directory, whose polling would send it a
+    # second time after the depictions of the pre-computation were streamed
+    store_room_graph(room_id, graph_data)
+
+    try:
+        await room_connections[room_id].send_json({
+            "type": "new-graph",
+            "room_id": room_id,
+            "data": graph_data
+        })
+    except Exception as e:
+        logger.warning(f"WebSocket send error: {e}")
+
+    start_precompute(room_id, graph_data)
+    return graph_data
+
+
 @app.post("/upload_json_body/")
 async def upload_json_body(
+    request: Request,
     room_id: str = Query(...),
     convert_to_aicp: bool = Query(False),
     convert_from: Optional[ConvertFromOptions] = Query(None),
@@ -297,6 +443,7 @@ async def upload_json_body(
     - `json_data` (dict): The JSON payload representing a reaction or synthesis graph. The structure must match the expected schema. See example in Swagger UI or refer to `public/json_example_1.json`.
 
     If `convert_to_aicp` is enabled, the `json_data` will be transformed to AICP format before validation and storage.
+    Uploading the same body again reuses the converted payload.
 
     **Returns**:
     Returns the validated data as confirmation.
@@ -310,24 +457,22 @@ async def upload_json_body(
 
     try:
         if convert_to_aicp and convert_from == ConvertFromOptions.askcos:
-            json_data = await _convert_to_aicp(ConvertToAicpRequest(source_data=json_data, convert_from="askcos"))
+            # The body was already read to parse json_data, so this returns it without reading the request again
+            document = await request.body()
+            json_data = json.loads(await cached_conversion(
+                conversion_cache_key("askcos", document),
+                lambda report: _convert_to_aicp(
+                    ConvertToAicpRequest(source_data=json_data, convert_from="askcos"), report
+                ),
+            ))
         elif convert_to_aicp:
             raise HTTPException(
                 status_code=400, detail=f"Invalid conversion source: {convert_from}")
 
         validated_data = InputFile(**json_data)
-        save_room_data(room_id, validated_data.dict())
+        graph_data = await publish_graph(room_id, validated_data)
 
-        try:
-            await room_connections[room_id].send_json({
-                "type": "new-graph",
-                "room_id": room_id,
-                "data": validated_data.dict()
-            })
-        except Exception as e:
-            logger.warning(f"WebSocket send error: {e}")
-
-        return {"data": validated_data.dict()}
+        return {"data": graph_data}
 
     except (json.JSONDecodeError, ValidationError) as e:
         raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
@@ -373,27 +518,23 @@ async def upload_json_file(
 
     try:
         file_content = await file.read()
-        json_data = json.loads(file_content)
 
         if convert_to_aicp and convert_from == ConvertFromOptions.askcos:
-            json_data = await _convert_to_aicp(ConvertToAicpRequest(source_data=json_data, convert_from="askcos"))
+            # Converted from the raw file, so the ASKCOS response is never decoded as a whole. Uploading the same file
+            # again reuses the converted payload
+            json_data = json.loads(await cached_conversion(
+                conversion_cache_key("askcos", file_content), lambda report: _convert_askcos_json(file_content, report)
+            ))
         elif convert_to_aicp:
             raise HTTPException(
                 status_code=400, detail=f"Invalid conversion source: {convert_from}")
+        else:
+            json_data = json.loads(file_content)
 
         validated_data = InputFile(**json_data)
-        save_room_data(room_id, validated_data.dict())
-
-        try:
-            await room_connections[room_id].send_json({
-                "type": "new-graph",
-                "room_id": room_id,
-                "data": validated_data.dict()
-            })
-        except Exception as e:
-            logger.warning(f"WebSocket send error: {e}")
+        graph_data = await publish_graph(room_id, validated_data)
 
-        return {"data": validated_data.dict()}
+        return {"data": graph_data}
 
     except (json.JSONDecodeError, ValidationError) as e:
         raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
@@ -454,6 +595,12 @@ async def websocket_endpoint(websocket: WebSocket):
             room_connections.pop(room_id, None)
 
 
+@app.on_event("startup")
+async def startup_event():
+    # Spawn and pre-warm the RDKit worker processes before the first request arrives
+    await PROCESS_POOL.start()
+
+
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down... closing all WebSocket connections.")
@@ -463,6 +610,10 @@ async def shutdown_event():
         except Exception as e:
             logger.warning(f"Error closing websocket for room {room_id}: {e}")
     room_connections.clear()
+    for task in list(precompute_tasks):
+        task.cancel()
+    JOBS.cancel_all()
+    PROCESS_POOL.shutdown()
 
 
 ################
@@ -489,45 +640,77 @@ async def getWsTestHtml():
 # Helper Endpoints
 ###################
 
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check whether the If-None-Match header of the request matches the given ETag."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def render_response(content, response_format: RenderFormat, etag: Optional[str]) -> Response:
+    """
+    Wrap a rendered image (or the JSON object holding it) in a response with caching headers. Without an ETag,
+    e.g. for the placeholder of a reaction that failed to render, the response must not be cached.
+    """
+    headers = {"ETag": etag, "Cache-Control": RENDER_CACHE_CONTROL} if etag else {"Cache-Control": "no-cache"}
+    if response_format == RenderFormat.json:
+        return JSONResponse(content=content, headers=headers)
+    return Response(content=content, media_type=IMAGE_MEDIA_TYPES[response_format.value], headers=headers)
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": RENDER_CACHE_CONTROL})
+
+
 # Endpoint to convert reaction smiles to SVG
 @app.get("/rxsmiles2svg")
-async def rxsmiles_to_svg_endpoint(rxsmiles: str = 'CCO.CC(=O)O>>CC(=O)OCC.O', highlight: bool = True, base64_encode: bool = True, show_atom_indices: bool = False):
+async def rxsmiles_to_svg_endpoint(request: Request, rxsmiles: str = 'CCO.CC(=O)O>>CC(=O)OCC.O', highlight: bool = True, base64_encode: bool = True, show_atom_indices: bool = False, response_format: RenderFormat = RenderFormat.json):
     """
     Generates an SVG for a given reaction SMILES string.
 
     Args:
     - rxsmiles (str): The reaction SMILES string.
     - highlight (bool): Whether to highlight the reactants and products.
-    - base64_encode (bool): Whether to encode the SVG as base64.
+    - base64_encode (bool): Whether to encode the SVG as base64. Only used for the 'json' response format.
     - show_atom_indices (bool): Whether to show atom indices in the SVG.
+    - response_format (RenderFormat): 'json' (default), or 'svg' / 'png' for the raw image.
 
     Returns:
     - If base64_encode is True, returns a JSON response with the original reaction SMILES and the base64-encoded SVG.
     - If base64_encode is False, returns a JSON response with the original reaction SMILES and the SVG.
+    - For the 'svg' and 'png' response formats, returns the image itself.
+    Responses carry an ETag and are answered with 304 Not Modified if it matches the If-None-Match header.
     """
-    try:
-        svg = reaction_smiles_to_image(rxsmiles, align=False, transparent=False,
-                                       highlight=highlight, retro=False, show_atom_indices=show_atom_indices)
-        svg = svg.replace('"', "'")
-    except Exception as e:
-        svg = """
-        <svg width="450" height="75" xmlns="http://www.w3.org/2000/svg">
-          <rect width="100%" height="100%" fill="white" />
-          <text x="10" y="50" font-size="32" fill="black">Unable to generate reaction SVG</text>
-        </svg>
-        """.strip()
-
+    image_format = "svg" if response_format == RenderFormat.json else response_format.value
+    key = reaction_render_key(rxsmiles, highlight, show_atom_indices, False, image_format)
+    if response_format == RenderFormat.json:
+        etag = render_etag(key, response_format.value, base64_encode, rxsmiles)
+    else:
+        etag = render_etag(key)
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+
+    image = await get_reaction_svg(rxsmiles, highlight=highlight, show_atom_indices=show_atom_indices, retro=False, key=key, image_format=image_format)
+    if image == unrenderable_reaction_image(image_format):
+        etag = None
+    elif response_format == RenderFormat.json:
+        image = image.replace('"', "'")
+
+    if response_format != RenderFormat.json:
+        return render_response(image, response_format, etag)
     if base64_encode:
-        svg = base64.b64encode(svg.encode('utf-8')).decode('utf-8')
-        return JSONResponse(content={"rxsmiles": rxsmiles, "svg_base64": svg})
+        svg = base64.b64encode(image.encode('utf-8')).decode('utf-8')
+        return render_response({"rxsmiles": rxsmiles, "svg_base64": svg}, response_format, etag)
     else:
-        return JSONResponse(content={"rxsmiles": rxsmiles, "svg": svg})
+        return render_response({"rxsmiles": rxsmiles, "svg": image}, response_format, etag)
 
 # Endpoint to convert molecule SMILES to SVG
 
 
 @app.get("/molsmiles2svg")
-async def smiles_to_svg_endpoint(mol_smiles: str = 'Cc1cc(Br)cc(C)c1C1C(=O)CCC1=O', img_width: int = 300, img_height: int = 300, base64_encode: bool = True):
+async def smiles_to_svg_endpoint(request: Request, mol_smiles: str = 'Cc1cc(Br)cc(C)c1C1C(=O)CCC1=O', img_width: int = 300, img_height: int = 300, base64_encode: bool = True, response_format: RenderFormat = RenderFormat.json):
     """
     Generates an SVG for a given molecule SMILES string.
 
@@ -535,37 +718,117 @@ async def smiles_to_svg_endpoint(mol_smiles: str = 'Cc1cc(Br)cc(C)c1C1C(=O)CCC1=
     - mol_smiles (str, optional): The SMILES string of the molecule to be drawn. Defaults to 'Cc1cc(Br)cc(C)c1C1C(=O)CCC1=O'.
     - img_width (int, optional): The width of the SVG image. Defaults to 300.
     - img_height (int, optional): The height of the SVG image. Defaults to 300.
-    - base64_encode (bool, optional): Whether to encode the SVG as a base64 string. Defaults to True.
+    - base64_encode (bool, optional): Whether to encode the SVG as a base64 string. Defaults to True. Only used for the 'json' response format.
+    - response_format (RenderFormat, optional): 'json' (default), or 'svg' / 'png' for the raw image.
 
     Returns:
     - JSONResponse: A JSON response containing the SMILES string and either the SVG string or the base64-encoded SVG string.
+    - For the 'svg' and 'png' response formats, returns the image itself.
+    Responses carry an ETag and are answered with 304 Not Modified if it matches the If-None-Match header.
     """
-    if not mol_smiles:
-        logger.error("Empty SMILES string provided")
-        raise HTTPException(
-            status_code=400, detail="Empty SMILES string provided")
-
-    mol = Chem.MolFromSmiles(mol_smiles)
-    if mol is None:
-        logger.error(f"Invalid SMILES string: {mol_smiles}")
-        raise HTTPException(
-            status_code=400, detail=f"Invalid SMILES string: {mol_smiles}")
+    image_format = "svg" if response_format == RenderFormat.json else response_format.value
+    key = molecule_render_key(mol_smiles, img_width, img_height, image_format)
+    if response_format == RenderFormat.json:
+        etag = render_etag(key, response_format.value, base64_encode, mol_smiles)
+    else:
+        etag = render_etag(key)
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
 
-    d2d = Draw.MolDraw2DSVG(img_width, img_height)
     try:
-        d2d.DrawMolecule(mol)
-    except Exception as e:
-        logger.error(f"Failed to draw molecule: {mol_smiles}", exc_info=True)
-        raise HTTPException(
-            status_code=500, detail=f"Failed to draw molecule: {mol_smiles}")
-    d2d.FinishDrawing()
-
-    svg = d2d.GetDrawingText()
+        image = await get_molecule_svg(mol_smiles, img_width, img_height, key=key, image_format=image_format)
+    except MoleculeRenderError as e:
+        if e.invalid_smiles:
+            logger.error(e.message)
+            raise HTTPException(status_code=400, detail=e.message)
+        logger.error(e.message, exc_info=True)
+        raise HTTPException(status_code=500, detail=e.message)
+    except TaskTimeoutError as e:
+        logger.error(f"Drawing molecule {mol_smiles} timed out")
+        raise HTTPException(status_code=504, detail=e.message)
+
+    if response_format != RenderFormat.json:
+        return render_response(image, response_format, etag)
     if base64_encode:
-        svg = base64.b64encode(svg.encode('utf-8')).decode('utf-8')
-        return JSONResponse(content={"smiles": mol_smiles, "svg_base64": svg})
+        svg = base64.b64encode(image.encode('utf-8')).decode('utf-8')
+        return render_response({"smiles": mol_smiles, "svg_base64": svg}, response_format, etag)
     else:
-        return JSONResponse(content={"smiles": mol_smiles, "svg": svg})
+        return render_response({"smiles": mol_smiles, "svg": image}, response_format, etag)
+
+
+@app.post("/render/batch", summary="Render many molecules and reactions in one call")
+async def render_batch_endpoint(request: RenderBatchRequest) -> RenderBatchResponse:
+    """
+    Draws a batch of molecule and reaction SMILES, e.g. all nodes of a synthesis graph, in a single request.
+    Items are spread over the render worker pool and duplicate items are only drawn once.
+
+    Args:
+    - items (list): Molecules and reactions to draw, each with an 'id' and its own draw options.
+    - base64_encode (bool): Whether to base64 encode the SVGs.
+
+    Returns:
+    - RenderBatchResponse: The SVG, its width and height and an optional error message, keyed by item id.
+    """
+    results = await render_batch([item.dict() for item in request.items])
+
+    if request.base64_encode:
+        for result in results.values():
+            if result["svg"]:
+                result["svg"] = base64.b64encode(result["svg"].encode('utf-8')).decode('utf-8')
+
+    return RenderBatchResponse(results=results)
+
+
+def collect_substance_smiles(graph_data: dict) -> dict:
+    """Map the InChIKey of every substance node of the synthesis graphs in an AICP payload to its canonical SMILES."""
+    substances = {}
+    for node in iter_graph_nodes(graph_data):
+        if str(node.get("node_type", "")).lower() != "substance":
+            continue
+        if node.get("inchikey") and node.get("canonical_smiles"):
+            substances.setdefault(node["inchikey"], node["canonical_smiles"])
+    return substances
+
+
+async def sprite_sheet_response(request: Request, graph_data: dict) -> Response:
+    substances = collect_substance_smiles(graph_data)
+    etag = sprite_sheet_etag(substances)
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+
+    sprite = await render_sprite_sheet(substances)
+    return Response(
+        content=sprite,
+        media_type=IMAGE_MEDIA_TYPES["svg"],
+        headers={"ETag": etag, "Cache-Control": RENDER_CACHE_CONTROL},
+    )
+
+
+@app.get("/render/sprite", summary="SVG sprite sheet of all substances of a room")
+async def room_sprite_sheet(request: Request, room_id: str = Query(...)):
+    """
+    Draws every substance of the synthesis graphs last published to a room into one SVG document.
+
+    Args:
+    - room_id (str): The room whose graph is drawn.
+
+    Returns:
+    - An image/svg+xml document with one <symbol id="{inchikey}"> per substance, a shared style sheet and a JSON
+      index of the symbol sizes in <metadata id="index">. Clients reference the symbols with <use href="#{inchikey}">.
+    """
+    filename = secure_filename(room_id)
+    if not is_valid_filename(filename):
+        raise HTTPException(status_code=400, detail=f"Invalid room ID: {room_id}")
+    return await sprite_sheet_response(request, await get_room_data(filename))
+
+
+@app.post("/render/sprite", summary="SVG sprite sheet of all substances of an AICP payload")
+async def payload_sprite_sheet(request: Request, data: InputFile):
+    """
+    Draws every substance of the synthesis graphs of an AICP payload into one SVG document.
+    See GET /render/sprite for the format.
+    """
+    return await sprite_sheet_response(request, data.dict())
 
 
 # Create style function
@@ -742,37 +1005,7 @@ def convert_to_cytoscape_json(aicp_graph, synth_graph_key="synth_graph", convert
 
 def assign_srole(parsed_data):
     # Assign substance roles
-    in_degrees = {}
-    out_degrees = {}
-
-    # Initialize degrees
-    for node in parsed_data["synth_graph"]["nodes"]:
-        if node["node_type"].lower() == "substance":
-            in_degrees[node["node_label"]] = 0
-            out_degrees[node["node_label"]] = 0
-
-    # Count in-degrees and out-degrees
-    for edge in parsed_data["synth_graph"]["edges"]:
-        from_node = edge["start_node"]
-        to_node = edge["end_node"]
-
-        if from_node in out_degrees:
-            out_degrees[from_node] += 1
-        if to_node in in_degrees:
-            in_degrees[to_node] += 1
-
-    # Assign roles
-    for node in parsed_data["synth_graph"]["nodes"]:
-        if node["node_type"].lower() == "substance":
-            in_deg = in_degrees[node["node_label"]]
-            out_deg = out_degrees[node["node_label"]]
-
-            if out_deg == 0:
-                node["srole"] = "tm"  # terminal material
-            elif in_deg == 0:
-                node["srole"] = "sm"  # starting material
-            else:
-                node["srole"] = "im"  # intermediate
+    assign_substance_roles(parsed_data["synth_graph"], overwrite=True)
     return parsed_data
 
 
@@ -907,23 +1140,70 @@ async def normalize_rxsmiles_roles(request: NormalizeRoleRequest) -> NormalizeRo
     """
     rxsmiles = request.rxsmiles
 
-    # Check if the RXSMILES has atom mapping
-    if not role_assigner_utils.rxsmiles_has_atommapping(rxsmiles):
-        raise HTTPException(
-            status_code=400, detail="Input RXSMILES must contain atom mapping.")
-
     try:
-        normalized_rxn = role_assigner_utils.normalize_roles(rxsmiles)
+        # Check if the RXSMILES has atom mapping
+        if not await get_has_atom_mapping(rxsmiles):
+            raise HTTPException(
+                status_code=400, detail="Input RXSMILES must contain atom mapping.")
+
+        normalized_rxn = await get_normalized_roles(rxsmiles)
         return NormalizeRoleResponse(original_rxsmiles=request.rxsmiles, rxsmiles=normalized_rxn)
+    except HTTPException:
+        raise
     except RxsmilesAtomMappingException:
         raise HTTPException(
             status_code=400, detail="Error parsing RXN Smiles: Atom mapping required")
+    except TaskTimeoutError as e:
+        raise HTTPException(status_code=504, detail=e.message)
     except Exception as e:
         logger.error(f"Error normalizing roles: {str(e)}")
         raise HTTPException(
             status_code=500, detail="Internal error normalizing roles")
 
 
+def _normalize_role_result(index: int, result: role_assigner_utils.RxnNormalizeBatchOutput) -> NormalizeRoleResult:
+    return NormalizeRoleResult(
+        index=index,
+        original_rxsmiles=result.rxsmiles,
+        rxsmiles=result.normalized_rxsmiles,
+        error=result.error,
+        error_type=result.error_type,
+    )
+
+
+@app.post(
+    "/normalize_roles/batch",
+    summary="Normalize the reaction roles of many RXN Smiles in one call",
+    response_model=NormalizeRoleBatchResponse,
+)
+async def normalize_rxsmiles_roles_batch(request: NormalizeRoleBatchRequest):
+    """
+    Normalizes the roles of a batch of reactions, e.g. all reactions of a route export. Duplicates are normalized once
+    and the unique reactions are spread over the worker processes. Reactions that fail (e.g. have no atom mapping or
+    invalid fragment groups) get an error message and type instead of the normalized RXN Smiles, the batch as a whole
+    does not fail.
+
+    Args:
+    - rxsmiles (list): The reaction smiles strings.
+    - stream (bool, optional): Stream the results as NDJSON in the order they complete. Defaults to False.
+
+    Returns:
+    - NormalizeRoleBatchResponse: The normalized RXN Smiles of every reaction, in request order. With 'stream', one
+      NormalizeRoleResult per line instead, use its 'index' to match it to the request.
+    """
+    if request.stream:
+        async def ndjson_lines():
+            async for index, result in iter_normalized_roles_batch(request.rxsmiles):
+                yield _normalize_role_result(index, result).json() + "\n"
+
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    results = await get_normalized_roles_batch(request.rxsmiles)
+    return NormalizeRoleBatchResponse(
+        results=[_normalize_role_result(index, result) for index, result in enumerate(results)]
+    )
+
+
 @app.get("/compute_all_bi")
 async def compute_all_bi(rxsmiles: Optional[str] = "ClC(Cl)(O[C:5](=[O:11])OC(Cl)(Cl)Cl)Cl.[Cl:13][C:14]1[CH:19]=[CH:18][C:17]([C:20]2[N:21]=[C:22]([CH:31]3[CH2:36][CH2:35][NH:34][CH2:33][CH2:32]3)[S:23][C:24]=2[C:25]2[CH:30]=[CH:29][CH:28]=[CH:27][CH:26]=2)=[CH:16][CH:15]=1.C(N(CC)CC)C.Cl.[CH3:45][NH:46][OH:47].[Cl-].[NH4+]>ClCCl.O>[Cl:13][C:14]1[CH:19]=[CH:18][C:17]([C:20]2[N:21]=[C:22]([CH:31]3[CH2:36][CH2:35][N:34]([C:5](=[O:11])[N:46]([OH:47])[CH3:45])[CH2:33][CH2:32]3)[S:23][C:24]=2[C:25]2[CH:30]=[CH:29][CH:28]=[CH:27][CH:26]=2)=[CH:16][CH:15]=1"):
     """
@@ -933,7 +1213,8 @@ async def compute_all_bi(rxsmiles: Optional[str] = "ClC(Cl)(O[C:5](=[O:11])OC(Cl
     - rxsmiles (str): The reaction smiles string.
 
     Returns:
-    - dict: A dictionary containing the calculated balance indices.
+    - dict: A dictionary containing the calculated balance indices, and the reactant, product, matched and unmapped
+      atom counts they are based on.
     """
     try:
         # Ensure rxsmiles is provided
@@ -942,28 +1223,160 @@ async def compute_all_bi(rxsmiles: Optional[str] = "ClC(Cl)(O[C:5](=[O:11])OC(Cl
                 status_code=400, detail="rxsmiles parameter is required.")
 
         # Process the rxsmiles input
-        pbi = role_assigner_utils.compute_pbi(rxsmiles)
-        rbi = role_assigner_utils.compute_rbi(rxsmiles)
-        tbi = role_assigner_utils.compute_tbi(rxsmiles)
+        balance = await get_balance_indices(rxsmiles)
 
         # Round values to two decimal places
-        pbi = round(pbi, 2)
-        rbi = round(rbi, 2)
-        tbi = round(tbi, 2)
+        pbi = round(balance.pbi, 2)
+        rbi = round(balance.rbi, 2)
+        tbi = round(balance.tbi, 2)
 
-        return {"pbi": pbi, "rbi": rbi, "tbi": tbi}
+        return {
+            "pbi": pbi,
+            "rbi": rbi,
+            "tbi": tbi,
+            "reactant_atoms": balance.reactant_atoms,
+            "product_atoms": balance.product_atoms,
+            "matched_atoms": balance.matched_atoms,
+            "unmapped_reactant_atoms": balance.unmapped_reactant_atoms,
+            "unmapped_product_atoms": balance.unmapped_product_atoms,
+        }
 
+    except TaskTimeoutError as e:
+        raise HTTPException(status_code=504, detail=e.message)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
-@app.post("/convert2aicp", summary="Convert to AICP format")
-async def _convert_to_aicp(request: ConvertToAicpRequest) -> dict:
+@app.post("/compute_all_bi/batch", summary="Calculate the balance indices of many reactions in one call")
+async def compute_all_bi_batch(request: BalanceBatchRequest) -> BalanceBatchResponse:
+    """
+    Calculates all balance indices for a batch of reaction smiles, e.g. all mapped reactions of a synthesis graph.
+    Reactions that fail (e.g. have no atom mapping, or their chunk of the batch timed out) get an error message instead
+    of indices, the batch as a whole does not fail.
+
+    Args:
+    - rxsmiles (list): The reaction smiles strings.
+
+    Returns:
+    - BalanceBatchResponse: The balance indices and atom counts of every reaction, in request order.
+    """
+    balances = await get_balance_indices_batch(request.rxsmiles)
+
+    results = []
+    for balance in balances:
+        result = balance.dict()
+        for index in ["pbi", "rbi", "tbi"]:
+            if result[index] is not None:
+                result[index] = round(result[index], 2)
+        results.append(result)
+    return BalanceBatchResponse(results=results)
+
+
+@app.post("/reaction/analyze", summary="Atom mapping, normalized roles, balance indices and depiction of a reaction")
+async def analyze_reaction(request: ReactionAnalyzeRequest) -> ReactionAnalyzeResponse:
+    """
+    Analyzes a reaction in one call: checks its atom mapping, and for atom mapped reactions normalizes its roles and
+    computes its balance indices, parsing the RXSMILES once for all of them. Replaces calling /normalize_roles,
+    /rxsmiles2svg and /compute_all_bi one after the other.
+
+    Args:
+    - rxsmiles (str): A reaction SMILES string in the format 'reactants > reagents > products'.
+    - depict (bool): Whether to include the depiction of the reaction.
+    - normalize (bool): Whether to depict the reaction with normalized roles, if they could be normalized.
+    - highlight (bool): Whether to highlight the atoms based on atom mapping in the depiction.
+    - show_atom_indices (bool): Whether to show the atom map numbers in the depiction.
+
+    Returns:
+    - ReactionAnalyzeResponse: The atom mapping flag, the normalized RXSMILES, the balance indices rounded to two
+      decimals and the atom counts they are based on, and the base64 encoded depiction if requested.
+    """
+    rxsmiles = request.rxsmiles
+    try:
+        analysis = await get_reaction_analysis(rxsmiles)
+    except TaskTimeoutError as e:
+        raise HTTPException(status_code=504, detail=e.message)
+    except (ValueError, FragmentGroupError) as e:
+        raise HTTPException(status_code=400, detail=f"Error parsing RXN Smiles: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error analyzing reaction: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal error analyzing reaction")
+
+    result = {
+        "rxsmiles": rxsmiles,
+        "has_atom_mapping": analysis.has_atom_mapping,
+        "normalized_rxsmiles": analysis.normalized_rxsmiles,
+        "normalize_error": analysis.normalize_error,
+    }
+    if analysis.balance is not None:
+        result.update(analysis.balance.dict(exclude={"rxsmiles"}))
+        for index in ["pbi", "rbi", "tbi"]:
+            result[index] = round(result[index], 2)
+
+    if request.depict:
+        depicted = rxsmiles
+        if request.normalize and analysis.normalized_rxsmiles is not None:
+            depicted = analysis.normalized_rxsmiles
+        key = reaction_render_key(depicted, request.highlight, request.show_atom_indices, False, "svg")
+        image = await get_reaction_svg(
+            depicted, highlight=request.highlight, show_atom_indices=request.show_atom_indices, retro=False, key=key
+        )
+        width, height = get_svg_dimensions(image)
+        if image != unrenderable_reaction_image():
+            # Same SVG as returned by /rxsmiles2svg
+            image = image.replace('"', "'")
+        result["depicted_rxsmiles"] = depicted
+        result["svg_base64"] = base64.b64encode(image.encode("utf-8")).decode("utf-8")
+        result["width"] = width
+        result["height"] = height
+
+    return ReactionAnalyzeResponse(**result)
+
+
+@app.post(
+    "/convert2aicp",
+    summary="Convert to AICP format",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": ConvertToAicpRequest.model_json_schema()}},
+        }
+    },
+)
+async def convert_to_aicp(request: Request) -> Response:
+    """
+    Converts a graph format to AICP. Currently only converts from askcos but could be expanded in the future.
+
+    The converted payload is cached by the ASKCOS result ID and a hash of the request body, so converting the same
+    body again is answered from the cache before the request is parsed or validated.
+
+    **Request Body**:
+    - `convert_from` (str): The format to convert from, `askcos`
+    - `source_data` (dict): The graph data to be converted
+
+    Returns:
+    -  dict: The converted graph data
+    """
+    document = await request.body()
+
+    async def convert(report: ProgressCallback) -> dict:
+        try:
+            convert_request = ConvertToAicpRequest.model_validate_json(document)
+        except ValidationError as e:
+            # Same response as a request FastAPI failed to validate
+            raise RequestValidationError(e.errors())
+        return await _convert_to_aicp(convert_request, report)
+
+    converted = await cached_conversion(conversion_cache_key("askcos", document), convert)
+    return Response(content=converted, media_type="application/json")
+
+
+async def _convert_to_aicp(request: ConvertToAicpRequest, report: Optional[ProgressCallback] = None) -> dict:
     """
     Converts a graph format to AICP. Currently only converts from askcos but could be expanded in the future.
 
     Args:
     - request (ConvertToAicpRequest): The request object containing the graph data and conversion source
+    - report (Callable, optional): Called with the progress of the conversion
 
     Returns:
     -  dict: The converted graph data
@@ -977,42 +1390,140 @@ async def _convert_to_aicp(request: ConvertToAicpRequest) -> dict:
             status_code=400, detail=f"Invalid conversion source: {conversion_source}")
 
     if conversion_source == "askcos":
-        synth_graph, paths = askcos_tree2synth_paths_with_graph(
-            TreeSearchResponse(**source_data), USE_RETRO_RXN_RENDERING=False)
+        try:
+            return await _convert_askcos(merge_askcos_tree, source_data, report)
+        except TaskTimeoutError as e:
+            raise HTTPException(status_code=504, detail=e.message)
+    else:
+        raise HTTPException(
+            status_code=400, detail="Unsupported conversion format")
 
-        # Flatten node and edge data into list of objects
-        nodes = [
-            {**{k: v for k, v in attrs.items() if k != "node_id"}, "node_id": n}
-            for n, attrs in synth_graph.nodes(data=True)
-        ]
 
-        edges = [
-            dict(source=u, target=v, **attrs)
-            for u, v, attrs in synth_graph.edges(data=True)
-        ]
+async def _convert_askcos_json(document: bytes, report: Optional[ProgressCallback] = None) -> dict:
+    """
+    Converts the raw JSON of an ASKCOS tree search response to AICP, reading its paths one at a time.
+
+    Args:
+    - document (bytes): The JSON of the ASKCOS response
+    - report (Callable, optional): Called with the progress of the conversion
+
+    Returns:
+    -  dict: The converted graph data
+    """
+    try:
+        return await _convert_askcos(merge_askcos_json, document, report)
+    except TaskTimeoutError as e:
+        raise HTTPException(status_code=504, detail=e.message)
+
+
+async def _convert_askcos(merge, source, report: Optional[ProgressCallback] = None, bound=None) -> dict:
+    """
+    Converts an ASKCOS tree search response to AICP: its paths are merged by a worker, then the identifiers of the
+    unique substances are taken from the substance index or computed in parallel on the process pool. Progress is
+    passed to ``report`` if given, and with ``bound`` (e.g. ``JOBS.bounded``) every worker task is started through it.
+    """
+    async def progress(stage: str, done: Optional[int] = None, total: Optional[int] = None):
+        if report is not None:
+            await report(stage, done, total)
+
+    def run_merge():
+        return PROCESS_POOL.run(merge, source, False)
+
+    await progress("merging")
+    merger = await (bound(run_merge) if bound is not None else run_merge())
+    smiles = merger.substance_smiles()
+    await progress("substances", 0, len(smiles))
+    identifiers = await get_substance_identifiers(
+        smiles, progress=lambda done, total: progress("substances", done, total), bound=bound
+    )
+    await progress("building")
+    return merger.to_aicp(identifiers)
+
+
+async def send_job_status(job: Job):
+    """
+    Send the status of a job to its room: 'job-progress' messages while it is queued or running, then a
+    'job-completed', 'job-failed' or 'job-cancelled' message.
+    """
+    websocket = room_connections.get(job.room_id)
+    if websocket is None:
+        return
+    message_type = f"job-{job.status.value}" if job.finished else "job-progress"
+    await websocket.send_json({"type": message_type, "room_id": job.room_id, "job": job.dict()})
+
+
+@app.post("/jobs/convert", status_code=202, summary="Convert to AICP format in the background")
+async def submit_convert_job(
+    room_id: str = Form(..., description="Room ID to send the converted graph and the job status to", example=""),
+    convert_from: ConvertFromOptions = Query(ConvertFromOptions.askcos),
+    file: UploadFile = File(...),
+):
+    """
+    Start converting an uploaded ASKCOS tree search response to AICP and return at once, instead of holding the
+    request until the conversion finished like `/upload_json_file/?convert_to_aicp=true`.
+
+    The status of the job is sent to the room as 'job-progress' messages (with the current `stage` and, where the
+    stage has items, `done` and `total`), and the converted graph as a 'new-graph' message followed by a
+    'job-completed' message. A failed or cancelled job ends with a 'job-failed' or 'job-cancelled' message.
+    The status can also be requested from `/jobs/{job_id}`.
 
-        # Loop through routes
-        final_routes = []
-        for route in paths:
-            final_routes.append(
-                {
-                    "aggregated_yield": 0.0,
-                    "predicted": True,
-                    "route_index": route["path_index"],
-                    "route_status": "Predicted Synthesis Route",
-                    "method": "ASKCOS v2",
-                    "route_node_labels": route["nodes"]
-                }
-            )
-
-        # Return converted graph
+    At most RW_JOB_CONCURRENCY jobs run at once, further jobs are queued. The jobs share RW_JOB_WORKER_TASKS worker
+    processes, the other workers stay free for rendering.
+
+    **Form Fields (multipart/form-data)**:
+    - `room_id` (str, required): The room ID to associate with the converted data.
+
+    **File Upload**:
+    - `file` (UploadFile, required): The `.json` file of the ASKCOS tree search response.
+
+    **Returns**:
+    The queued job, with its `job_id`.
+    """
+    logger.info(f"[Convert Job] Room ID: {room_id}, convert_from: {convert_from}")
+
+    if room_id not in room_connections:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid room ID: {room_id}")
+
+    document = await file.read()
+
+    async def convert(job: Job) -> dict:
+        # Jobs converting the same file share the conversion, each gets its progress until it is cancelled
+        json_data = json.loads(await cached_conversion(
+            conversion_cache_key("askcos", document),
+            lambda report: _convert_askcos(merge_askcos_json, document, report, JOBS.bounded),
+            progress=job.report,
+        ))
+        await job.report("publishing")
+        graph_data = await publish_graph(room_id, InputFile(**json_data))
         return {
-            "predictive_synth_graph": {
-                "nodes": nodes,
-                "edges": edges
-            },
-            "routes": final_routes
+            "nodes": len((graph_data.get("predictive_synth_graph") or {}).get("nodes") or []),
+            "routes": len(graph_data.get("routes") or []),
         }
-    else:
-        raise HTTPException(
-            status_code=400, detail="Unsupported conversion format")
+
+    return JOBS.submit("convert", room_id, convert, send_job_status).dict()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Returns the status of a background job: its `status` (queued, running, completed, failed or cancelled), the
+    `stage` it is at, its progress (`done` of `total`), the `error` of a failed job and the `result` of a completed
+    one. Finished jobs are kept for the last RW_JOB_HISTORY_SIZE jobs.
+    """
+    try:
+        return JOBS.get(job_id).dict()
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=e.message)
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancels a queued or running background job. The job stops at its next step and its room receives a
+    'job-cancelled' message. Finished jobs are returned unchanged.
+    """
+    try:
+        return JOBS.cancel(job_id).dict()
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=e.message)
@@ -0,0 +1,210 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Read the atoms and atom map numbers of (reaction) SMILES straight from the string, without building RDKit
+# molecules. Used as the fast path of the atom mapping checks and balance indices, which only need the map numbers and
+# the atom counts. Anything the tokenizer is not sure about is rejected, so that callers can fall back to RDKit.
+#
+# The SMILES syntax is checked by a single regular expression over the token sequence. The parts that are not regular
+# (branch depth and ring closure pairing) are checked on the 'skeleton' of the SMILES, in which every atom is replaced
+# by '*' and bonds are dropped.
+#
+
+import re
+from typing import List, NamedTuple, Tuple
+
+# Hydrogen is left out on purpose: RDKit keeps or removes explicit hydrogen atoms depending on their environment
+ELEMENTS = """
+    He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn Ga Ge As Se Br Kr Rb Sr Y Zr Nb Mo Tc
+    Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb Lu Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi
+    Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf Es Fm Md No Lr Rf Db Sg Bh Hs Mt Ds Rg Cn Nh Fl Mc Lv Ts Og
+""".split()
+AROMATIC_SYMBOLS = ["se", "as", "te", "b", "c", "n", "o", "p", "s"]
+
+
+def _symbol_pattern(symbols: List[str]) -> str:
+    """Regular expression matching any of the symbols, grouped by their first letter to avoid trying each in turn."""
+    groups = {}
+    for symbol in symbols:
+        groups.setdefault(symbol[0], set()).add(symbol[1:])
+    alternatives = []
+    for first, rests in sorted(groups.items()):
+        seconds = "".join(sorted(rest for rest in rests if rest))
+        if not seconds:
+            alternatives.append(re.escape(first))
+        else:
+            alternatives.append(f"{re.escape(first)}[{seconds}]{'?' if '' in rests else ''}")
+    return "|".join(alternatives)
+
+
+_SYMBOL = _symbol_pattern(ELEMENTS + AROMATIC_SYMBOLS + ["*"])
+_CHIRALITY = r"(?:@@?|@(?:TH|AL|SP|TB|OH)\d{1,2})"
+_CHARGE = r"(?:\+\+?|--?|[+-]\d{1,2})"
+_BRACKET_ATOM = rf"\[\d*(?:{_SYMBOL}){_CHIRALITY}?(?:H\d?)?{_CHARGE}?(?::(?:0|[1-9]\d*))?\]"
+_ORGANIC_ATOM = r"(?:Br|Cl|[BCNOPSFIbcnops*])"
+_ATOM = rf"(?:{_BRACKET_ATOM}|{_ORGANIC_ATOM})"
+_BOND = r"[-=#$:/\\]"
+_RING = rf"(?:{_BOND}?(?:%\d\d|\d))"
+# Ring closures follow an atom or another ring closure. A branch opens after an atom, ring closure or closed branch
+# and starts with an atom. A closed branch is followed by another branch, an atom, a fragment separator or the end.
+_FRAGMENT = rf"{_ATOM}{_RING}*(?:\({_BOND}?{_ATOM}{_RING}*|\)+(?![%\d])|{_BOND}?{_ATOM}{_RING}*)*"
+SMILES_PATTERN = re.compile(rf"{_FRAGMENT}(?:\.{_FRAGMENT})*")
+
+BRACKET_ATOM_PATTERN = re.compile(r"\[[^\[\]]*\]")
+ATOM_MAP_PATTERN = re.compile(r":(\d+)\]")
+RING_CLOSURE_PATTERN = re.compile(r"%\d\d|\d")
+CLOSED_BRANCH_PATTERN = re.compile(r"\([^()]*\)")
+AROMATIC_ORGANIC_PATTERN = re.compile(r"[bcnops]")
+AROMATIC_BRACKET_PATTERN = re.compile(r"\[\d*(?:se|as|te|[bcnops])")
+# The skeleton reduced to atoms ('*'), branches, fragment separators and ring closures. The grammar only allows 'l'
+# and 'r' outside of brackets in 'Cl' and 'Br', so they can be dropped
+ATOMS_ONLY = str.maketrans("BCNOPSFIbcnops", "*" * 14, "lr-=#$:/\\")
+BRANCHES_ONLY = str.maketrans("", "", "*%0123456789")
+RING_DIGITS = str.maketrans("", "", "%0123456789")
+
+
+class SmilesTokenizerError(Exception):
+    """Exception raised for SMILES the tokenizer does not handle, these have to be parsed with RDKit instead."""
+
+    def __init__(self, smiles: str, message: str):
+        self.smiles = smiles
+        self.message = message
+        super().__init__(self.message)
+
+
+class SmilesAtoms(NamedTuple):
+    atoms: int  # Number of atoms, as GetNumAtoms() of the RDKit molecule (hydrogens are implicit)
+    map_numbers: List[int]  # Atom map numbers of the mapped atoms, in order of appearance
+
+
+def _check_branches(smiles: str, atoms_only: str) -> None:
+    """Check that branches are balanced and do not contain fragment separators."""
+    depth = 0
+    for char in atoms_only.translate(BRANCHES_ONLY):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth < 0:
+                raise SmilesTokenizerError(smiles, "Unbalanced branch")
+        elif depth:
+            raise SmilesTokenizerError(smiles, "Fragment separator inside a branch")
+    if depth:
+        raise SmilesTokenizerError(smiles, "Unbalanced branch")
+
+
+def _is_chain_bonded(first: int, second: int, atoms_only: str) -> bool:
+    """Whether the atom at position ``second`` of the skeleton follows the one at ``first`` in the chain."""
+    between = atoms_only[first + 1 : second].translate(RING_DIGITS)
+    if between.endswith("*"):
+        # The usual case, the second atom follows another atom
+        return False
+    while ")" in between:
+        between, closed = CLOSED_BRANCH_PATTERN.subn("", between)
+        if not closed:
+            # The chain left the branch of the first atom
+            return False
+    return "*" not in between
+
+
+def _check_rings(smiles: str, atoms_only: str) -> None:
+    """Check that ring closures are paired and bond two different atoms, which are not bonded already."""
+    open_rings = {}
+    ring_bonds = set()
+    for match in RING_CLOSURE_PATTERN.finditer(atoms_only):
+        # Atoms are identified by their position in the skeleton
+        atom = atoms_only.rfind("*", 0, match.start())
+        opened = open_rings.pop(match.group(), None)
+        if opened is None:
+            open_rings[match.group()] = atom
+            continue
+        if "." in atoms_only[opened:atom]:
+            raise SmilesTokenizerError(smiles, "Ring closure between fragments")
+        if opened == atom or (opened, atom) in ring_bonds or _is_chain_bonded(opened, atom, atoms_only):
+            raise SmilesTokenizerError(smiles, "Ring closure duplicates a bond")
+        ring_bonds.add((opened, atom))
+    if open_rings:
+        raise SmilesTokenizerError(smiles, "Unclosed ring")
+
+
+def _check_aromatic_fragments(smiles: str, skeleton: str) -> None:
+    """Reject aromatic fragments without rings, RDKit cannot kekulize them."""
+    for fragment, fragment_skeleton in zip(smiles.split("."), skeleton.split(".")):
+        if RING_CLOSURE_PATTERN.search(fragment_skeleton) is None and (
+            AROMATIC_ORGANIC_PATTERN.search(fragment_skeleton) or AROMATIC_BRACKET_PATTERN.search(fragment)
+        ):
+            raise SmilesTokenizerError(smiles, "Aromatic atoms outside of rings")
+
+
+def scan_smiles(smiles: str) -> SmilesAtoms:
+    """
+    Count the atoms of a (multi-fragment) SMILES and collect its atom map numbers.
+
+    Only the syntax is checked, e.g. balanced branches and closed rings, not the chemistry (valences, kekulization).
+    Explicit hydrogen atoms (e.g. '[H]' or '[2H]') are rejected, as RDKit keeps or removes them depending on their
+    environment. So are aromatic fragments without rings.
+
+    Args:
+        smiles (str): SMILES string, may contain several fragments separated by '.'
+
+    Returns:
+        SmilesAtoms: atom count and atom map numbers
+
+    Raises:
+        SmilesTokenizerError: if the SMILES is invalid or not supported by the tokenizer
+    """
+    if not smiles:
+        return SmilesAtoms(0, [])
+    if SMILES_PATTERN.fullmatch(smiles) is None:
+        raise SmilesTokenizerError(smiles, f"Unsupported SMILES {smiles}")
+
+    skeleton = BRACKET_ATOM_PATTERN.sub("*", smiles)
+    atoms_only = skeleton.translate(ATOMS_ONLY)
+    if "(" in atoms_only or ")" in atoms_only:
+        _check_branches(smiles, atoms_only)
+    if RING_CLOSURE_PATTERN.search(atoms_only):
+        _check_rings(smiles, atoms_only)
+    _check_aromatic_fragments(smiles, skeleton)
+
+    atoms = atoms_only.count("*")
+    map_numbers = list(map(int, ATOM_MAP_PATTERN.findall(smiles)))
+    if 0 in map_numbers:
+        # Map number 0 means unmapped
+        map_numbers = [map_number for map_number in map_numbers if map_number]
+    return SmilesAtoms(atoms, map_numbers)
+
+
+def split_reaction_smiles(rxsmiles: str) -> Tuple[List[List[str]], str]:
+    """
+    Split a reaction SMILES into the fragments of its reactants, reagents and products, and its extension.
+
+    Args:
+        rxsmiles (str): reaction SMILES with an optional extension, e.g. '|f:1.2|'
+
+    Returns:
+        (list, str): fragment SMILES of the three sections, and the extension without the enclosing '|'
+
+    Raises:
+        SmilesTokenizerError: if the reaction SMILES does not have exactly three sections
+    """
+    smiles, _, extension = rxsmiles.strip().partition("|")
+    sections = smiles.strip().split(">")
+    if len(sections) != 3:
+        raise SmilesTokenizerError(rxsmiles, "Reaction SMILES must have reactants, reagents and products")
+    return [section.split(".") if section else [] for section in sections], extension.strip().rstrip("|")
+
+
+def reaction_has_atom_mapping(rxsmiles: str) -> bool:
+    """
+    Check whether any atom of a reaction SMILES has an atom map number.
+
+    Raises:
+        SmilesTokenizerError: if any fragment is not supported by the tokenizer
+    """
+    sections, _ = split_reaction_smiles(rxsmiles)
+    has_mapping = False
+    for fragments in sections:
+        for fragment in fragments:
+            # Every fragment is scanned, as an unsupported one has to be decided by RDKit
+            has_mapping = bool(scan_smiles(fragment).map_numbers) or has_mapping
+    return has_mapping
@@ -0,0 +1,137 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Index of substance identifiers. Maps a SMILES to its RDKit canonical SMILES and InChIKey, computed once per
+# distinct SMILES from a single parse, kept in memory and (if RW_SUBSTANCE_INDEX_DIR is set) on disk, so that graphs
+# sharing substances with earlier uploads or conversions skip RDKit entirely.
+#
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from rdkit import Chem
+
+from cache_utils import MISSING, TieredCache, make_cache_key
+from executor_utils import PROCESS_POOL
+from mol_cache_utils import mol_from_smiles
+
+logger = logging.getLogger(__name__)
+
+SUBSTANCE_INDEX = TieredCache(
+    "substances",
+    max_entries=int(os.getenv("RW_SUBSTANCE_INDEX_SIZE", "65536")),
+    directory=os.getenv("RW_SUBSTANCE_INDEX_DIR") or None,
+    max_disk_bytes=int(os.getenv("RW_SUBSTANCE_INDEX_DISK_BYTES", str(256 * 1024 * 1024))),
+)
+
+# Number of substances whose identifiers are computed by one worker task
+SUBSTANCE_BATCH_CHUNK_SIZE = 256
+
+# Canonical SMILES and InChIKey (None if RDKit cannot compute it)
+SubstanceIdentifiers = Tuple[str, Optional[str]]
+
+
+def _index_key(smiles: str) -> str:
+    return make_cache_key("substance", smiles)
+
+
+def substance_identifiers(smiles: str) -> Optional[SubstanceIdentifiers]:
+    """
+    Canonical SMILES and InChIKey of a substance, both computed from one parse of the SMILES. Not looked up in the
+    index, see ``lookup_substance_identifiers``.
+
+    Returns:
+        tuple: the RDKit canonical SMILES and the InChIKey (None if RDKit cannot compute it), or None if RDKit cannot
+        parse the SMILES
+    """
+    mol = mol_from_smiles(smiles)
+    if mol is None:
+        return None
+    try:
+        inchikey = Chem.MolToInchiKey(mol) or None
+    except Exception as e:
+        logger.debug(f"Computing the InChIKey of {smiles} failed: {e}")
+        inchikey = None
+    return Chem.MolToSmiles(mol), inchikey
+
+
+def substance_identifiers_batch(smiles_list: List[str]) -> List[Optional[SubstanceIdentifiers]]:
+    """Compute ``substance_identifiers`` for many substances in one worker task."""
+    return [substance_identifiers(smiles) for smiles in smiles_list]
+
+
+def lookup_substance_identifiers(smiles: str) -> Optional[SubstanceIdentifiers]:
+    """``substance_identifiers`` of a single substance, answered from and added to ``SUBSTANCE_INDEX``."""
+    key = _index_key(smiles)
+    identifiers = SUBSTANCE_INDEX.get(key)
+    if identifiers is MISSING:
+        identifiers = substance_identifiers(smiles)
+        if identifiers is not None:
+            SUBSTANCE_INDEX.put(key, identifiers)
+    return identifiers
+
+
+async def _identifiers_chunk(
+    chunk: List[str], bound: Optional[Callable[[Callable[[], Awaitable[Any]]], Awaitable[Any]]] = None
+) -> Tuple[List[str], List[Optional[SubstanceIdentifiers]]]:
+    def run() -> Awaitable[List[Optional[SubstanceIdentifiers]]]:
+        return PROCESS_POOL.run(substance_identifiers_batch, chunk)
+
+    return chunk, await (bound(run) if bound is not None else run())
+
+
+async def get_substance_identifiers(
+    smiles_list: Iterable[str],
+    progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    bound: Optional[Callable[[Callable[[], Awaitable[Any]]], Awaitable[Any]]] = None,
+) -> Dict[str, Optional[SubstanceIdentifiers]]:
+    """
+    Batched ``lookup_substance_identifiers``. Every distinct SMILES is looked up in ``SUBSTANCE_INDEX`` and the
+    missing ones are computed in chunks spread over the process pool.
+
+    Args:
+        smiles_list (Iterable[str]): SMILES of the substances
+        progress (Callable, optional): coroutine function called with the number of substances done and the number
+            of distinct substances after each computed chunk
+        bound (Callable, optional): called with a coroutine function starting a worker task instead of starting it
+            directly, e.g. to limit the workers the chunks may occupy
+
+    Returns:
+        dict: the identifiers (or None if RDKit cannot parse the SMILES) of every distinct SMILES
+
+    Raises:
+        TaskTimeoutError: if a chunk cannot be computed in time. Errors of the process pool are raised as well, the
+            substances are not computed on the event loop instead
+    """
+    results: Dict[str, Optional[SubstanceIdentifiers]] = {}
+    missing = []
+    for smiles in dict.fromkeys(smiles_list):
+        identifiers = SUBSTANCE_INDEX.get(_index_key(smiles))
+        if identifiers is MISSING:
+            missing.append(smiles)
+        else:
+            results[smiles] = identifiers
+
+    total = len(results) + len(missing)
+    chunks = [missing[i:i + SUBSTANCE_BATCH_CHUNK_SIZE] for i in range(0, len(missing), SUBSTANCE_BATCH_CHUNK_SIZE)]
+    tasks = [asyncio.ensure_future(_identifiers_chunk(chunk, bound)) for chunk in chunks]
+    try:
+        for next_chunk in asyncio.as_completed(tasks):
+            chunk, chunk_results = await next_chunk
+            for smiles, identifiers in zip(chunk, chunk_results):
+                results[smiles] = identifiers
+                if identifiers is not None:
+                    SUBSTANCE_INDEX.put(_index_key(smiles), identifiers)
+            if progress is not None:
+                await progress(len(results), total)
+    finally:
+        # Cancelled (e.g. the conversion job was), the remaining chunks are not needed anymore
+        for task in tasks:
+            task.cancel()
+    return results
+
+
+def substance_index_stats() -> dict:
+    return SUBSTANCE_INDEX.stats()
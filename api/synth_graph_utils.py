@@ -0,0 +1,188 @@
+#
+# Organization: National Center for Advancing Translational Sciences (NCATS/NIH)
+#
+# Aim: Compact synthesis graph for the conversion and role assignment of large graphs. Node IDs are interned to
+# integers, node types and substance roles are kept in typed arrays and edges in CSR/CSC arrays, so a graph costs a
+# few bytes per node and edge instead of a Python dict each. Node and edge dicts are only built when serializing.
+#
+
+from array import array
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+# Node type codes
+SUBSTANCE = 0
+REACTION = 1
+OTHER = 2
+NODE_TYPE_CODES = {"substance": SUBSTANCE, "reaction": REACTION}
+
+# Substance role codes, indices into ROLE_NAMES
+NO_ROLE = 0
+STARTING_MATERIAL = 1
+INTERMEDIATE = 2
+TARGET_MOLECULE = 3
+ROLE_NAMES = ["", "sm", "im", "tm"]
+
+
+def node_type_code(node_type: Any) -> int:
+    """Code of an AICP node type ('substance' or 'reaction', case insensitive), OTHER for anything else."""
+    code = NODE_TYPE_CODES.get(node_type)
+    return code if code is not None else NODE_TYPE_CODES.get(str(node_type or "").lower(), OTHER)
+
+
+class SynthGraph:
+    """
+    Immutable directed graph built by ``SynthGraphBuilder``. Node ``i`` has the ID ``ids[i]`` and the type
+    ``node_types[i]``. The successors of node ``i`` are ``indices[indptr[i]:indptr[i + 1]]`` (CSR) and its predecessors
+    ``in_indices[in_indptr[i]:in_indptr[i + 1]]`` (CSC), both in the order the edges were first added.
+    """
+
+    def __init__(
+        self,
+        ids: List[Hashable],
+        node_types: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        in_indptr: np.ndarray,
+        in_indices: np.ndarray,
+    ):
+        self.ids = ids
+        self.node_types = node_types
+        self.indptr = indptr
+        self.indices = indices
+        self.in_indptr = in_indptr
+        self.in_indices = in_indices
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.ids)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices)
+
+    def out_degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def in_degrees(self) -> np.ndarray:
+        return np.diff(self.in_indptr)
+
+    def successors(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node] : self.indptr[node + 1]]
+
+    def predecessors(self, node: int) -> np.ndarray:
+        return self.in_indices[self.in_indptr[node] : self.in_indptr[node + 1]]
+
+    def edges(self) -> Iterator[Tuple[int, int]]:
+        """Yield the (start, end) node indices of all edges, grouped by start node in node order."""
+        starts = np.repeat(np.arange(self.num_nodes), self.out_degrees())
+        return zip(starts.tolist(), self.indices.tolist())
+
+    def substance_roles(self, single_target: bool = False) -> np.ndarray:
+        """
+        Roles of the substances from their degrees: substances without outgoing edges are target molecules,
+        substances without incoming edges starting materials and all other substances intermediates.
+
+        Args:
+            single_target (bool): only the first substance without outgoing edges is a target molecule, the others
+                are starting materials or intermediates by their incoming edges (as for ASKCOS trees)
+
+        Returns:
+            np.ndarray: role code of every node, NO_ROLE for nodes that are not substances
+        """
+        substances = self.node_types == SUBSTANCE
+        roles = np.where(self.in_degrees() == 0, STARTING_MATERIAL, INTERMEDIATE).astype(np.int8)
+        roles[~substances] = NO_ROLE
+        targets = substances & (self.out_degrees() == 0)
+        if single_target:
+            first = np.flatnonzero(targets)[:1]
+            roles[first] = TARGET_MOLECULE
+        else:
+            roles[targets] = TARGET_MOLECULE
+        return roles
+
+
+class SynthGraphBuilder:
+    """
+    Collects the nodes and edges of a ``SynthGraph``. Node IDs are interned on first use. Edges are kept as two
+    integer arrays until ``build``, repeated edges are kept once.
+    """
+
+    def __init__(self):
+        self.ids: List[Hashable] = []
+        self.index: Dict[Hashable, int] = {}
+        self._node_types = array("b")
+        self._starts = array("q")
+        self._ends = array("q")
+
+    def add_node(self, node_id: Hashable, node_type: int = OTHER) -> int:
+        """
+        Add a node, or set the type of a node only known from its edges so far.
+
+        Returns:
+            int: the index of the node
+        """
+        node = self.index.get(node_id)
+        if node is None:
+            node = self.index[node_id] = len(self.ids)
+            self.ids.append(node_id)
+            self._node_types.append(node_type)
+        elif self._node_types[node] == OTHER:
+            self._node_types[node] = node_type
+        return node
+
+    def node(self, node_id: Hashable) -> int:
+        """Index of a node, added with type OTHER if it is not known yet."""
+        node = self.index.get(node_id)
+        return node if node is not None else self.add_node(node_id)
+
+    def node_type(self, node: int) -> int:
+        return self._node_types[node]
+
+    def add_edge(self, start: int, end: int) -> None:
+        self._starts.append(start)
+        self._ends.append(end)
+
+    def add_nodes(self, node_ids: List[Hashable], node_types: Iterable[int]) -> Sequence[int]:
+        """Add many nodes, see ``add_node``. Returns their indices."""
+        if not self.ids:
+            index = dict(zip(node_ids, range(len(node_ids))))
+            if len(index) == len(node_ids):
+                # Distinct IDs, interned without a call per node
+                self.index = index
+                self.ids = list(node_ids)
+                self._node_types.extend(node_types)
+                return range(len(node_ids))
+        return list(map(self.add_node, node_ids, node_types))
+
+    def add_edges_by_id(self, start_ids: Sequence[Hashable], end_ids: Sequence[Hashable]) -> None:
+        """Add the edges between the nodes with the given start and end IDs, adding unknown nodes with type OTHER."""
+        for edge_ends, node_ids in ((self._starts, start_ids), (self._ends, end_ids)):
+            nodes = list(map(self.index.get, node_ids))
+            if None in nodes:
+                nodes = [self.node(node_id) for node_id in node_ids]
+            edge_ends.extend(nodes)
+
+    def build(self) -> SynthGraph:
+        num_nodes = len(self.ids)
+        starts = np.frombuffer(self._starts, dtype=np.int64)
+        ends = np.frombuffer(self._ends, dtype=np.int64)
+        # First occurrence of every distinct edge
+        _, first = np.unique(starts * num_nodes + ends, return_index=True)
+        first.sort()
+        out_order = first[np.argsort(starts[first], kind="stable")]
+        in_order = first[np.argsort(ends[first], kind="stable")]
+
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(starts[out_order], minlength=num_nodes), out=indptr[1:])
+        in_indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ends[in_order], minlength=num_nodes), out=in_indptr[1:])
+        return SynthGraph(
+            self.ids,
+            np.frombuffer(self._node_types, dtype=np.int8).copy(),
+            indptr,
+            ends[out_order],
+            in_indptr,
+            starts[in_order],
+        )
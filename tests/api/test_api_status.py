@@ -1,5 +1,11 @@
+import os
+import subprocess
+import sys
+
 import requests
 
+API_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "api")
+
 def test_root_endpoint_returns_200(base_api_url):
     response = requests.get(f"{base_api_url}/")
     assert response.status_code == 200, f"Expected 200 OK but got {response.status_code}"
@@ -8,3 +14,115 @@ def test_status_endpoint_returns_ok(base_api_url):
     response = requests.get(f"{base_api_url}/status")
     assert response.status_code == 200, f"Expected 200 OK but got {response.status_code}"
     assert response.json() == {"status": "OK"}, f"Expected body {{'status': 'OK'}} but got {response.json()}"
+
+def test_metrics_reports_process_pool(base_api_url):
+    response = requests.get(f"{base_api_url}/metrics")
+    assert response.status_code == 200
+
+    pool = response.json()["process_pool"]
+    for key in ["workers", "pending", "queue_depth", "submitted", "completed", "failed", "timeouts", "recycled"]:
+        assert key in pool, f"Missing {key} in process pool metrics"
+
+def test_metrics_reports_worker_caches(base_api_url):
+    payload = {"rxsmiles": "[CH3:1][OH:2].[Na+].[Cl-]>>[CH3:1][Cl:3] |f:1.2|"}
+    assert requests.post(f"{base_api_url}/normalize_roles", json=payload).status_code == 200
+
+    response = requests.get(f"{base_api_url}/metrics")
+    assert response.status_code == 200
+
+    fragments = response.json()["worker_caches"]["fragment_properties"]
+    for key in ["workers", "entries", "hits", "misses", "hit_rate"]:
+        assert key in fragments, f"Missing {key} in fragment cache metrics"
+    assert fragments["hits"] + fragments["misses"] > 0
+
+
+def test_metrics_reports_molecule_cache(base_api_url):
+    params = {"mol_smiles": "c1ccccc1O", "img_width": 120, "img_height": 120}
+    assert requests.get(f"{base_api_url}/molsmiles2svg", params=params).status_code == 200
+
+    response = requests.get(f"{base_api_url}/metrics")
+    assert response.status_code == 200
+
+    molecules = response.json()["worker_caches"]["molecules"]
+    for key in ["workers", "entries", "hits", "misses", "size_bytes"]:
+        assert key in molecules, f"Missing {key} in molecule cache metrics"
+    assert molecules["entries"] > 0
+
+
+def test_metrics_reports_substance_index(base_api_url):
+    source_data = {
+        "status_code": 200,
+        "message": "",
+        "result": {
+            "stats": {},
+            "graph": None,
+            "paths": [
+                {
+                    "nodes": [
+                        {"id": "c1", "type": "chemical", "smiles": "CC(=O)OCC"},
+                        {"id": "r1", "type": "reaction", "smiles": "CCO.CC(=O)O>>CC(=O)OCC"},
+                        {"id": "c2", "type": "chemical", "smiles": "CCO"},
+                        {"id": "c3", "type": "chemical", "smiles": "CC(=O)O"},
+                    ],
+                    "edges": [{"from": "c1", "to": "r1"}, {"from": "r1", "to": "c2"}, {"from": "r1", "to": "c3"}],
+                }
+            ],
+        },
+    }
+    for run in range(2):
+        # Different bodies, so the second conversion is not answered from the conversion cache
+        payload = {"convert_from": "askcos", "source_data": {**source_data, "message": f"run {run}"}}
+        assert requests.post(f"{base_api_url}/convert2aicp", json=payload).status_code == 200
+
+    response = requests.get(f"{base_api_url}/metrics")
+    assert response.status_code == 200
+
+    substances = response.json()["substance_index"]
+    for key in ["entries", "hits", "misses", "disk"]:
+        assert key in substances, f"Missing {key} in substance index metrics"
+    assert substances["entries"] >= 3
+    assert substances["hits"] >= 3
+
+
+REPLACE_BROKEN_POOL = """
+import asyncio, os, time
+from concurrent.futures.process import BrokenProcessPool
+from executor_utils import ProcessPool
+
+async def main():
+    pool = ProcessPool(2)
+    await pool.start()
+    broken = pool._executor
+    # One worker dies while the other runs a task and more tasks wait in the queue
+    tasks = [pool.run(time.sleep, 2), pool.run(os._exit, 1), pool.run(time.sleep, 2), pool.run(time.sleep, 2)]
+    crash = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(result, BrokenProcessPool) for result in crash), crash
+
+    # The replacement pool is busy and has a queued task when a caller of the broken pool learns about it
+    running = [asyncio.ensure_future(pool.run(time.sleep, 0.5)) for _ in range(2)]
+    queued = asyncio.ensure_future(pool.run(pow, 2, 10))
+    await asyncio.sleep(0.1)
+    replacement = pool._executor
+    assert replacement is not broken
+    pool._get_executor = lambda: broken
+    try:
+        await pool.run(pow, 2, 3)
+    except BrokenProcessPool:
+        pass
+    del pool._get_executor
+    assert pool._executor is replacement
+    assert await queued == 1024
+    await asyncio.gather(*running)
+    print(await pool.run(pow, 3, 2))
+    pool.shutdown()
+
+asyncio.run(main())
+"""
+
+def test_broken_pool_is_replaced_without_cancelling_its_replacement():
+    env = {key: value for key, value in os.environ.items() if not key.startswith("RW_")}
+    result = subprocess.run(
+        [sys.executable, "-c", REPLACE_BROKEN_POOL], cwd=API_DIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ["9"]
@@ -1,7 +1,14 @@
+import os
+import subprocess
+import sys
+import time
+
 import pytest
 import requests
 from urllib.parse import urlencode
 
+API_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "api")
+
 RXSMILES_VALID = "CCO.CC(=O)O>>CC(=O)OCC.O"
 RXSMILES_INVALID = "INVALID>>RXNSMILES"
 DEFAULT_INVALID_SVG = "PHN2ZyB3aWR0aD0iNDUwIiBoZWlnaHQ9Ijc1IiB4bWxucz0iaHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmciPgogICAgICAgICAgPHJlY3Qgd2lkdGg9IjEwMCUiIGhlaWdodD0iMTAwJSIgZmlsbD0id2hpdGUiIC8+CiAgICAgICAgICA8dGV4dCB4PSIxMCIgeT0iNTAiIGZvbnQtc2l6ZT0iMzIiIGZpbGw9ImJsYWNrIj5VbmFibGUgdG8gZ2VuZXJhdGUgcmVhY3Rpb24gU1ZHPC90ZXh0PgogICAgICAgIDwvc3ZnPg=="
@@ -99,3 +106,230 @@ def test_molsmiles2svg_invalid_smiles_returns_400(base_api_url):
     url = f"{base_api_url}/molsmiles2svg?{urlencode(params)}"
     response = requests.get(url, headers={"accept": "application/json"})
     assert response.status_code == 400, f"Expected 400 Bad Request, got {response.status_code}"
+
+
+def test_render_cache_serves_repeated_requests(base_api_url):
+    params = {
+        "mol_smiles": "c1ccc2ccccc2c1",
+        "img_width": 123,
+        "img_height": 123,
+        "base64_encode": "false",
+    }
+    url = f"{base_api_url}/molsmiles2svg?{urlencode(params)}"
+
+    first = requests.get(url).json()
+    hits_before = requests.get(f"{base_api_url}/metrics").json()["render_cache"]["hits"]
+    second = requests.get(url).json()
+    hits_after = requests.get(f"{base_api_url}/metrics").json()["render_cache"]["hits"]
+
+    assert first["svg"] == second["svg"], "Cached SVG differs from the first render"
+    assert hits_after == hits_before + 1, "Repeated request was not served from the render cache"
+
+
+def test_render_keys_of_repeated_requests_are_cached(base_api_url):
+    for endpoint, params in [
+        ("molsmiles2svg", {"mol_smiles": "c1ccc2cc3ccccc3cc2c1", "img_width": 124, "img_height": 124}),
+        ("rxsmiles2svg", {"rxsmiles": "c1ccc2cc3ccccc3cc2c1>>C1=CC=C2C=C3C=CC=CC3=CC2=C1", "highlight": "false"}),
+    ]:
+        url = f"{base_api_url}/{endpoint}?{urlencode(params)}"
+        assert requests.get(url).status_code == 200
+        hits_before = requests.get(f"{base_api_url}/metrics").json()["render_cache"]["keys"]["hits"]
+        assert requests.get(url).status_code == 200
+        hits_after = requests.get(f"{base_api_url}/metrics").json()["render_cache"]["keys"]["hits"]
+        assert hits_after == hits_before + 1, f"The render key of a repeated {endpoint} request was computed again"
+
+
+def test_molsmiles2svg_invalid_smiles_is_negatively_cached(base_api_url):
+    params = {"mol_smiles": INVALID_SMILES, "img_width": 300, "img_height": 300}
+    url = f"{base_api_url}/molsmiles2svg?{urlencode(params)}"
+
+    assert requests.get(url).status_code == 400
+    negative_hits_before = requests.get(f"{base_api_url}/metrics").json()["render_cache"]["negative"]["hits"]
+    assert requests.get(url).status_code == 400
+    negative_hits_after = requests.get(f"{base_api_url}/metrics").json()["render_cache"]["negative"]["hits"]
+
+    assert negative_hits_after == negative_hits_before + 1, "Invalid SMILES was not answered from the negative cache"
+
+
+def test_render_batch_returns_svgs_keyed_by_id(base_api_url):
+    payload = {
+        "items": [
+            {"id": "mol_1", "kind": "molecule", "smiles": DEFAULT_SMILES, "img_width": 200, "img_height": 150},
+            {"id": "mol_2", "kind": "molecule", "smiles": DEFAULT_SMILES, "img_width": 200, "img_height": 150},
+            {"id": "rxn_1", "kind": "reaction", "smiles": RXSMILES_VALID, "highlight": True},
+            {"id": "bad_mol", "kind": "molecule", "smiles": INVALID_SMILES},
+        ]
+    }
+    response = requests.post(f"{base_api_url}/render/batch", json=payload)
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+
+    results = response.json()["results"]
+    assert set(results) == {"mol_1", "mol_2", "rxn_1", "bad_mol"}
+
+    assert results["mol_1"]["svg"].startswith("<?xml")
+    assert (results["mol_1"]["width"], results["mol_1"]["height"]) == (200, 150)
+    assert results["mol_1"]["svg"] == results["mol_2"]["svg"], "Duplicate items should share one render"
+
+    assert results["rxn_1"]["error"] is None
+    assert results["rxn_1"]["width"] > 0 and results["rxn_1"]["height"] > 0
+
+    assert results["bad_mol"]["svg"] is None
+    assert results["bad_mol"]["error"], "Invalid SMILES should be reported per item"
+
+
+@pytest.mark.parametrize("response_format,media_type,magic", [
+    ("svg", "image/svg+xml", b"<?xml"),
+    ("png", "image/png", b"\x89PNG"),
+])
+def test_render_raw_image_with_etag(base_api_url, response_format, media_type, magic):
+    for endpoint, params in [
+        ("molsmiles2svg", {"mol_smiles": DEFAULT_SMILES, "response_format": response_format}),
+        ("rxsmiles2svg", {"rxsmiles": RXSMILES_VALID, "response_format": response_format}),
+    ]:
+        url = f"{base_api_url}/{endpoint}?{urlencode(params)}"
+        response = requests.get(url)
+        assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+        assert response.headers["content-type"].startswith(media_type)
+        assert response.content.startswith(magic)
+        assert "max-age" in response.headers["cache-control"]
+
+        etag = response.headers["etag"]
+        cached = requests.get(url, headers={"If-None-Match": etag})
+        assert cached.status_code == 304, f"Expected 304 Not Modified, got {cached.status_code}"
+        assert cached.content == b""
+
+
+
+def test_render_reaction_etag_ignores_atom_map_numbers(base_api_url):
+    # Without highlighting the atom map numbers are not drawn, so renumbered reactions share one depiction
+    etags = []
+    for rxsmiles in ["[CH3:1][OH:2]>>[CH3:1]Cl", "[CH3:5][OH:9]>>[CH3:5]Cl"]:
+        params = {"rxsmiles": rxsmiles, "highlight": False, "response_format": "svg"}
+        response = requests.get(f"{base_api_url}/rxsmiles2svg?{urlencode(params)}")
+        assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+        etags.append(response.headers["etag"])
+    assert etags[0] == etags[1]
+
+def test_render_sprite_sheet_has_symbol_per_substance(base_api_url):
+    payload = {
+        "synth_graph": {
+            "nodes": [
+                {"node_label": "LFQSCWFLJHTTHZ-UHFFFAOYSA-N", "node_type": "substance", "uuid": "s1",
+                 "inchikey": "LFQSCWFLJHTTHZ-UHFFFAOYSA-N", "canonical_smiles": "CCO"},
+                {"node_label": "QTBSBXVTEAMEQO-UHFFFAOYSA-N", "node_type": "substance", "uuid": "s2",
+                 "inchikey": "QTBSBXVTEAMEQO-UHFFFAOYSA-N", "canonical_smiles": "CC(=O)O"},
+                {"node_label": "r1", "node_type": "reaction", "uuid": "r1", "rxsmiles": RXSMILES_VALID},
+            ],
+            "edges": [],
+        }
+    }
+    response = requests.post(f"{base_api_url}/render/sprite", json=payload)
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+    assert response.headers["content-type"].startswith("image/svg+xml")
+
+    sprite = response.text
+    assert sprite.count("<symbol ") == 2
+    assert 'id="LFQSCWFLJHTTHZ-UHFFFAOYSA-N"' in sprite
+    assert 'id="QTBSBXVTEAMEQO-UHFFFAOYSA-N"' in sprite
+    assert "<metadata id='index'>" in sprite
+
+    cached = requests.post(
+        f"{base_api_url}/render/sprite", json=payload, headers={"If-None-Match": response.headers["etag"]}
+    )
+    assert cached.status_code == 304
+
+def test_render_sprite_sheet_of_room(base_api_url, room_id):
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", "data", "json_example_1.json")) as f:
+        graph = f.read()
+    response = requests.post(
+        f"{base_api_url}/upload_json_body/", params={"room_id": room_id}, data=graph,
+        headers={"Content-Type": "application/json"}
+    )
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+    published = response.json()["data"]
+
+    # The room's data file is removed within a second of sending it to the room's WebSocket
+    time.sleep(2)
+    response = requests.get(f"{base_api_url}/render/sprite", params={"room_id": room_id})
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+    assert response.text.count("<symbol ") > 0
+
+    # The sprite sheet of the room is the one of the published (enriched) graph, not of the uploaded one
+    enriched = requests.post(f"{base_api_url}/render/sprite", json=published)
+    assert response.text == enriched.text
+
+    missing = requests.get(f"{base_api_url}/render/sprite", params={"room_id": "no-such-room"})
+    assert missing.status_code == 404
+
+RENDER_IN_FRESH_PROCESS = """
+import hashlib, sys
+from render_utils import render_molecule_svg, render_reaction_svg
+def render(smiles):
+    return render_reaction_svg(smiles, True, False) if ">" in smiles else render_molecule_svg(smiles, 300, 300)
+history, targets = sys.argv[1].split(), sys.argv[2:]
+for smiles in history:
+    render(smiles)
+for smiles in targets:
+    print(hashlib.sha256(render(smiles).encode()).hexdigest())
+"""
+
+def run_in_api_process(code, *args):
+    # Runs the renderer in a fresh process with the default configuration, bypassing the server and its caches
+    env = {key: value for key, value in os.environ.items() if not key.startswith("RW_")}
+    env["RW_WORKER_PROCESSES"] = "0"
+    result = subprocess.run(
+        [sys.executable, "-c", code, *args], cwd=API_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return result.stdout.splitlines()
+
+def render_in_fresh_process(history, targets):
+    return run_in_api_process(RENDER_IN_FRESH_PROCESS, " ".join(history), *targets)
+
+def test_render_is_independent_of_render_history():
+    # Depictions are content addressed, so a render must not depend on the coordinates earlier renders stored
+    pytest.importorskip("rdkit")
+    targets = [
+        "[CH3:1][CH2:2][OH:3]>>[CH3:1][CH:2]=[O:3]",
+        "CC(=O)Nc1ccc(O)cc1>>CC(=O)Nc1ccc(OC)cc1",
+        "OC1CCCCC1>>O=C1CCCCC1",
+        "CN1CCC[C@H]1c1cccnc1",
+        "O=C(O)c1ccccc1O",
+    ]
+    # The same molecules written with other atom orders
+    history = ["Oc1ccc(NC(C)=O)cc1", "C1CCCCC1O", "c1cccnc1[C@@H]1CCCN1C", "Oc1ccccc1C(O)=O", "OCC>>CC=O"]
+    cold = render_in_fresh_process([], targets)
+    warm = render_in_fresh_process(history, targets)
+    assert len(cold) == len(targets)
+    assert cold == warm
+
+DESCRIBE_DRAWING_MODES = """
+import io, re, sys
+from PIL import Image
+from draw_utils import reaction_smiles_to_image
+for rxsmiles in sys.argv[1:]:
+    for single_canvas in (True, False):
+        for highlight in (False, True):
+            svg = reaction_smiles_to_image(rxsmiles, highlight=highlight, single_canvas=single_canvas)
+            png = reaction_smiles_to_image(rxsmiles, svg=False, highlight=highlight, single_canvas=single_canvas)
+            width, height = re.search(r"<svg[^>]*width=.([0-9.]+)px.[^>]*height=.([0-9.]+)px", svg).groups()
+            print(rxsmiles, single_canvas, highlight, width, height, svg.count("<path"), *Image.open(io.BytesIO(png)).size)
+"""
+
+def test_reaction_drawing_modes_draw_the_same_components():
+    # The single canvas and the compositor lay the components out alike. The images are not pixel identical, the
+    # molecules may sit a few pixels apart vertically
+    pytest.importorskip("rdkit")
+    reactions = [
+        "CCO.CC(=O)O>>CC(=O)OCC.O",
+        "[CH3:1][OH:2]>>[CH3:1]Cl",
+        "c1ccccc1Br.OB(O)c1ccccc1>>c1ccc(-c2ccccc2)cc1",
+    ]
+    rows = [line.rsplit(" ", 7) for line in run_in_api_process(DESCRIBE_DRAWING_MODES, *reactions)]
+    assert len(rows) == len(reactions) * 4
+
+    drawings = {(rxsmiles, single_canvas, highlight): rest for rxsmiles, single_canvas, highlight, *rest in rows}
+    for rxsmiles in reactions:
+        for highlight in ["False", "True"]:
+            single_canvas, composite = drawings[rxsmiles, "True", highlight], drawings[rxsmiles, "False", highlight]
+            # SVG width and height, number of drawn paths, PNG width and height
+            assert single_canvas == composite, f"{rxsmiles} (highlight={highlight}): {single_canvas} != {composite}"
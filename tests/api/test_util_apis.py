@@ -1,6 +1,14 @@
+import json
+import os
+import pytest
 import requests
+import subprocess
+import sys
+import time
 from urllib.parse import urlencode
 
+API_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "api")
+
 TEST_RXSMILES = "[O:1]=[C:2]1[C:6]2([CH2:11][CH2:10][NH:9][CH2:8][CH2:7]2)[N:5]([C:12]2[CH:17]=[CH:16][CH:15]=[CH:14][CH:13]=2)[CH2:4][N:3]1[CH2:18][C:19]1[CH:31]=[CH:30][CH:29]=[CH:28][C:20]=1[C:21]([O:23][C:24]([CH3:27])([CH3:26])[CH3:25])=[O:22].[I-].[Na+].C(=O)([O-])[O-].[K+].[K+].Cl[CH2:41][CH2:42][CH2:43][N:44]1[C:52]2[C:47](=[CH:48][CH:49]=[CH:50][CH:51]=2)[C:46]([CH3:54])([CH3:53])[C:45]1=[O:55]>CC(=O)CC>[CH3:54][C:46]1([CH3:53])[C:47]2[C:52](=[CH:51][CH:50]=[CH:49][CH:48]=2)[N:44]([CH2:43][CH2:42][CH2:41][N:9]2[CH2:8][CH2:7][C:6]3([N:5]([C:12]4[CH:13]=[CH:14][CH:15]=[CH:16][CH:17]=4)[CH2:4][N:3]([CH2:18][C:19]4[CH:31]=[CH:30][CH:29]=[CH:28][C:20]=4[C:21]([O:23][C:24]([CH3:27])([CH3:25])[CH3:26])=[O:22])[C:2]3=[O:1])[CH2:11][CH2:10]2)[C:45]1=[O:55] |f:1.2,3.4.5|"
 TEST_MAPPED = "[O:1]=[C:2]1[C:6]2([CH2:11][CH2:10][NH:9][CH2:8][CH2:7]2)[N:5]([C:12]2[CH:17]=[CH:16][CH:15]=[CH:14][CH:13]=2)[CH2:4][N:3]1[CH2:18][C:19]1[CH:31]=[CH:30][CH:29]=[CH:28][C:20]=1[C:21]([O:23][C:24]([CH3:27])([CH3:26])[CH3:25])=[O:22].Cl[CH2:41][CH2:42][CH2:43][N:44]1[C:52]2[C:47](=[CH:48][CH:49]=[CH:50][CH:51]=2)[C:46]([CH3:54])([CH3:53])[C:45]1=[O:55]>[K+].[K+].C(=O)([O-])[O-].CC(=O)CC.[Na+].[I-]>[CH3:54][C:46]1([CH3:53])[C:47]2[C:52](=[CH:51][CH:50]=[CH:49][CH:48]=2)[N:44]([CH2:43][CH2:42][CH2:41][N:9]2[CH2:8][CH2:7][C:6]3([N:5]([C:12]4[CH:13]=[CH:14][CH:15]=[CH:16][CH:17]=4)[CH2:4][N:3]([CH2:18][C:19]4[CH:31]=[CH:30][CH:29]=[CH:28][C:20]=4[C:21]([O:23][C:24]([CH3:27])([CH3:25])[CH3:26])=[O:22])[C:2]3=[O:1])[CH2:11][CH2:10]2)[C:45]1=[O:55] |f:2.3.4,6.7|"
 
@@ -51,3 +59,304 @@ def test_compute_all_bi_returns_expected_keys(base_api_url):
         assert key in data, f"Missing key '{key}' in response"
         assert isinstance(data[key], (int, float)
                           ), f"{key} is not a number: {data[key]}"
+
+
+def test_compute_all_bi_reports_atom_counts(base_api_url):
+    params = {"rxsmiles": "[CH3:1][OH:2]>>[CH3:1]Cl"}
+    response = requests.get(f"{base_api_url}/compute_all_bi?{urlencode(params)}")
+
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+
+    data = response.json()
+    assert data["rbi"] == 50.0
+    assert data["pbi"] == 50.0
+    assert data["tbi"] == 33.33
+    assert data["reactant_atoms"] == 2
+    assert data["product_atoms"] == 2
+    assert data["matched_atoms"] == 1
+    assert data["unmapped_reactant_atoms"] == 0
+    assert data["unmapped_product_atoms"] == 1
+
+
+def test_compute_all_bi_counts_explicit_hydrogens(base_api_url):
+    # Explicit hydrogens are counted by RDKit, not by the SMILES tokenizer
+    params = {"rxsmiles": "[CH3:1][2H].[OH2:2]>>[CH3:1][OH:2]"}
+    response = requests.get(f"{base_api_url}/compute_all_bi?{urlencode(params)}")
+
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+
+    data = response.json()
+    assert data["rbi"] == 66.67
+    assert data["pbi"] == 100.0
+    assert data["tbi"] == 66.67
+    assert data["reactant_atoms"] == 3
+    assert data["unmapped_reactant_atoms"] == 1
+
+
+
+def test_compute_all_bi_equivalent_reactions(base_api_url):
+    # Renumbered atom maps, reordered fragments and renumbered fragment groups describe the same reaction
+    results = []
+    for rxsmiles in ["[CH3:1][OH:2].[Na+].[Cl-]>>[CH3:1]Cl |f:1.2|", "[Cl-].[Na+].[CH3:7][OH:5]>>[CH3:7]Cl |f:0.1|"]:
+        response = requests.get(f"{base_api_url}/compute_all_bi?{urlencode({'rxsmiles': rxsmiles})}")
+        assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+        results.append(response.json())
+
+    assert results[0] == results[1]
+    assert results[0]["matched_atoms"] == 1
+
+@pytest.mark.parametrize("rxsmiles", [
+    "[CH3:1][OH:2].c1cccc1>>[CH3:1]Cl",
+    "[CH3:1][OH:2].C(C)(C)(C)(C)C>>[CH3:1]Cl",
+])
+def test_compute_all_bi_skips_unsanitizable_substances(base_api_url, rxsmiles):
+    # Substances RDKit cannot sanitize (kekulization, valence) are not counted, by the single and the batch endpoint
+    response = requests.get(f"{base_api_url}/compute_all_bi?{urlencode({'rxsmiles': rxsmiles})}")
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+    data = response.json()
+    assert (data["rbi"], data["pbi"], data["tbi"]) == (50.0, 50.0, 33.33)
+    assert data["reactant_atoms"] == 2
+
+    response = requests.post(f"{base_api_url}/compute_all_bi/batch", json={"rxsmiles": [rxsmiles]})
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+    (result,) = response.json()["results"]
+    assert (result["rbi"], result["pbi"], result["tbi"]) == (50.0, 50.0, 33.33)
+    assert result["reactant_atoms"] == 2
+
+
+def test_compute_all_bi_batch_reports_errors_inline(base_api_url):
+    payload = {"rxsmiles": ["[CH3:1][OH:2]>>[CH3:1]Cl", "CCO>>CCCl", "[CH3:1][OH:2]>>[CH3:1]Cl"]}
+    response = requests.post(f"{base_api_url}/compute_all_bi/batch", json=payload)
+
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+
+    results = response.json()["results"]
+    assert [result["rxsmiles"] for result in results] == payload["rxsmiles"]
+
+    mapped, unmapped, duplicate = results
+    assert (mapped["rbi"], mapped["pbi"], mapped["tbi"]) == (50.0, 50.0, 33.33)
+    assert mapped["error"] is None
+    assert duplicate == mapped
+    assert unmapped["rbi"] is None
+    assert "No atom mapping" in unmapped["error"]
+
+
+def test_compute_all_bi_batch_rejects_leading_zero_map_numbers(base_api_url):
+    # RDKit does not accept atom map numbers with leading zeros, neither may the SMILES tokenizer
+    payload = {"rxsmiles": ["[CH3:01][OH:2]>>[CH3:01]Cl"]}
+    response = requests.post(f"{base_api_url}/compute_all_bi/batch", json=payload)
+
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+
+    (result,) = response.json()["results"]
+    assert result["rbi"] is None
+    assert result["error"] is not None
+
+
+def test_analyze_reaction_matches_single_endpoints(base_api_url):
+    rxsmiles = "[CH3:1][OH:2].[Na+].[Cl-]>>[CH3:1]Cl |f:1.2|"
+    response = requests.post(f"{base_api_url}/reaction/analyze", json={"rxsmiles": rxsmiles, "depict": True})
+
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+
+    data = response.json()
+    normalized = requests.post(f"{base_api_url}/normalize_roles", json={"rxsmiles": rxsmiles}).json()
+    balance = requests.get(f"{base_api_url}/compute_all_bi?{urlencode({'rxsmiles': rxsmiles})}").json()
+
+    assert data["has_atom_mapping"] is True
+    assert data["normalized_rxsmiles"] == normalized["rxsmiles"]
+    assert all(data[key] == value for key, value in balance.items())
+    assert data["depicted_rxsmiles"] == normalized["rxsmiles"]
+    assert data["svg_base64"]
+
+
+def test_analyze_reaction_without_atom_mapping(base_api_url):
+    response = requests.post(f"{base_api_url}/reaction/analyze", json={"rxsmiles": "CCO>>CCCl"})
+
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+
+    data = response.json()
+    assert data["has_atom_mapping"] is False
+    assert data["normalized_rxsmiles"] is None
+    assert data["rbi"] is None
+    assert data["svg_base64"] is None
+
+
+def test_normalizeroles_batch_reports_errors_inline(base_api_url):
+    payload = {"rxsmiles": [TEST_RXSMILES, "NOMAPPING>>RXSMILES", TEST_RXSMILES, "[CH3:1][OH:2].[Na+]>>[CH3:1]Cl |f:0.2|"]}
+    response = requests.post(f"{base_api_url}/normalize_roles/batch", json=payload)
+
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+
+    results = response.json()["results"]
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert [result["original_rxsmiles"] for result in results] == payload["rxsmiles"]
+
+    mapped, unmapped, duplicate, bad_group = results
+    assert mapped["rxsmiles"] == TEST_MAPPED
+    assert mapped["error"] is None
+    assert duplicate == {**mapped, "index": 2}
+    assert unmapped["rxsmiles"] is None
+    assert unmapped["error_type"] == "RxsmilesAtomMappingException"
+    assert bad_group["error_type"] == "FragmentGroupError"
+
+
+def test_normalizeroles_batch_streams_ndjson(base_api_url):
+    payload = {"rxsmiles": [TEST_RXSMILES, "NOMAPPING>>RXSMILES"], "stream": True}
+    response = requests.post(f"{base_api_url}/normalize_roles/batch", json=payload, stream=True)
+
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    results = sorted((json.loads(line) for line in response.iter_lines() if line), key=lambda result: result["index"])
+    assert [result["original_rxsmiles"] for result in results] == payload["rxsmiles"]
+    assert results[0]["rxsmiles"] == TEST_MAPPED
+    assert results[1]["error_type"] == "RxsmilesAtomMappingException"
+
+
+def test_convert2aicp_merges_askcos_paths(base_api_url):
+    sample = os.path.join(os.path.dirname(__file__), "..", "..", "data", "askcos_route_sample.json")
+    with open(sample, "r") as file:
+        source_data = json.load(file)
+    payload = {"convert_from": "askcos", "source_data": source_data}
+    response = requests.post(f"{base_api_url}/convert2aicp", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    nodes = data["predictive_synth_graph"]["nodes"]
+    node_ids = {node["node_id"] for node in nodes}
+    assert len(node_ids) == len(nodes)
+    assert len({node["canonical_smiles"] for node in nodes if node["node_type"] == "substance"}) == len(
+        [node for node in nodes if node["node_type"] == "substance"]
+    )
+    assert len(data["routes"]) == len(source_data["result"]["paths"])
+    assert all(set(route["route_node_labels"]) <= node_ids for route in data["routes"])
+    assert [node["srole"] for node in nodes if node["node_type"] == "substance"].count("tm") == 1
+
+
+def test_convert2aicp_reuses_cached_conversion(base_api_url):
+    sample = os.path.join(os.path.dirname(__file__), "..", "..", "data", "askcos_route_sample.json")
+    with open(sample, "rb") as file:
+        body = b'{"convert_from": "askcos", "source_data": ' + file.read() + b"}"
+    headers = {"Content-Type": "application/json"}
+
+    first = requests.post(f"{base_api_url}/convert2aicp", data=body, headers=headers)
+    assert first.status_code == 200
+    hits = requests.get(f"{base_api_url}/metrics").json()["conversion_cache"]["hits"]
+
+    second = requests.post(f"{base_api_url}/convert2aicp", data=body, headers=headers)
+    assert second.status_code == 200
+    # Node UUIDs are random, so equal payloads come from the cache
+    assert second.json() == first.json()
+    assert requests.get(f"{base_api_url}/metrics").json()["conversion_cache"]["hits"] == hits + 1
+
+
+def test_convert2aicp_assigns_substance_roles(base_api_url):
+    # c1 is made from c2 and c3, c2 from c4
+    source_data = {
+        "status_code": 200,
+        "message": "substance roles",
+        "result": {
+            "stats": {},
+            "graph": None,
+            "paths": [
+                {
+                    "nodes": [
+                        {"id": "c1", "type": "chemical", "smiles": "CC(=O)OCC"},
+                        {"id": "r1", "type": "reaction", "smiles": "CCO.CC(=O)O>>CC(=O)OCC"},
+                        {"id": "c2", "type": "chemical", "smiles": "CCO"},
+                        {"id": "c3", "type": "chemical", "smiles": "CC(=O)O"},
+                        {"id": "r2", "type": "reaction", "smiles": "CC=O>>CCO"},
+                        {"id": "c4", "type": "chemical", "smiles": "CC=O"},
+                    ],
+                    "edges": [
+                        {"from": "c1", "to": "r1"},
+                        {"from": "r1", "to": "c2"},
+                        {"from": "r1", "to": "c3"},
+                        {"from": "c2", "to": "r2"},
+                        {"from": "r2", "to": "c4"},
+                    ],
+                }
+            ],
+        },
+    }
+    payload = {"convert_from": "askcos", "source_data": source_data}
+    response = requests.post(f"{base_api_url}/convert2aicp", json=payload)
+    assert response.status_code == 200
+
+    nodes = response.json()["predictive_synth_graph"]["nodes"]
+    roles = {node["canonical_smiles"]: node["srole"] for node in nodes if node["node_type"] == "substance"}
+    assert roles == {"CCOC(C)=O": "tm", "CCO": "im", "CC(=O)O": "sm", "CC=O": "sm"}
+    assert all(not node.get("srole") for node in nodes if node["node_type"] == "reaction")
+
+
+BUILD_SYNTH_GRAPH = """
+import json
+from synth_graph_utils import REACTION, ROLE_NAMES, SUBSTANCE, SynthGraphBuilder
+builder = SynthGraphBuilder()
+node_types = [SUBSTANCE, SUBSTANCE, REACTION, SUBSTANCE, REACTION, SUBSTANCE, SUBSTANCE]
+builder.add_nodes(["a", "b", "r1", "c", "r2", "d", "e"], node_types)
+# a -> r1 is added twice, r1 -> x ends at a node that was not added
+builder.add_edges_by_id(["a", "b", "a", "r1", "c", "r2", "r1"], ["r1", "r1", "r1", "c", "r2", "d", "x"])
+graph = builder.build()
+print(json.dumps({
+    "ids": graph.ids,
+    "node_types": graph.node_types.tolist(),
+    "num_edges": graph.num_edges,
+    "edges": [list(edge) for edge in graph.edges()],
+    "predecessors": [graph.predecessors(node).tolist() for node in range(graph.num_nodes)],
+    "roles": [ROLE_NAMES[role] for role in graph.substance_roles().tolist()],
+    "single_target_roles": [ROLE_NAMES[role] for role in graph.substance_roles(single_target=True).tolist()],
+}))
+"""
+
+def test_synth_graph_builder_build():
+    pytest.importorskip("numpy")
+    result = subprocess.run(
+        [sys.executable, "-c", BUILD_SYNTH_GRAPH], cwd=API_DIR, capture_output=True, text=True, check=True
+    )
+    graph = json.loads(result.stdout)
+
+    # The unknown node is added with type OTHER, the repeated edge is kept once
+    assert graph["ids"] == ["a", "b", "r1", "c", "r2", "d", "e", "x"]
+    assert graph["node_types"] == [0, 0, 1, 0, 1, 0, 0, 2]
+    assert graph["num_edges"] == 6
+    assert graph["edges"] == [[0, 2], [1, 2], [2, 3], [2, 7], [3, 4], [4, 5]]
+    assert graph["predecessors"] == [[], [], [0, 1], [2], [3], [4], [], [2]]
+    # Substances without outgoing edges are targets, only the first of them if there is a single target
+    assert graph["roles"] == ["sm", "sm", "", "im", "", "tm", "tm", ""]
+    assert graph["single_target_roles"] == ["sm", "sm", "", "im", "", "tm", "sm", ""]
+
+
+def test_convert2aicp_rejects_invalid_request(base_api_url):
+    response = requests.post(f"{base_api_url}/convert2aicp", json={"convert_from": "other", "source_data": {}})
+    assert response.status_code == 422
+
+
+def test_jobs_convert_rejects_unknown_room(base_api_url):
+    sample = os.path.join(os.path.dirname(__file__), "..", "..", "data", "askcos_route_sample.json")
+    with open(sample, "rb") as file:
+        files = {"file": ("askcos_route_sample.json", file, "application/json")}
+        response = requests.post(f"{base_api_url}/jobs/convert", data={"room_id": "unknown-room"}, files=files)
+    assert response.status_code == 400
+
+
+def test_jobs_unknown_job_returns_404(base_api_url):
+    assert requests.get(f"{base_api_url}/jobs/unknown-job").status_code == 404
+    assert requests.delete(f"{base_api_url}/jobs/unknown-job").status_code == 404
+
+
+def test_upload_sends_graph_to_room_once(base_api_url, room_websocket, room_id):
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", "data", "json_example_1.json")) as f:
+        graph = json.load(f)
+    response = requests.post(f"{base_api_url}/upload_json_body/", params={"room_id": room_id}, json=graph)
+    assert response.status_code == 200, f"Expected 200 OK, got {response.status_code}"
+
+    # Collect the messages of the room for longer than the data directory is polled
+    messages = []
+    deadline = time.monotonic() + 3
+    while (remaining := deadline - time.monotonic()) > 0:
+        try:
+            messages.append(json.loads(room_websocket.recv(timeout=remaining)))
+        except TimeoutError:
+            break
+    assert [message["type"] for message in messages].count("new-graph") == 1
@@ -1,3 +1,4 @@
+import json
 import os
 import pytest
 from playwright.sync_api import sync_playwright
@@ -17,6 +18,20 @@ def base_ui_url():
 def base_api_url():
     return BASE_API_URL
 
+# WebSocket client of a room, the connection stays open for the duration of the test
+@pytest.fixture
+def room_websocket(base_api_url):
+    from websockets.sync.client import connect
+
+    with connect(base_api_url.replace("http", "ws", 1) + "/ws") as websocket:
+        yield websocket
+
+@pytest.fixture
+def room_id(room_websocket):
+    message = json.loads(room_websocket.recv(timeout=10))
+    assert message["type"] == "new-room"
+    return message["room_id"]
+
 @pytest.fixture(scope="session")
 def browser():
     with sync_playwright() as p:
@@ -20,13 +20,29 @@ import {
   getReactionRdkitSvgByRxsmiles,
   getMoleculeRdkitSvgBySmiles,
   checkApiStatus,
-  compute_balance,
+  analyzeReaction,
   hasAtomMapping,
-  normalizeRoles,
 } from "./helpers/apiHelpers";
 
 const defaultApiStatus = { error: false };
 
+// Returns a copy of the Cytoscape element showing a depiction streamed by the server ('node-svg' message)
+const applyStreamedSvg = (graphElement, depiction) => {
+  const isSubstance = graphElement.data.nodeType === "substance";
+  // Same sizes as the requested depictions: substances depend on their role, reactions on the SVG
+  const substanceSize = graphElement.data.srole === "tm" ? 250 : 100;
+  return {
+    ...graphElement,
+    data: {
+      ...graphElement.data,
+      svg: depiction.svg,
+      width: isSubstance ? substanceSize : depiction.width,
+      height: isSubstance ? substanceSize : depiction.height,
+      type: isSubstance ? graphElement.data.type : "custom",
+    },
+  };
+};
+
 function App() {
   const navigate = useNavigate();
   useEffect(() => {
@@ -54,9 +70,33 @@ function App() {
       } else if (messageType === "new-graph") {
         // Update the graph object with the received data
         const finalData = data.data;
+        // The depictions streamed for the graph are kept if the same graph is sent again
+        const graphJson = JSON.stringify(finalData);
+        if (graphJson !== streamedGraphJsonRef.current) {
+          streamedGraphJsonRef.current = graphJson;
+          streamedSvgsRef.current = {};
+        }
         setAicpGraph(finalData);
         // const mappedData = mapGraphDataToCytoscape(finalData);
         // updateCytoscapeGraph(mappedData);
+      } else if (messageType === "node-svg") {
+        // Depiction streamed by the server as soon as it is rendered, shown until the requested SVGs arrive
+        const depiction = {
+          svg: `data:image/svg+xml;base64,${data.svg_base64}`,
+          width: data.width,
+          height: data.height,
+        };
+        streamedSvgsRef.current[data.node_label] = depiction;
+        setCytoscapeGraph((prev) =>
+          prev.map((graphElement) =>
+            graphElement.data.id === data.node_label && !graphElement.data.svg
+              ? applyStreamedSvg(graphElement, depiction)
+              : graphElement
+          )
+        );
+      } else if (messageType === "graph-ready") {
+        // The server finished rendering and pre-computing the uploaded graph, its requests are served from cache now
+        console.log("Graph pre-computation finished for room", data.room_id);
       } else {
         console.error("Unknown message type:", messageType);
       }
@@ -100,6 +140,8 @@ function App() {
   const [roomId, setRoomId] = useState("");
   const preserveSubgraphIndexRef = useRef(false);
   const resetReagentOriginalGraph = useRef(false);
+  const streamedSvgsRef = useRef({});
+  const streamedGraphJsonRef = useRef(null);
 
 
   useEffect(() => {
@@ -205,26 +247,23 @@ function App() {
         promises.push(substancePromise);
       } else if (nodeType === "reaction" && graphElement.data.rxsmiles) {
         const { rxid, rxsmiles, is_predicted } = graphElement.data;
-        let updatedRxsmiles = rxsmiles;
 
-        // Check if RXSMILES has atom mapping
+        // Mapped reactions are normalized, indexed and depicted by a single request
         if (hasAtomMapping(rxsmiles)) {
-          const combinedPromise = normalizeRoles(
-            appSettings.apiUrl,
-            rxsmiles,
-            normalizeRolesEnabled
-          ).then((normalizedRxsmiles) => {
-            updatedRxsmiles = normalizedRxsmiles;
-            graphElement.data.rxsmiles = updatedRxsmiles; // Update RXSMILES in graph data
-
-            return getReactionRdkitSvgByRxsmiles(
-              appSettings.apiUrl,
-              updatedRxsmiles,
-              highlightAtoms,
-              showAtomIndices
-            ).then((svg) => {
-              if (svg) {
-                const svgUrl = `data:image/svg+xml;base64,${svg}`;
+          const combinedPromise = analyzeReaction(appSettings.apiUrl, rxsmiles, {
+            normalize: normalizeRolesEnabled,
+            highlight: highlightAtoms,
+            showAtomIndices,
+          })
+            .then((analysis) => {
+              if (!analysis) {
+                console.error(`Failed to analyze reaction ${rxid}`);
+                return;
+              }
+              graphElement.data.rxsmiles = analysis.depicted_rxsmiles; // Update RXSMILES in graph data
+
+              if (analysis.svg_base64) {
+                const svgUrl = `data:image/svg+xml;base64,${analysis.svg_base64}`;
                 graphElement.data.apiSvg = svgUrl;
                 graphElement.data.type = "custom";
                 const dimensions = getSvgDimensions(svgUrl);
@@ -233,6 +272,15 @@ function App() {
               } else {
                 console.error("Failed to fetch reaction SVG");
               }
+
+              if (analysis.pbi !== null) {
+                graphElement.data.pbi = analysis.pbi;
+                graphElement.data.rbi = analysis.rbi;
+                graphElement.data.tbi = analysis.tbi;
+                addBalanceData(rxid, analysis);
+              } else {
+                console.error(`Failed to fetch balance data for reaction ${rxid}`);
+              }
             })
             .finally(() => {
               setNodeSvgs((prev) => ({
@@ -243,7 +291,6 @@ function App() {
                 }
               }));
             });
-          });
           promises.push(combinedPromise);
         } else {
           const combinedPromise = getReactionRdkitSvgByRxsmiles(
@@ -277,29 +324,19 @@ function App() {
           });
           promises.push(combinedPromise);
         }
-
-        let balanceDataPromise;
-        if (hasAtomMapping(rxsmiles)) {
-          balanceDataPromise = compute_balance(
-            appSettings.apiUrl,
-            rxsmiles
-          ).then((balanceData) => {
-            if (balanceData) {
-              graphElement.data.pbi = balanceData["pbi"];
-              graphElement.data.rbi = balanceData["rbi"];
-              graphElement.data.tbi = balanceData["tbi"];
-              addBalanceData(rxid, balanceData);
-            } else {
-              console.error(
-                `Failed to fetch balance data for reaction ${rxid}`
-              );
-            }
-            promises.push(balanceDataPromise);
-          });
-        }
       }
     });
 
+    // Show the graph right away with the depictions streamed so far, the others are filled in as they are streamed
+    setCytoscapeGraph(
+      mappedGraph.map((graphElement) => {
+        const depiction = streamedSvgsRef.current[graphElement.data.id];
+        return depiction && !graphElement.data.svg
+          ? applyStreamedSvg(graphElement, depiction)
+          : { ...graphElement, data: { ...graphElement.data } };
+      })
+    );
+
     Promise.all(promises)
       .then(() => {
         mappedGraph.forEach((graphElement) => {
@@ -2,6 +2,7 @@ const rxnSmiles2RdkitSvgPath = "rxsmiles2svg";
 const molSmiles2RdkitSvgPath = "molsmiles2svg";
 const apiStatusPath = "status";
 const computeAllBiPath = "compute_all_bi";
+const analyzeReactionPath = "reaction/analyze";
 
 export const hasAtomMapping = (rxsmiles) => {
   // Check if the RXSMILES contains atom mapping by looking for atom map numbers in the format [n]
@@ -164,6 +165,42 @@ export const normalizeRoles = async (
   }
 };
 
+export const analyzeReaction = async (
+  baseUrl,
+  rxsmiles,
+  { normalize, highlight, showAtomIndices = false }
+) => {
+  // Atom mapping flag, normalized roles, balance indices and depiction of a reaction in a single request
+  const url = `${baseUrl.trim()}/${analyzeReactionPath}`;
+
+  try {
+    const response = await fetch(url, {
+      method: "POST",
+      headers: {
+        Accept: "application/json",
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        rxsmiles,
+        depict: true,
+        normalize,
+        highlight,
+        show_atom_indices: showAtomIndices,
+      }),
+    });
+
+    if (!response.ok) {
+      throw new Error(`Error: ${response.status}`);
+    }
+
+    // { depicted_rxsmiles: ..., svg_base64: ..., pbi: ..., rbi: ..., tbi: ..., ... }
+    return await response.json();
+  } catch (error) {
+    console.error("Error analyzing reaction:", error);
+    return null;
+  }
+};
+
 export const compute_balance = async (baseUrl, rxsmiles) => {
   // Ensure rxsmiles is provided
   if (!rxsmiles) {